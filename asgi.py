@@ -0,0 +1,15 @@
+"""
+Asynchronous Server Gateway Interface (ASGI) entry point
+
+Run it with: uvicorn asgi:app
+"""
+
+import os
+from service.async_app import create_app
+
+PORT = int(os.getenv("PORT", "8000"))
+
+app = create_app()
+
+if __name__ == "__main__":
+    app.run(host="0.0.0.0", port=PORT)
@@ -0,0 +1,361 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+REST API Load Benchmark
+
+Seeds shopcarts with items from the test factories and drives a weighted
+mix of the flows of the admin UI (list, search by name, add item, update
+quantity, clear and total price) for a fixed time. The throughput and the
+p50/p95/p99 latencies of every flow are written to a JSON file named after
+the git commit so that runs of different commits can be compared:
+
+    python benchmarks/api_load.py --database-uri sqlite:///benchmark.db --clients 1
+    python benchmarks/api_load.py --shopcarts 500 --items 10 --clients 8 --duration 60
+    python benchmarks/api_load.py --compare benchmarks/results/<commit>.json
+
+The requests go through the Flask test client in this process unless --url
+points at a running service, which must use the same database.
+"""
+
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from urllib.parse import urlsplit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS = os.path.join(ROOT, "benchmarks", "results")
+
+FLOWS = ("list", "search", "add_item", "update_quantity", "clear", "total_price")
+# Relative weights of the flows, roughly what a shopper does in the UI
+DEFAULT_MIX = "list=20,search=15,add_item=20,update_quantity=30,clear=5,total_price=10"
+
+
+######################################################################
+# Transports
+######################################################################
+class TestClientTransport:
+    """Sends the requests to the app in this process"""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def send(self, method: str, path: str, body=None) -> tuple:
+        """Returns the status and the JSON body of a request"""
+        response = self.client.open(path, method=method, json=body)
+        return response.status_code, response.get_json(silent=True)
+
+
+class HTTPTransport:
+    """Sends the requests to a running service over one keep-alive connection"""
+
+    def __init__(self, url: str):
+        self.url = urlsplit(url)
+        self.connection = http.client.HTTPConnection(self.url.hostname, self.url.port or 80)
+
+    def send(self, method: str, path: str, body=None) -> tuple:
+        """Returns the status and the JSON body of a request"""
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        payload = json.dumps(body) if body is not None else None
+        try:
+            self.connection.request(method, path, body=payload, headers=headers)
+            response = self.connection.getresponse()
+            data = response.read()
+        except (OSError, http.client.HTTPException):
+            self.connection.close()
+            raise
+        return response.status, json.loads(data) if data else None
+
+
+######################################################################
+# Workload
+######################################################################
+class Workload:
+    """The seeded shopcarts and the flows that are run against them"""
+
+    def __init__(self, shopcarts: dict, mix: dict):
+        self.names = {shopcart_id: name for shopcart_id, (name, _) in shopcarts.items()}
+        self.items = {shopcart_id: list(items) for shopcart_id, (_, items) in shopcarts.items()}
+        self.ids = list(shopcarts)
+        self.flows = list(mix)
+        self.weights = list(mix.values())
+        self.lock = threading.Lock()
+
+    def run(self, flow: str, transport, rng: random.Random) -> tuple:
+        """Runs one flow and returns its name, status and latency"""
+        shopcart_id = rng.choice(self.ids)
+        with self.lock:
+            item_ids = list(self.items[shopcart_id])
+        if flow == "update_quantity" and not item_ids:
+            flow = "add_item"  # a cleared cart is refilled first
+
+        url = f"/api/shopcarts/{shopcart_id}"
+        requests = {
+            "list": ("GET", "/api/shopcarts?limit=20", None),
+            "search": ("GET", f"/api/shopcarts?name={self.names[shopcart_id]}", None),
+            "add_item": ("POST", f"{url}/items?on_conflict=increment", new_item(shopcart_id, rng)),
+            "clear": ("PUT", f"{url}/clear", None),
+            "total_price": ("GET", f"{url}/calculate_total_price", None),
+        }
+        if flow == "update_quantity":
+            item_id = rng.choice(item_ids)
+            body = {**new_item(shopcart_id, rng), "quantity": rng.randint(1, 10)}
+            requests[flow] = ("PUT", f"{url}/items/{item_id}", body)
+
+        start = time.perf_counter()
+        code, data = transport.send(*requests[flow])
+        latency = time.perf_counter() - start
+
+        with self.lock:
+            if flow == "add_item" and code == 201:
+                self.items[shopcart_id].append(data["id"])
+            elif flow == "clear" and code == 200:
+                self.items[shopcart_id] = []
+        return flow, code, latency
+
+
+def new_item(shopcart_id: int, rng: random.Random) -> dict:
+    """Returns the JSON of an item that a shopper adds"""
+    return {
+        "shopcart_id": shopcart_id,
+        "item_id": str(rng.randint(1, 1000)),
+        "description": "benchmark item",
+        "quantity": rng.randint(1, 5),
+        "price": rng.randint(100, 1000),
+    }
+
+
+def parse_mix(text: str) -> dict:
+    """Parses flow=weight pairs such as 'list=3,clear=1'"""
+    mix = {}
+    for pair in text.split(","):
+        flow, _, weight = pair.partition("=")
+        mix[flow.strip()] = float(weight or 1)
+    unknown = set(mix) - set(FLOWS)
+    if unknown:
+        raise argparse.ArgumentTypeError(f"unknown flows: {', '.join(sorted(unknown))}")
+    return mix
+
+
+######################################################################
+# Seeding
+######################################################################
+def seed(app, count: int, item_count: int, seed_value: int) -> dict:
+    """Creates shopcarts with items from the factories
+
+    Returns:
+        dict: the name and the item ids of every shopcart by its id
+    """
+    # pylint: disable=import-outside-toplevel
+    import factory.random
+    from service.models import db
+    from tests.factories import ShopcartFactory, ItemFactory
+
+    factory.random.reseed_random(seed_value)
+    shopcarts = {}
+    with app.app_context():
+        for start in range(0, count, 100):
+            batch = [
+                ShopcartFactory(
+                    id=None,
+                    items=[ItemFactory(id=None, shopcart=None) for _ in range(item_count)],
+                )
+                for _ in range(min(100, count - start))
+            ]
+            db.session.add_all(batch)
+            db.session.commit()
+            for shopcart in batch:
+                shopcarts[shopcart.id] = (shopcart.name, [item.id for item in shopcart.items])
+        db.session.remove()
+    return shopcarts
+
+
+def remove(app, shopcart_ids: list) -> None:
+    """Deletes the seeded shopcarts and their items"""
+    # pylint: disable=import-outside-toplevel
+    from service.models import db, Shopcart
+
+    with app.app_context():
+        db.session.query(Shopcart).filter(Shopcart.id.in_(shopcart_ids)).delete(synchronize_session=False)
+        db.session.commit()
+        db.session.remove()
+
+
+######################################################################
+# Measurement
+######################################################################
+def client(workload: Workload, transport, rng: random.Random, deadline: float, samples: list) -> None:
+    """Runs random flows until the deadline"""
+    while time.perf_counter() < deadline:
+        flow = rng.choices(workload.flows, workload.weights)[0]
+        try:
+            samples.append(workload.run(flow, transport, rng))
+        except (OSError, http.client.HTTPException):
+            samples.append((flow, None, 0.0))
+
+
+def summarize(samples: list, duration: float) -> dict:
+    """Returns the throughput and the latency percentiles of some samples"""
+    latencies = sorted(latency for _, code, latency in samples if code is not None and code < 400)
+
+    def percentile(fraction: float):
+        if not latencies:
+            return None
+        return round(latencies[int(fraction * (len(latencies) - 1))] * 1000, 2)
+
+    return {
+        "requests": len(samples),
+        "errors": len(samples) - len(latencies),
+        "throughput": round(len(latencies) / duration, 1),
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 2) if latencies else None,
+        "p50_ms": percentile(0.50),
+        "p95_ms": percentile(0.95),
+        "p99_ms": percentile(0.99),
+    }
+
+
+def measure(workload: Workload, transports: list, duration: float, seed_value: int) -> dict:
+    """Runs one client thread per transport and summarizes every flow"""
+    samples = [[] for _ in transports]
+    deadline = time.perf_counter() + duration
+    threads = [
+        threading.Thread(
+            target=client,
+            args=(workload, transport, random.Random(seed_value + number), deadline, samples[number]),
+        )
+        for number, transport in enumerate(transports)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    everything = [sample for client_samples in samples for sample in client_samples]
+    return {
+        "total": summarize(everything, duration),
+        "flows": {
+            flow: summarize([sample for sample in everything if sample[0] == flow], duration)
+            for flow in workload.flows
+        },
+    }
+
+
+######################################################################
+# Results
+######################################################################
+def git(*args) -> str:
+    """Returns the output of a git command or an empty string"""
+    try:
+        return subprocess.run(
+            ["git", *args], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def compare(baseline: dict, results: dict) -> str:
+    """Returns a table of the change of every flow against a baseline"""
+    lines = [f"{'flow':<16}{'throughput':>26}{'p50 ms':>26}{'p95 ms':>26}{'p99 ms':>26}"]
+    names = ["total"] + list(results["flows"])
+    for name in names:
+        old = baseline["total"] if name == "total" else baseline["flows"].get(name)
+        new = results["total"] if name == "total" else results["flows"][name]
+        if not old:
+            continue
+        cells = []
+        for key in ("throughput", "p50_ms", "p95_ms", "p99_ms"):
+            if old[key] and new[key] is not None:
+                cells.append(f"{old[key]} -> {new[key]} ({(new[key] - old[key]) / old[key]:+.0%})")
+            else:
+                cells.append(f"{old[key]} -> {new[key]}")
+        lines.append(f"{name:<16}" + "".join(f"{cell:>26}" for cell in cells))
+    return "\n".join(lines)
+
+
+def main():
+    """Seeds the database, runs the benchmark and stores the results"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-uri", help="database to seed and serve (default $DATABASE_URI)")
+    parser.add_argument("--url", help="a running service to benchmark instead of the app in this process")
+    parser.add_argument("--shopcarts", type=int, default=200)
+    parser.add_argument("--items", type=int, default=5, help="items in every seeded shopcart")
+    parser.add_argument("--clients", type=int, default=4, help="concurrent clients (use 1 on SQLite)")
+    parser.add_argument("--duration", type=float, default=30, help="seconds")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX), help=DEFAULT_MIX)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="JSON file of the results (default benchmarks/results/<commit>.json)")
+    parser.add_argument("--compare", metavar="BASELINE", help="JSON results of an earlier run to compare with")
+    parser.add_argument("--keep", action="store_true", help="do not delete the seeded shopcarts")
+    args = parser.parse_args()
+
+    if args.database_uri:
+        os.environ["DATABASE_URI"] = args.database_uri
+    sys.path.insert(0, ROOT)
+    from wsgi import app  # pylint: disable=import-outside-toplevel
+
+    shopcarts = seed(app, args.shopcarts, args.items, args.seed)
+    try:
+        if args.url:
+            transports = [HTTPTransport(args.url) for _ in range(args.clients)]
+        else:
+            transports = [TestClientTransport(app) for _ in range(args.clients)]
+        measured = measure(Workload(shopcarts, args.mix), transports, args.duration, args.seed)
+    finally:
+        if not args.keep:
+            remove(app, list(shopcarts))
+
+    commit = git("rev-parse", "--short", "HEAD")
+    results = {
+        "commit": commit,
+        "dirty": bool(git("status", "--porcelain", "--untracked-files=no")),
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "database": app.config["SQLALCHEMY_DATABASE_URI"].split(":", 1)[0],
+        "target": args.url or "in-process",
+        "config": {
+            "shopcarts": args.shopcarts,
+            "items": args.items,
+            "clients": args.clients,
+            "duration": args.duration,
+            "mix": args.mix,
+            "seed": args.seed,
+        },
+        **measured,
+    }
+
+    output = args.output or os.path.join(RESULTS, f"{commit or 'results'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as file:
+        json.dump(results, file, indent=2)
+    print(json.dumps(results, indent=2))
+    print(f"Results written to {output}", file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as file:
+            print(compare(json.load(file), results))
+
+
+if __name__ == "__main__":
+    main()
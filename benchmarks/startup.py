@@ -0,0 +1,170 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Startup Time Benchmark
+
+Starts the service in new processes and measures how long each one takes
+until it answers its first request. Every run starts a fresh interpreter
+that imports wsgi.py, which creates the app, and sends a request through
+the test client:
+
+    python benchmarks/startup.py --runs 10
+    python benchmarks/startup.py --budget 1.5
+
+--budget fails the run when the median import of wsgi.py takes longer
+than that many seconds. --gunicorn boots gunicorn with gunicorn.conf.py
+instead and polls it until it answers, which is what a readiness probe
+sees.
+"""
+
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+FIRST_REQUEST = "/api/shopcarts?limit=1"
+
+# Runs in every fresh interpreter and prints its timings as JSON
+PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import wsgi
+imported = time.perf_counter()
+from service.models import db
+with wsgi.app.app_context():
+    pool = db.engine.pool
+    connections = pool.checkedin() + pool.checkedout() if hasattr(pool, "checkedin") else None
+client = wsgi.app.test_client()
+status = client.get(sys.argv[1]).status_code
+served = time.perf_counter()
+client.get("/api/swagger.json")
+documented = time.perf_counter()
+print(json.dumps({
+    "ready": time.time(),
+    "import": imported - started,
+    "first_request": served - imported,
+    "swagger": documented - served,
+    "connections_at_boot": connections,
+    "status": status,
+}))
+"""
+
+
+def probe(env: dict) -> dict:
+    """Starts one interpreter and returns its timings"""
+    launched = time.time()
+    result = subprocess.run(
+        [sys.executable, "-c", PROBE, FIRST_REQUEST],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True,
+    )
+    timings = json.loads(result.stdout.strip().splitlines()[-1])
+    timings["time_to_first_request"] = timings.pop("ready") - launched
+    return timings
+
+
+def free_port() -> int:
+    """Returns a TCP port that nothing listens on"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def boot_gunicorn(env: dict, timeout: float) -> dict:
+    """Starts gunicorn and returns the time until it answers its first request"""
+    port = free_port()
+    launched = time.time()
+    server = subprocess.Popen(  # pylint: disable=consider-using-with
+        ["gunicorn", "--config=gunicorn.conf.py", f"--bind=127.0.0.1:{port}", "wsgi:app"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        while time.time() - launched < timeout:
+            if server.poll() is not None:
+                raise RuntimeError(f"gunicorn exited with {server.returncode}")
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}{FIRST_REQUEST}", timeout=1) as response:
+                    return {"time_to_first_request": time.time() - launched, "status": response.status}
+            except (urllib.error.URLError, ConnectionError):
+                time.sleep(0.01)
+        raise RuntimeError(f"gunicorn did not answer within {timeout} seconds")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def summarize(runs: list) -> dict:
+    """Returns the median and the maximum of every timing"""
+    summary = {}
+    for key, value in runs[0].items():
+        if isinstance(value, float):
+            values = [run[key] for run in runs]
+            summary[key] = {"median": statistics.median(values), "max": max(values)}
+    return summary
+
+
+def main():
+    """Measures the startup of the service and checks the import budget"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-uri", help="database of the service (default $DATABASE_URI)")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget", type=float, help="largest median import time of wsgi.py in seconds")
+    parser.add_argument("--gunicorn", action="store_true", help="boot gunicorn and poll it instead")
+    parser.add_argument("--workers", type=int, default=1, help="gunicorn workers")
+    parser.add_argument("--timeout", type=float, default=30, help="seconds to wait for gunicorn")
+    parser.add_argument("--output", help="JSON file of the results")
+    args = parser.parse_args()
+
+    env = dict(os.environ, PYTHONPATH=ROOT, LOGGING_LEVEL="WARNING")
+    if args.database_uri:
+        env["DATABASE_URI"] = args.database_uri
+    if args.gunicorn:
+        env["GUNICORN_WORKERS"] = str(args.workers)
+        runs = [boot_gunicorn(env, args.timeout) for _ in range(args.runs)]
+    else:
+        runs = [probe(env) for _ in range(args.runs)]
+
+    results = {
+        "target": "gunicorn" if args.gunicorn else "in-process",
+        "runs": args.runs,
+        "statuses": sorted({run["status"] for run in runs}),
+        **summarize(runs),
+    }
+    if not args.gunicorn:
+        results["connections_at_boot"] = max(run["connections_at_boot"] or 0 for run in runs)
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+
+    if args.budget is not None and not args.gunicorn:
+        median = results["import"]["median"]
+        if median > args.budget:
+            print(f"Importing wsgi.py took {median:.3f}s, over the budget of {args.budget}s", file=sys.stderr)
+            sys.exit(1)
+        print(f"Importing wsgi.py took {median:.3f}s, within the budget of {args.budget}s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
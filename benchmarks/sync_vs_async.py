@@ -0,0 +1,136 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Sync versus Async Throughput
+
+Drives the WSGI and the ASGI services with the same number of concurrent
+clients that read random shopcarts and reports the throughput and latency
+of each. Start both services against the same database first:
+
+    gunicorn --bind=0.0.0.0:8000 wsgi:app
+    uvicorn --port 8001 asgi:app
+
+    python benchmarks/sync_vs_async.py --clients 500 --duration 30
+
+The clients send plain GETs of whole shopcarts, which both services answer
+alike. The ASGI service has no batch endpoint, sparse fields, read cache
+or response compression, so those paths of the WSGI service are not part
+of the comparison.
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import time
+import urllib.request
+from urllib.parse import urlsplit
+
+
+def seed(base_url: str, count: int) -> list:
+    """Creates shopcarts with a few items each and returns their ids"""
+    ids = []
+    for number in range(count):
+        items = [
+            {"shopcart_id": 0, "item_id": f"P{line}", "description": "benchmark item", "quantity": 1, "price": 100}
+            for line in range(5)
+        ]
+        body = json.dumps({"name": f"benchmark-{number}", "items": items}).encode()
+        request = urllib.request.Request(
+            f"{base_url}/api/shopcarts", data=body, headers={"Content-Type": "application/json"}
+        )
+        with urllib.request.urlopen(request) as response:
+            ids.append(json.load(response)["id"])
+    return ids
+
+
+async def fetch(reader, writer, host: str, path: str) -> tuple:
+    """Sends one keep-alive GET and returns the status and if the server closes"""
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: {host}\r\n\r\n".encode())
+    await writer.drain()
+    head = (await reader.readuntil(b"\r\n\r\n")).decode("latin-1").split("\r\n")
+    headers = dict(line.lower().split(": ", 1) for line in head[1:] if ": " in line)
+    await reader.readexactly(int(headers.get("content-length", 0)))
+    return int(head[0].split()[1]), headers.get("connection") == "close"
+
+
+async def client(base_url: str, ids: list, deadline: float, latencies: list, errors: list) -> None:
+    """Reads random shopcarts over one connection until the deadline"""
+    url = urlsplit(base_url)
+    connection = None
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            if connection is None:
+                connection = await asyncio.open_connection(url.hostname, url.port or 80)
+            code, closed = await fetch(*connection, url.netloc, f"/api/shopcarts/{random.choice(ids)}")
+        except (OSError, asyncio.IncompleteReadError):
+            errors.append(time.perf_counter() - start)
+            connection = None
+            continue
+        latencies.append(time.perf_counter() - start)
+        if code != 200:
+            errors.append(code)
+        if closed:
+            connection[1].close()
+            connection = None
+    if connection is not None:
+        connection[1].close()
+
+
+async def run(base_url: str, ids: list, clients: int, duration: float) -> dict:
+    """Runs the clients against one service and summarizes the latencies"""
+    latencies, errors = [], []
+    deadline = time.perf_counter() + duration
+    await asyncio.gather(*(client(base_url, ids, deadline, latencies, errors) for _ in range(clients)))
+    latencies.sort()
+
+    def percentile(fraction: float):
+        if not latencies:
+            return None
+        return round(latencies[int(fraction * (len(latencies) - 1))] * 1000, 2)
+
+    return {
+        "url": base_url,
+        "requests": len(latencies),
+        "errors": len(errors),
+        "throughput": round(len(latencies) / duration, 1),
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 2) if latencies else None,
+        "p50_ms": percentile(0.50),
+        "p95_ms": percentile(0.95),
+        "p99_ms": percentile(0.99),
+    }
+
+
+def main():
+    """Benchmarks both services one after the other"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sync-url", default="http://localhost:8000")
+    parser.add_argument("--async-url", default="http://localhost:8001")
+    parser.add_argument("--clients", type=int, default=500)
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--shopcarts", type=int, default=100)
+    args = parser.parse_args()
+
+    ids = seed(args.sync_url, args.shopcarts)
+    results = [asyncio.run(run(url, ids, args.clients, args.duration)) for url in (args.sync_url, args.async_url)]
+    print(json.dumps({"clients": args.clients, "duration": args.duration, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
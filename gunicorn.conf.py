@@ -0,0 +1,150 @@
+"""
+Gunicorn configuration for production
+
+Every setting can be overridden from the environment. The number of workers
+follows the CPUs that the container may use, which is the cgroup CPU quota
+under Kubernetes and the CPU affinity otherwise:
+
+    GUNICORN_WORKERS        number of worker processes (2 x CPUs + 1)
+    GUNICORN_WORKER_CLASS   gthread, gevent or sync (gthread)
+    GUNICORN_THREADS        threads of every gthread worker (4)
+    GUNICORN_CONNECTIONS    greenlets of every gevent worker (100)
+    GUNICORN_PRELOAD        import the app once in the master (true, false for gevent)
+    GUNICORN_MAX_REQUESTS   restart a worker after this many requests (1000, 0 disables)
+    GUNICORN_MAX_REQUESTS_JITTER  random extra requests so workers don't restart together (100)
+    GUNICORN_TIMEOUT        seconds before a silent worker is killed (30)
+    GUNICORN_KEEPALIVE      seconds to wait for the next request on a connection (5)
+    GUNICORN_LOG_LEVEL      log level of gunicorn (info)
+    PROMETHEUS_MULTIPROC_DIR  directory where the workers share their /metrics
+
+gevent is not a dependency of the service and has to be installed to use it.
+QUANTITY_COALESCE_WINDOW above 0 needs GUNICORN_WORKERS=1, because only the
+worker that buffered a quantity can see it before the flush.
+"""
+
+import glob
+import math
+import os
+
+CGROUP_ROOT = "/sys/fs/cgroup"
+
+
+def _read(path: str):
+    """Returns the stripped contents of a file or None if it cannot be read"""
+    try:
+        with open(path, encoding="utf-8") as file:
+            return file.read().strip()
+    except OSError:
+        return None
+
+
+def cgroup_cpu_quota(root: str = CGROUP_ROOT):
+    """Returns the CPU quota of the cgroup in CPUs, or None if there is none"""
+    # cgroup v2: "<quota> <period>" or "max <period>"
+    cpu_max = _read(os.path.join(root, "cpu.max"))
+    if cpu_max:
+        quota, _, period = cpu_max.partition(" ")
+        if quota != "max" and period:
+            return int(quota) / int(period)
+        return None
+    # cgroup v1: a quota of -1 means no limit
+    quota = _read(os.path.join(root, "cpu", "cpu.cfs_quota_us"))
+    period = _read(os.path.join(root, "cpu", "cpu.cfs_period_us"))
+    if quota and period and int(quota) > 0:
+        return int(quota) / int(period)
+    return None
+
+
+def available_cpus(root: str = CGROUP_ROOT) -> int:
+    """Returns the number of CPUs this process may use, at least 1"""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:  # not available on macOS
+        cpus = os.cpu_count() or 1
+    quota = cgroup_cpu_quota(root)
+    if quota is not None:
+        cpus = min(cpus, math.ceil(quota))
+    return max(cpus, 1)
+
+
+def _flag(name: str, default: bool) -> bool:
+    """Returns a boolean setting from the environment"""
+    return os.getenv(name, str(default)).lower() in ("true", "1", "yes")
+
+
+######################################################################
+# Server socket
+######################################################################
+bind = os.getenv("GUNICORN_BIND", f"0.0.0.0:{os.getenv('PORT', '8080')}")
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5"))
+
+######################################################################
+# Worker processes
+######################################################################
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+workers = int(os.getenv("GUNICORN_WORKERS", str(2 * available_cpus() + 1)))
+threads = int(os.getenv("GUNICORN_THREADS", "4"))
+worker_connections = int(os.getenv("GUNICORN_CONNECTIONS", "100"))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "30"))
+graceful_timeout = timeout
+
+# the other workers would read the quantities that one worker holds back
+if int(os.getenv("QUANTITY_COALESCE_WINDOW", "0")) > 0 and workers > 1:
+    raise RuntimeError(f"QUANTITY_COALESCE_WINDOW needs GUNICORN_WORKERS=1, not {workers}")
+
+# Restart the workers now and then to contain memory leaks
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "1000"))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", "100"))
+
+# gevent must patch the standard library before the app is imported
+preload_app = _flag("GUNICORN_PRELOAD", worker_class != "gevent")
+
+# Every thread of a worker may hold a database connection
+if worker_class == "gthread":
+    os.environ.setdefault("DB_POOL_SIZE", str(threads))
+
+
+######################################################################
+# Metrics
+######################################################################
+def reset_metrics_directory() -> None:
+    """Removes the metrics of an earlier run of the server"""
+    directory = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+        for path in glob.glob(os.path.join(directory, "*.db")):
+            os.remove(path)
+
+
+# before the app is preloaded because the master writes metrics too
+reset_metrics_directory()
+
+######################################################################
+# Logging
+######################################################################
+loglevel = os.getenv("GUNICORN_LOG_LEVEL", "info")
+
+
+######################################################################
+# Server hooks
+######################################################################
+def child_exit(_server, worker):
+    """Drops the live gauges of a worker that exited"""
+    # pylint: disable=import-outside-toplevel
+    from service.common.metrics import mark_process_dead
+
+    mark_process_dead(worker.pid)
+
+
+def post_fork(server, worker):
+    """Drops the connections inherited from the master after a fork"""
+    if not server.cfg.preload_app:
+        return
+    # pylint: disable=import-outside-toplevel
+    from service.models import db
+
+    with worker.app.wsgi().app_context():
+        for engine in db.engines.values():
+            # close=False leaves the sockets of the master alone
+            engine.dispose(close=False)
+    worker.log.info("Worker %s disposed of the inherited connection pool", worker.pid)
@@ -22,7 +22,8 @@ import sys
 from flask import Flask
 from flask_restx import Api
 from service import config
-from service.common import log_handlers
+from service.common import compression, fast_json, log_handlers, metrics, query_budget
+from service.common.db_pool import InstrumentedQueuePool
 
 # Will be initialize when app is created
 api = None  # pylint: disable=invalid-name
@@ -36,6 +37,7 @@ def create_app():
     # Create Flask application
     app = Flask(__name__)
     app.config.from_object(config)
+    app.json = fast_json.OrjsonProvider(app)
 
     # Turn off strict slashes because it violates best practices
     app.url_map.strict_slashes = False
@@ -43,8 +45,23 @@ def create_app():
     # Initialize Plugins
     # pylint: disable=import-outside-toplevel
     from service.models import db
+    from service.common import write_coalescing
+    from service.common.cache import cache
+
+    # Count the waits and timeouts of the connection pool
+    engine_options = dict(app.config.get("SQLALCHEMY_ENGINE_OPTIONS", {}))
+    if "pool_size" in engine_options:
+        engine_options.setdefault("poolclass", InstrumentedQueuePool)
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options
 
     db.init_app(app)
+    cache.init(app.config)
+    # the flushes of the buffered quantities are not counted as queries of
+    # the requests that happen to trigger them
+    write_coalescing.init_write_coalescing(app)
+    metrics.init_metrics(app)
+    query_budget.init_query_budget(app)
+    compression.init_compression(app)
 
     ######################################################################
     # Configure Swagger before initializing it
@@ -59,7 +76,9 @@ def create_app():
         default_label="Shopcarts operations",
         doc="/apidocs",
         prefix="/api",
+        authorizations={"bearer": {"type": "apiKey", "in": "header", "name": "Authorization"}},
     )
+    api.representation("application/json")(fast_json.output_json)
 
     with app.app_context():
         # Dependencies require we import the routes AFTER the Flask app is created
@@ -67,12 +86,15 @@ def create_app():
         from service import routes, models  # noqa: F401 E402
         from service.common import error_handlers, cli_commands  # noqa: F401, E402
 
-        try:
-            db.create_all()
-        except Exception as error:  # pylint: disable=broad-except
-            app.logger.critical("%s: Cannot continue", error)
-            # gunicorn requires exit code 4 to stop spawning workers when they die
-            sys.exit(4)
+        # the schema is created by `flask db-init` before the service starts,
+        # so a worker boots without a round trip to the database
+        if app.config["DB_CREATE_TABLES"]:
+            try:
+                db.create_all()
+            except Exception as error:  # pylint: disable=broad-except
+                app.logger.critical("%s: Cannot continue", error)
+                # gunicorn requires exit code 4 to stop spawning workers when they die
+                sys.exit(4)
 
         # Set up logging for production
         log_handlers.init_logging(app, "gunicorn.error")
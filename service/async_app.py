@@ -0,0 +1,67 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Package: service
+This module creates and configures the Quart app that serves the Shopcart
+API over ASGI with async SQLAlchemy on psycopg's async driver
+"""
+from quart import Quart
+from service import config
+from service.common import log_handlers
+from service.common.cache import cache
+from service.models import async_db
+
+
+############################################################
+# Initialize the Quart instance
+############################################################
+def create_app():
+    """Initialize the core ASGI application."""
+    app = Quart(__name__)
+    app.config.from_object(config)
+
+    # Turn off strict slashes because it violates best practices
+    app.url_map.strict_slashes = False
+
+    # The async engine has a pool of its own with the same sizing
+    async_db.init(
+        app.config["SQLALCHEMY_DATABASE_URI"],
+        **app.config.get("SQLALCHEMY_ENGINE_OPTIONS", {}),
+    )
+    # the writes of this app invalidate the entries that the WSGI app reads
+    cache.init(app.config)
+
+    # pylint: disable=import-outside-toplevel
+    from service import async_routes
+
+    app.register_blueprint(async_routes.blueprint)
+
+    @app.teardown_appcontext
+    async def remove_session(_exception):
+        """Closes the session of the request"""
+        await async_db.session.remove()
+
+    @app.after_serving
+    async def dispose_engine():
+        """Closes the connections of the pool on shutdown"""
+        await async_db.dispose()
+
+    # The schema is created by the WSGI service or with flask db-create
+    log_handlers.init_logging(app, "uvicorn.error")
+    app.logger.info("ASGI service initialized!")
+
+    return app
@@ -0,0 +1,364 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Shopcart Service over ASGI
+
+This blueprint serves the /api/shopcarts resources of routes.py with the
+async model methods so that a request waiting on the database does not
+hold up a worker. It answers If-None-Match and If-Match like routes.py;
+it does not serve the batch and import endpoints, sparse fields or the
+search of the Shopcarts by name.
+"""
+
+# pylint: disable=duplicate-code
+
+from quart import Blueprint, request, url_for, abort
+from quart import current_app as app
+from sqlalchemy.orm.exc import StaleDataError
+from werkzeug.exceptions import HTTPException
+from werkzeug.http import quote_etag
+from service.models import Shopcart, Item, DataValidationError
+from service.common import status  # HTTP Status Codes
+from service.common.etags import held_etag, item_etag, shopcart_etag
+
+blueprint = Blueprint("shopcarts_async", __name__)
+
+ITEM_FILTERS = ("quantity", "price", "price_min", "price_max", "quantity_gte")
+
+
+######################################################################
+# GET HEALTH CHECK
+######################################################################
+@blueprint.route("/health")
+async def health_check():
+    """Let them know our heart is still beating"""
+    return {"status": 200, "message": "Healthy"}, 200
+
+
+######################################################################
+#  PATH: /shopcarts
+######################################################################
+@blueprint.route("/api/shopcarts", methods=["GET"])
+async def list_shopcarts():
+    """Returns all of the Shopcarts"""
+    app.logger.info("Request for Shopcart list")
+
+    name = request.args.get("name")
+    limit = min(
+        int_arg("limit", minimum=1) or app.config["DEFAULT_PAGE_SIZE"],
+        app.config["MAX_PAGE_SIZE"],
+    )
+    cursor = int_arg("cursor", minimum=0)
+
+    shopcarts, next_cursor = await Shopcart.paginate_async(
+        Shopcart.select_with_items(name), limit, cursor
+    )
+    results = [shopcart.serialize() for shopcart in shopcarts]
+    app.logger.info("Returning [%d] shopcarts", len(results))
+
+    headers = {}
+    if next_cursor is not None:
+        next_url = url_for(
+            "shopcarts_async.list_shopcarts",
+            name=name,
+            limit=limit,
+            cursor=next_cursor,
+            _external=True,
+        )
+        headers["Link"] = f'<{next_url}>; rel="next"'
+        headers["X-Next-Cursor"] = str(next_cursor)
+
+    return results, status.HTTP_200_OK, headers
+
+
+@blueprint.route("/api/shopcarts", methods=["POST"])
+async def create_shopcarts():
+    """Creates a Shopcart"""
+    app.logger.info("Request to create a Shopcart")
+
+    shopcart = Shopcart()
+    shopcart.deserialize(await request.get_json())
+    await shopcart.create_async()
+
+    app.logger.info("Shopcart id [%s] created!", shopcart.id)
+    location_url = url_for(
+        "shopcarts_async.get_shopcarts", shopcart_id=shopcart.id, _external=True
+    )
+    return shopcart.serialize(), status.HTTP_201_CREATED, {"Location": location_url}
+
+
+######################################################################
+#  PATH: /shopcarts/{id}
+######################################################################
+@blueprint.route("/api/shopcarts/<int:shopcart_id>", methods=["GET"])
+async def get_shopcarts(shopcart_id):
+    """Retrieve a single Shopcart"""
+    app.logger.info("Request to Retrieve a shopcart with id: %s", shopcart_id)
+
+    # answer revalidations from the version alone without loading the items
+    if request.if_none_match:
+        version = await Shopcart.find_version_async(shopcart_id)
+        held = held_etag(request.if_none_match, shopcart_etag(shopcart_id, version), weak=True) if version else None
+        if held:
+            return not_modified(held)
+
+    shopcart = await find_shopcart_or_404(shopcart_id)
+    etag = shopcart_etag(shopcart.id, shopcart.version)
+    return shopcart.serialize(), status.HTTP_200_OK, {"ETag": quote_etag(etag)}
+
+
+@blueprint.route("/api/shopcarts/<int:shopcart_id>", methods=["PUT"])
+async def update_shopcarts(shopcart_id):
+    """Update a Shopcart"""
+    app.logger.info("Request to update shopcart with id: %s", shopcart_id)
+
+    shopcart = await find_shopcart_or_404(shopcart_id)
+    check_if_match(shopcart_etag(shopcart.id, shopcart.version))
+    shopcart.deserialize(await request.get_json())
+    shopcart.id = shopcart_id
+    await shopcart.update_async()
+
+    etag = shopcart_etag(shopcart.id, shopcart.version)
+    return shopcart.serialize(), status.HTTP_200_OK, {"ETag": quote_etag(etag)}
+
+
+@blueprint.route("/api/shopcarts/<int:shopcart_id>", methods=["DELETE"])
+async def delete_shopcarts(shopcart_id):
+    """Delete a Shopcart"""
+    app.logger.info("Request to Delete a shopcart with id: %s", shopcart_id)
+
+    shopcart = await Shopcart.find_async(shopcart_id)
+    check_if_match(shopcart_etag(shopcart.id, shopcart.version) if shopcart else None)
+    if shopcart:
+        await shopcart.delete_async()
+
+    return "", status.HTTP_204_NO_CONTENT
+
+
+######################################################################
+#  ACTIONS => PATH: /shopcarts/{id}/clear and /calculate_total_price
+######################################################################
+@blueprint.route("/api/shopcarts/<int:shopcart_id>/clear", methods=["PUT"])
+async def clear_shopcarts(shopcart_id):
+    """Clear a Shopcart"""
+    app.logger.info("Request to clear shopcart : %s", shopcart_id)
+
+    shopcart = await find_shopcart_or_404(shopcart_id)
+    check_if_match(shopcart_etag(shopcart.id, shopcart.version))
+    await shopcart.clear_async()
+
+    return shopcart.serialize(), status.HTTP_200_OK
+
+
+@blueprint.route("/api/shopcarts/<int:shopcart_id>/calculate_total_price", methods=["GET"])
+async def calculate_total_price(shopcart_id):
+    """Calculate total price of all items in a Shopcart"""
+    app.logger.info("Request to calculate total price for Shopcart %s", shopcart_id)
+
+    total_price = await Shopcart.calculate_total_price_async(shopcart_id)
+    if total_price is None:
+        error(status.HTTP_404_NOT_FOUND, f"No such shopcart: {shopcart_id}.")
+
+    return {"total_price": total_price}, status.HTTP_200_OK
+
+
+######################################################################
+#  PATH: /shopcarts/{id}/items
+######################################################################
+@blueprint.route("/api/shopcarts/<int:shopcart_id>/items", methods=["GET"])
+async def list_items(shopcart_id):
+    """List all items in a Shopcart"""
+    app.logger.info("Request to list items in Shopcart %s", shopcart_id)
+
+    if not await Shopcart.find_async(shopcart_id):
+        error(status.HTTP_404_NOT_FOUND, f"Shopcart with id '{shopcart_id}' was not found.")
+
+    filters = {name: int_arg(name) for name in ITEM_FILTERS}
+    items = await Item.find_by_shopcart_id_async(shopcart_id, **filters)
+
+    return [item.serialize() for item in items], status.HTTP_200_OK
+
+
+@blueprint.route("/api/shopcarts/<int:shopcart_id>/items", methods=["POST"])
+async def create_items(shopcart_id):
+    """Create a Item on a Shopcart"""
+    app.logger.info("Request to create a Item for Shopcart with id: %s", shopcart_id)
+
+    if not await Shopcart.find_async(shopcart_id):
+        error(status.HTTP_404_NOT_FOUND, f"Shopcart with id '{shopcart_id}' could not be found.")
+
+    item = Item()
+    item.deserialize(await request.get_json())
+    item.shopcart_id = shopcart_id
+    line = await Item.upsert_async(item, request.args.get("on_conflict", "error"))
+    if line is None:
+        error(
+            status.HTTP_409_CONFLICT,
+            f"Shopcart '{shopcart_id}' already holds item '{item.item_id}', "
+            "post it with on_conflict=increment or on_conflict=replace.",
+        )
+
+    location_url = url_for(
+        "shopcarts_async.get_items",
+        shopcart_id=shopcart_id,
+        item_id=line.id,
+        _external=True,
+    )
+    return line.serialize(), status.HTTP_201_CREATED, {"Location": location_url}
+
+
+######################################################################
+#  PATH: /shopcarts/{id}/items/{id}
+######################################################################
+@blueprint.route("/api/shopcarts/<int:shopcart_id>/items/<int:item_id>", methods=["GET"])
+async def get_items(shopcart_id, item_id):
+    """Retrieve a Item from Shopcart"""
+    app.logger.info("Request to retrieve Item %s for Shopcart id: %s", item_id, shopcart_id)
+
+    if request.if_none_match:
+        version = await Item.find_version_async(item_id)
+        held = held_etag(request.if_none_match, item_etag(item_id, version), weak=True) if version else None
+        if held:
+            return not_modified(held)
+
+    item = await find_item_or_404(shopcart_id, item_id)
+    return item.serialize(), status.HTTP_200_OK, {"ETag": quote_etag(item_etag(item.id, item.version))}
+
+
+@blueprint.route("/api/shopcarts/<int:shopcart_id>/items/<int:item_id>", methods=["PUT"])
+async def update_items(shopcart_id, item_id):
+    """Update an Item"""
+    app.logger.info("Request to update Item %s for Shopcart id: %s", item_id, shopcart_id)
+
+    item = await find_item_or_404(shopcart_id, item_id)
+    check_if_match(item_etag(item.id, item.version))
+    item.deserialize(await request.get_json())
+    # the body cannot move the Item to another Shopcart
+    item.shopcart_id = shopcart_id
+    await item.update_async()
+
+    return item.serialize(), status.HTTP_200_OK, {"ETag": quote_etag(item_etag(item.id, item.version))}
+
+
+@blueprint.route("/api/shopcarts/<int:shopcart_id>/items/<int:item_id>", methods=["DELETE"])
+async def delete_items(shopcart_id, item_id):
+    """Delete an Item from a Shopcart"""
+    app.logger.info("Request to delete Item %s from Shopcart %s", item_id, shopcart_id)
+
+    if not await Shopcart.find_async(shopcart_id):
+        error(status.HTTP_404_NOT_FOUND, f"Shopcart with id '{shopcart_id}' was not found.")
+
+    item = await Item.find_async(item_id)
+    if item and item.shopcart_id != shopcart_id:
+        item = None
+    check_if_match(item_etag(item.id, item.version) if item else None)
+    if item:
+        await item.delete_async()
+
+    return "", status.HTTP_204_NO_CONTENT
+
+
+######################################################################
+# Error Handlers
+######################################################################
+@blueprint.app_errorhandler(DataValidationError)
+async def request_validation_error(exception):
+    """Handles Value Errors from bad data"""
+    message = str(exception)
+    app.logger.error(message)
+    return {
+        "status_code": status.HTTP_400_BAD_REQUEST,
+        "error": "Bad Request",
+        "message": message,
+    }, status.HTTP_400_BAD_REQUEST
+
+
+@blueprint.app_errorhandler(StaleDataError)
+async def version_conflict(exception):
+    """Handles writes to records that another request changed since they were read"""
+    app.logger.warning(str(exception))
+    return {
+        "status_code": status.HTTP_409_CONFLICT,
+        "error": "Conflict",
+        "message": "The resource was changed by another request, read it again and retry",
+    }, status.HTTP_409_CONFLICT
+
+
+@blueprint.app_errorhandler(HTTPException)
+async def http_error(exception):
+    """Returns the HTTP errors as JSON like flask-restx does"""
+    return {"message": exception.description}, exception.code
+
+
+######################################################################
+#  U T I L I T Y   F U N C T I O N S
+######################################################################
+def error(error_code: int, message: str):
+    """Logs errors before aborting"""
+    app.logger.error(message)
+    abort(error_code, message)
+
+
+def int_arg(name: str, minimum: int = None):
+    """Returns an integer query argument, or None when it is missing"""
+    value = request.args.get(name)
+    if value is None:
+        return None
+    try:
+        number = int(value)
+    except ValueError as exception:
+        raise DataValidationError(f"Invalid {name}: {value!r} is not an integer") from exception
+    if minimum is not None and number < minimum:
+        raise DataValidationError(f"Invalid {name}: must be at least {minimum}")
+    return number
+
+
+async def find_shopcart_or_404(shopcart_id: int) -> Shopcart:
+    """Returns a Shopcart with its items or aborts with 404 Not Found"""
+    shopcart = await Shopcart.find_with_items_async(shopcart_id)
+    if not shopcart:
+        error(status.HTTP_404_NOT_FOUND, f"Shopcart with id {shopcart_id} was not found")
+    return shopcart
+
+
+async def find_item_or_404(shopcart_id: int, item_id: int) -> Item:
+    """Returns an Item of a Shopcart or aborts with 404 Not Found"""
+    item = await Item.find_async(item_id)
+    if not item or item.shopcart_id != shopcart_id:
+        error(status.HTTP_404_NOT_FOUND, f"Item with id '{item_id}' could not be found in Shopcart '{shopcart_id}'.")
+    return item
+
+
+def check_if_match(etag: str = None) -> None:
+    """Aborts with 412 Precondition Failed unless If-Match holds the current entity tag
+
+    Args:
+        etag (str): the entity tag of the resource, or None if it does not exist
+    """
+    if request.if_match and (etag is None or held_etag(request.if_match, etag) is None):
+        error(
+            status.HTTP_412_PRECONDITION_FAILED,
+            "The resource was changed since it was read, read it again and retry",
+        )
+
+
+def not_modified(etag: str):
+    """Returns an empty 304 Not Modified response with the entity tag the client holds"""
+    app.logger.info("Returning 304 Not Modified for %s", etag)
+    response = app.response_class("", status=status.HTTP_304_NOT_MODIFIED)
+    response.set_etag(etag)
+    return response
@@ -0,0 +1,219 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Bulk Import of Shopcarts
+
+This module streams shopcarts and their items from NDJSON or CSV into the
+database in batches. On PostgreSQL every batch is written with COPY. The
+legacy shopcart ids are replaced with new ones and a checkpoint is committed
+with every batch so that an import can be resumed after a crash.
+
+NDJSON has one shopcart per line:
+    {"id": 17, "name": "Ann", "items": [{"item_id": "A1", "description": "pen",
+     "quantity": 2, "price": 150}]}
+
+CSV has one item per row with the rows of a shopcart next to each other and
+an empty item_id for a shopcart without items:
+    id,name,item_id,description,quantity,price
+"""
+
+import csv
+import json
+import logging
+from sqlalchemy import insert, text
+from service.models import db, Shopcart, Item, ImportCheckpoint, DataValidationError, database_error
+
+logger = logging.getLogger("flask.app")
+
+SHOPCART_COLUMNS = ("id", "name")
+ITEM_COLUMNS = ("shopcart_id", "item_id", "description", "quantity", "price")
+
+
+######################################################################
+#  R E A D E R S
+######################################################################
+def read_ndjson(lines):
+    """Yields one shopcart record for every non empty line of NDJSON"""
+    for number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError as error:
+            raise DataValidationError(f"Invalid JSON on line {number}: {error}") from error
+
+
+def read_csv(lines):
+    """Yields one shopcart record for every group of CSV rows with the same id"""
+    record = None
+    for row in csv.DictReader(lines):
+        if record is None or row["id"] != record["id"]:
+            if record is not None:
+                yield record
+            record = {"id": row["id"], "name": row["name"], "items": []}
+        if row.get("item_id"):
+            record["items"].append(row)
+    if record is not None:
+        yield record
+
+
+READERS = {"ndjson": read_ndjson, "csv": read_csv}
+
+
+######################################################################
+#  I M P O R T
+######################################################################
+def import_shopcarts(records, source: str, batch_size: int = 1000, resume: bool = False, progress=None) -> dict:
+    """
+    Imports shopcart records in batches
+
+    Args:
+        records: an iterable of shopcart records
+        source (str): the name under which the progress is checkpointed
+        batch_size (int): the number of shopcarts written per transaction
+        resume (bool): skip the records committed by an earlier run
+        progress: called with the statistics after every batch
+
+    Returns:
+        dict: the number of shopcarts and items imported, the number of
+        records skipped, the records of the source committed so far and the
+        (legacy id, new id) pairs of the last batch
+    """
+    checkpoint = db.session.get(ImportCheckpoint, source)
+    if checkpoint is None:
+        checkpoint = ImportCheckpoint(source=source, records=0)
+    skip = checkpoint.records if resume else 0
+    checkpoint.records = skip
+    logger.info("Importing shopcarts from %s after record %d", source, skip)
+
+    stats = {"shopcarts": 0, "items": 0, "skipped": 0, "id_map": []}
+    batch = []
+    for number, record in enumerate(records, start=1):
+        if number <= skip:
+            stats["skipped"] += 1
+            continue
+        batch.append(record)
+        if len(batch) >= batch_size:
+            _import_batch(batch, checkpoint, stats, progress)
+            batch = []
+    if batch:
+        _import_batch(batch, checkpoint, stats, progress)
+    stats["checkpoint"] = checkpoint.records
+    logger.info("Imported %d shopcarts with %d items", stats["shopcarts"], stats["items"])
+    return stats
+
+
+def _import_batch(batch: list, checkpoint: ImportCheckpoint, stats: dict, progress) -> None:
+    """Writes one batch of records and its checkpoint in one transaction"""
+    first = checkpoint.records + 1
+    try:
+        shopcarts = [_shopcart_row(record, first + offset) for offset, record in enumerate(batch)]
+        connection = db.session.connection()
+        ids = _insert_shopcarts(connection, shopcarts)
+        items = []
+        for shopcart_id, record, row in zip(ids, batch, shopcarts):
+            items.extend(_item_rows(record, shopcart_id, row["line"]))
+        _insert_items(connection, items)
+        checkpoint.records += len(batch)
+        db.session.merge(checkpoint)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logger.error("Error importing the batch starting at record %d", first)
+        raise database_error(e) from e
+
+    stats["shopcarts"] += len(batch)
+    stats["items"] += len(items)
+    stats["id_map"] = [(row["id"], shopcart_id) for row, shopcart_id in zip(shopcarts, ids)]
+    if progress:
+        progress(stats)
+
+
+def _shopcart_row(record, line: int) -> dict:
+    """Validates a shopcart record and returns its row"""
+    try:
+        name = record["name"]
+    except (KeyError, TypeError) as error:
+        raise DataValidationError(f"Invalid Shopcart in record {line}: missing name") from error
+    if not isinstance(name, str) or not name:
+        raise DataValidationError(f"Invalid Shopcart in record {line}: bad name {name!r}")
+    return {"id": record.get("id"), "name": name, "line": line}
+
+
+def _item_rows(record: dict, shopcart_id: int, line: int) -> list:
+    """Validates the items of a shopcart record and returns their rows
+
+    A shopcart holds every product once, so the quantities of repeated
+    products are added up into their first row.
+    """
+    rows = {}
+    try:
+        for item in record.get("items") or []:
+            item_id = str(item["item_id"])
+            quantity = int(item["quantity"])
+            if item_id in rows:
+                rows[item_id][3] += quantity
+                continue
+            rows[item_id] = [shopcart_id, item_id, str(item["description"]), quantity, int(item["price"])]
+    except (KeyError, TypeError, ValueError) as error:
+        raise DataValidationError(f"Invalid Item in record {line}: {error}") from error
+    return [tuple(row) for row in rows.values()]
+
+
+######################################################################
+#  W R I T E R S
+######################################################################
+def _supports_copy(connection) -> bool:
+    """Returns True when the batch can be written with COPY"""
+    return connection.dialect.name == "postgresql"
+
+
+def _insert_shopcarts(connection, shopcarts: list) -> list:
+    """Inserts the shopcarts and returns their new ids in the same order"""
+    table = Shopcart.__table__
+    if not _supports_copy(connection):
+        rows = [{"name": shopcart["name"]} for shopcart in shopcarts]
+        return connection.scalars(insert(table).returning(table.c.id, sort_by_parameter_order=True), rows).all()
+
+    # reserve the ids up front so that the items can reference them
+    ids = connection.scalars(
+        text("SELECT nextval(pg_get_serial_sequence('shopcart', 'id')) FROM generate_series(1, :count)"),
+        {"count": len(shopcarts)},
+    ).all()
+    rows = [(shopcart_id, shopcart["name"]) for shopcart_id, shopcart in zip(ids, shopcarts)]
+    _copy(connection, table.name, SHOPCART_COLUMNS, rows)
+    return ids
+
+
+def _insert_items(connection, items: list) -> None:
+    """Inserts the items of a batch"""
+    if not items:
+        return
+    if not _supports_copy(connection):
+        connection.execute(insert(Item.__table__), [dict(zip(ITEM_COLUMNS, item)) for item in items])
+        return
+    _copy(connection, Item.__table__.name, ITEM_COLUMNS, items)
+
+
+def _copy(connection, table: str, columns: tuple, rows: list) -> None:
+    """Streams rows into a table with COPY on the connection of the session"""
+    driver_connection = connection.connection.driver_connection
+    statement = f"COPY {table} ({', '.join(columns)}) FROM STDIN"
+    with driver_connection.cursor() as cursor:
+        with cursor.copy(statement) as copy:
+            for row in rows:
+                copy.write_row(row)
@@ -0,0 +1,265 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Read Cache
+
+The models keep the Shopcarts that they serialize in `cache`, which both the
+WSGI and the ASGI app set up from CACHE_BACKEND:
+
+    none    no caching, every read goes to the database (the default)
+    lru     the CACHE_MAX_ENTRIES most recently used entries of this process
+    memory  every entry of this process until it expires, for tests
+    redis   shared by all of the processes through the Redis-protocol
+            server at CACHE_URL, which needs the redis package
+
+Entries expire after CACHE_TTL seconds. The models delete the entries of the
+records they change right after every commit, so the reads that follow see
+the change; the lru and memory backends only drop the entries of their own
+process. A read that raced a write can still store the old value after the
+write deleted it, so a Shopcart entry is only served while its version is
+the version in the database; a hit still reads that version and only saves
+loading the items. CACHE_CHECK_VERSION=false skips the check, and such an
+entry is then served until CACHE_TTL. The hits and misses are counted in
+/metrics.
+"""
+
+import logging
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+import orjson
+from prometheus_client import Counter
+
+logger = logging.getLogger("flask.app")
+
+CACHE_HITS = Counter("cache_hits_total", "Number of reads served by the cache", ["backend"])
+CACHE_MISSES = Counter("cache_misses_total", "Number of reads the cache could not serve", ["backend"])
+
+
+######################################################################
+#  B A C K E N D S
+######################################################################
+class CacheBackend(ABC):
+    """Stores bytes by key for a number of seconds"""
+
+    name = ""
+
+    @abstractmethod
+    def get(self, key: str):
+        """Returns the value of a key, or None when it is missing or expired"""
+
+    @abstractmethod
+    def set(self, key: str, value: bytes, ttl: float) -> None:
+        """Stores the value of a key for ttl seconds"""
+
+    @abstractmethod
+    def delete(self, *keys: str) -> None:
+        """Removes some keys"""
+
+
+class NullCache(CacheBackend):
+    """Stores nothing, so every read is a miss"""
+
+    name = "none"
+
+    def get(self, key: str):
+        return None
+
+    def set(self, key: str, value: bytes, ttl: float) -> None:
+        return None
+
+    def delete(self, *keys: str) -> None:
+        return None
+
+
+class MemoryCache(CacheBackend):
+    """Keeps the entries in this process until they expire"""
+
+    name = "memory"
+
+    def __init__(self):
+        self._entries = OrderedDict()  # key -> (expiry, value)
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._used(key)
+            return entry[1]
+
+    def set(self, key: str, value: bytes, ttl: float) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._used(key)
+
+    def delete(self, *keys: str) -> None:
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def _used(self, key: str) -> None:
+        """Called with the lock held whenever an entry is read or written"""
+
+
+class LRUCache(MemoryCache):
+    """Keeps the most recently used entries of this process"""
+
+    name = "lru"
+
+    def __init__(self, max_entries: int):
+        super().__init__()
+        self.max_entries = max_entries
+
+    def _used(self, key: str) -> None:
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+class RedisCache(CacheBackend):
+    """Shares the entries between processes through a Redis-protocol server"""
+
+    name = "redis"
+
+    def __init__(self, url: str, prefix: str = "shopcarts:"):
+        # pylint: disable=import-outside-toplevel
+        import redis
+
+        self.client = redis.Redis.from_url(url, socket_timeout=1)
+        self.prefix = prefix
+
+    def get(self, key: str):
+        return self.client.get(self.prefix + key)
+
+    def set(self, key: str, value: bytes, ttl: float) -> None:
+        self.client.set(self.prefix + key, value, px=max(int(ttl * 1000), 1))
+
+    def delete(self, *keys: str) -> None:
+        if keys:
+            self.client.delete(*(self.prefix + key for key in keys))
+
+
+def make_backend(config) -> CacheBackend:
+    """Returns the backend that CACHE_BACKEND of a configuration names"""
+    name = config["CACHE_BACKEND"]
+    if name == "none":
+        return NullCache()
+    if name == "memory":
+        return MemoryCache()
+    if name == "lru":
+        return LRUCache(config["CACHE_MAX_ENTRIES"])
+    if name == "redis":
+        return RedisCache(config["CACHE_URL"])
+    raise ValueError(f"Unknown CACHE_BACKEND {name!r}: must be none, lru, memory or redis")
+
+
+######################################################################
+#  C A C H E
+######################################################################
+class Cache:
+    """JSON values in a backend, with their TTL and the hit and miss counters
+
+    A backend that fails is treated like a miss, so the reads fall back to
+    the database.
+    """
+
+    def __init__(self):
+        self.backend = NullCache()
+        self.ttl = 0
+
+    def init(self, config) -> None:
+        """Sets the backend and the TTL up from a configuration"""
+        self.backend = make_backend(config)
+        self.ttl = config["CACHE_TTL"]
+
+    @property
+    def enabled(self) -> bool:
+        """Whether there is a backend to read from"""
+        return not isinstance(self.backend, NullCache)
+
+    def get(self, key: str, fresh=None):
+        """Returns the value of a key, or None
+
+        Args:
+            key (str): the key of the entry
+            fresh (callable): tells whether a stored value is still current,
+                a value that is not counts as a miss
+        """
+        if not self.enabled:
+            return None
+        try:
+            value = self.backend.get(key)
+        except Exception as error:  # pylint: disable=broad-except
+            logger.warning("Cannot read %s from the cache: %s", key, error)
+            value = None
+        if value is not None:
+            value = orjson.loads(value)
+            if fresh is not None and not fresh(value):
+                logger.info("Ignoring the stale cache entry %s", key)
+                value = None
+        if value is None:
+            CACHE_MISSES.labels(self.backend.name).inc()
+            return None
+        CACHE_HITS.labels(self.backend.name).inc()
+        return value
+
+    def set(self, key: str, value) -> None:
+        """Stores a value for CACHE_TTL seconds"""
+        if not self.enabled:
+            return
+        try:
+            self.backend.set(key, orjson.dumps(value), self.ttl)
+        except Exception as error:  # pylint: disable=broad-except
+            logger.warning("Cannot write %s to the cache: %s", key, error)
+
+    def fetch(self, key: str, load, fresh=None):
+        """Returns the value of a key, calling load() and storing what it returns on a miss
+
+        A read that loads a value before a write commits may store it after
+        the write invalidated the key, so the value can be older than the
+        record. Pass fresh() to check a stored value against the record, the
+        stale ones are loaded and stored again.
+        """
+        value = self.get(key, fresh)
+        if value is None:
+            value = load()
+            if value is not None:
+                self.set(key, value)
+        return value
+
+    def invalidate(self, *keys: str) -> None:
+        """Deletes the entries of some keys after the records they hold changed"""
+        if not self.enabled or not keys:
+            return
+        try:
+            self.backend.delete(*keys)
+        except Exception as error:  # pylint: disable=broad-except
+            # the entries stay stale until they expire
+            logger.error("Cannot invalidate %s in the cache: %s", ", ".join(keys), error)
+
+
+# The cache of the models, set up by create_app()
+cache = Cache()
@@ -16,8 +16,13 @@
 """
 Flask CLI Command Extensions
 """
+import click
 from flask import current_app as app  # Import Flask application
-from service.models import db
+from service.models import db, Shopcart
+from service.common.bulk_import import READERS, import_shopcarts
+from service.common.db_indexes import describe, missing_indexes, unused_indexes
+from service.common.db_upgrade import upgrade_schema
+from service.common.static_assets import build_assets
 
 
 ######################################################################
@@ -34,3 +39,125 @@ def db_create():
     db.drop_all()
     db.create_all()
     db.session.commit()
+
+
+######################################################################
+# Command to create the tables that do not exist yet
+# Usage:
+#   flask db-init
+######################################################################
+@app.cli.command("db-init")
+def db_init():
+    """
+    Creates the missing tables and upgrades the existing ones without
+    losing their rows. Run it before the service starts, e.g. from an init
+    container.
+    """
+    db.create_all()
+    db.session.commit()
+    for change in upgrade_schema():
+        click.echo(change)
+    click.echo("Database tables are up to date")
+
+
+######################################################################
+# Command to check the stored shopcart totals against their items
+# Usage:
+#   flask db-reconcile-totals [--repair]
+######################################################################
+@app.cli.command("db-reconcile-totals")
+@click.option("--repair", is_flag=True, help="Recompute the drifted totals")
+def db_reconcile_totals(repair):
+    """
+    Reports the shopcarts whose total_price or item_count do not match
+    their items and optionally repairs them
+    """
+    drifted = Shopcart.reconcile_totals(repair=repair)
+    for row in drifted:
+        click.echo(
+            f"shopcart {row['id']}: "
+            f"total_price {row['total_price']} != {row['actual_total_price']}, "
+            f"item_count {row['item_count']} != {row['actual_item_count']}"
+        )
+    if not drifted:
+        click.echo("All shopcart totals are consistent")
+    elif repair:
+        click.echo(f"Repaired {len(drifted)} shopcarts")
+    else:
+        raise click.ClickException(f"{len(drifted)} shopcarts have drifted totals")
+
+
+######################################################################
+# Command to bulk import shopcarts from another system
+# Usage:
+#   flask db-import carts.ndjson [--format csv] [--resume]
+######################################################################
+@app.cli.command("db-import")
+@click.argument("file", type=click.File("r", encoding="utf-8"))
+@click.option("--format", "fmt", type=click.Choice(list(READERS)), help="Defaults to the file extension")
+@click.option("--batch-size", default=1000, show_default=True, help="Shopcarts written per transaction")
+@click.option("--source", help="Name of the checkpoint, defaults to the file name")
+@click.option("--resume", is_flag=True, help="Skip the shopcarts committed by an earlier run")
+@click.option("--id-map", type=click.File("a"), help="Append the legacy_id,id pairs to this file")
+# pylint: disable=too-many-arguments, too-many-positional-arguments
+def db_import(file, fmt, batch_size, source, resume, id_map):
+    """
+    Streams shopcarts and their items from NDJSON or CSV into the database
+    """
+    fmt = fmt or ("csv" if file.name.endswith(".csv") else "ndjson")
+
+    def progress(stats):
+        if id_map:
+            id_map.writelines(f"{legacy_id},{new_id}\n" for legacy_id, new_id in stats["id_map"])
+        click.echo(f"Imported {stats['shopcarts']} shopcarts with {stats['items']} items")
+
+    stats = import_shopcarts(
+        READERS[fmt](file),
+        source or file.name,
+        batch_size=batch_size,
+        resume=resume,
+        progress=progress,
+    )
+    click.echo(f"Done: {stats['shopcarts']} shopcarts imported, {stats['skipped']} skipped")
+
+
+######################################################################
+# Command to report missing and unused indexes
+# Usage:
+#   flask db-index-report [--create]
+######################################################################
+@app.cli.command("db-index-report")
+@click.option("--create", is_flag=True, help="Create the missing indexes")
+def db_index_report(create):
+    """
+    Reports the declared indexes that are missing from the database and
+    the indexes that have never been scanned
+    """
+    missing = missing_indexes()
+    for index in missing:
+        click.echo(f"missing: {index.name} ON {index.table.name} ({describe(index)})")
+        if create:
+            index.create(bind=db.engine, checkfirst=True)
+            click.echo(f"created: {index.name}")
+
+    for index in unused_indexes():
+        click.echo(f"unused: {index['index_name']} ON {index['table_name']} ({index['size']} bytes)")
+
+    if missing and not create:
+        raise click.ClickException(f"{len(missing)} indexes are missing")
+
+
+######################################################################
+# Command to fingerprint and precompress the static files
+# Usage:
+#   flask build-static
+######################################################################
+@app.cli.command("build-static")
+def build_static():
+    """
+    Writes fingerprinted and precompressed copies of the static files to
+    STATIC_BUILD_FOLDER, from where /assets serves them
+    """
+    target = app.config["STATIC_BUILD_FOLDER"]
+    manifest = build_assets(app.static_folder, target, app.config["COMPRESS_MIN_SIZE"])
+    click.echo(f"Built {len(manifest)} static assets in {target}")
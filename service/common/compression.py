@@ -0,0 +1,124 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Response Compression
+
+This module compresses the text responses of the app, such as the JSON of
+the API and the Swagger document, with brotli or gzip, whichever the client
+prefers in its Accept-Encoding header. Brotli is only offered when the
+brotli package is installed. Responses smaller than COMPRESS_MIN_SIZE bytes
+are sent as they are because they would hardly get any smaller. Files sent
+with send_file() stream past the hook; the static assets are compressed
+ahead of time by static_assets.py instead.
+
+A compressed response is a different representation, so its strong ETag
+gets the content coding as a suffix, e.g. "shopcart-1-2-gzip". decode_etag()
+removes the suffix again to compare the tags of If-Match and If-None-Match
+with the version of a resource.
+"""
+
+import gzip
+from flask import current_app, request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Content types that are worth compressing
+COMPRESSIBLE_TYPES = frozenset(
+    {
+        "application/javascript",
+        "application/json",
+        "image/svg+xml",
+        "text/css",
+        "text/html",
+        "text/javascript",
+        "text/plain",
+    }
+)
+
+
+def init_compression(app) -> None:
+    """Installs the hook that compresses the responses of an app"""
+    app.after_request(_compress_response)
+
+
+def available_encodings() -> list:
+    """Returns the content codings that can be produced, the best first"""
+    return ["br", "gzip"] if brotli else ["gzip"]
+
+
+def negotiate(encodings: list = None):
+    """Returns the encoding that the request accepts best, or None for identity
+
+    Args:
+        encodings (list): the encodings to choose from, the best first
+    """
+    if encodings is None:
+        encodings = available_encodings()
+    return request.accept_encodings.best_match(encodings)
+
+
+def encode_etag(etag: str, encoding: str) -> str:
+    """Returns the entity tag of a representation in a content coding"""
+    return f"{etag}-{encoding}"
+
+
+def decode_etag(etag: str) -> str:
+    """Returns the entity tag of the resource that an encoded entity tag names"""
+    for encoding in ("br", "gzip"):
+        if etag.endswith(f"-{encoding}"):
+            return etag[: -len(encoding) - 1]
+    return etag
+
+
+def compress(data: bytes, encoding: str, level: int) -> bytes:
+    """Compresses data with "br" or "gzip" at a level of that encoding"""
+    if encoding == "br":
+        return brotli.compress(data, quality=level)
+    # without a timestamp the same data always compresses to the same bytes
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+def _compressible(response) -> bool:
+    return (
+        response.status_code >= 200
+        and response.status_code not in (204, 304)
+        and not response.direct_passthrough
+        and not response.is_streamed
+        and "Content-Encoding" not in response.headers
+        and response.mimetype in COMPRESSIBLE_TYPES
+    )
+
+
+def _compress_response(response):
+    config = current_app.config
+    if not config["COMPRESS_RESPONSES"] or not _compressible(response):
+        return response
+    response.vary.add("Accept-Encoding")
+    encoding = negotiate()
+    data = response.get_data()
+    if encoding is None or len(data) < config["COMPRESS_MIN_SIZE"]:
+        return response
+    level = config["COMPRESS_BROTLI_QUALITY"] if encoding == "br" else config["COMPRESS_GZIP_LEVEL"]
+    response.set_data(compress(data, encoding, level))
+    response.headers["Content-Encoding"] = encoding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(encode_etag(etag, encoding))
+    return response
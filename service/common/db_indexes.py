@@ -0,0 +1,87 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Database Index Reports
+
+This module compares the indexes declared on the models with the indexes
+of the database and reports the indexes that are never used
+"""
+
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import NoSuchTableError
+from service.models import db
+from service.models.shopcart import trigram_index_created
+
+UNUSED_INDEXES = text(
+    """
+SELECT s.relname AS table_name, s.indexrelname AS index_name,
+       pg_relation_size(s.indexrelid) AS size
+FROM pg_stat_user_indexes AS s
+JOIN pg_index AS i ON i.indexrelid = s.indexrelid
+WHERE s.idx_scan = 0 AND NOT i.indisunique AND NOT i.indisprimary
+ORDER BY size DESC, s.indexrelname
+"""
+)
+
+
+def missing_indexes() -> list:
+    """Returns the indexes declared on the models that the database lacks"""
+    inspector = inspect(db.engine)
+    missing = []
+    with db.engine.connect() as connection:
+        for table in db.metadata.sorted_tables:
+            try:
+                existing = {index["name"] for index in inspector.get_indexes(table.name)}
+            except NoSuchTableError:
+                existing = set()
+            missing.extend(
+                index for index in sorted(table.indexes, key=lambda index: index.name)
+                if index.name not in existing and declared_for(index, connection)
+            )
+    return missing
+
+
+# The indexes that the models only create on some databases, with the
+# function that their ddl_if() calls
+CONDITIONAL_INDEXES = {
+    "ix_shopcart_name_trgm": trigram_index_created,
+}
+
+
+def declared_for(index, connection) -> bool:
+    """Returns False for an index that the models leave out on this database"""
+    condition = CONDITIONAL_INDEXES.get(index.name)
+    return condition is None or condition(connection.dialect, connection)
+
+
+def describe(index) -> str:
+    """Returns the columns or expressions of an index as SQL, e.g. lower(name)"""
+    return ", ".join(
+        # a labeled expression names its operator class, the label is not SQL
+        str(getattr(expression, "element", expression).compile(
+            dialect=db.engine.dialect, compile_kwargs={"include_table": False, "literal_binds": True}
+        ))
+        for expression in index.expressions
+    )
+
+
+def unused_indexes() -> list:
+    """Returns the indexes that were never scanned according to pg_stat_user_indexes"""
+    if db.engine.dialect.name != "postgresql":
+        return []
+    with db.engine.connect() as connection:
+        return [dict(row._mapping) for row in connection.execute(UNUSED_INDEXES)]
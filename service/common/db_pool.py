@@ -0,0 +1,103 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Connection Pool Statistics
+
+This module provides a QueuePool that measures how long requests wait for a
+connection and how often they give up. Together with the connections that
+are checked out and in overflow this tells connection starvation apart from
+slow queries.
+"""
+
+import threading
+import time
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+
+
+class PoolStats:
+    """Thread safe counters of the connection checkouts of a pool"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def record(self, wait: float, timed_out: bool = False) -> None:
+        """Records one checkout that waited for the given number of seconds"""
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.wait_seconds += wait
+            self.max_wait_seconds = max(self.max_wait_seconds, wait)
+
+    def serialize(self) -> dict:
+        """Returns the counters as a dict"""
+        with self._lock:
+            attempts = self.checkouts + self.timeouts
+            return {
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "wait_seconds": round(self.wait_seconds, 6),
+                "max_wait_seconds": round(self.max_wait_seconds, 6),
+                "avg_wait_seconds": round(self.wait_seconds / attempts, 6) if attempts else 0.0,
+            }
+
+
+class InstrumentedQueuePool(QueuePool):
+    """A QueuePool that keeps PoolStats of its checkouts"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            self.stats.record(time.perf_counter() - start, timed_out=True)
+            raise
+        self.stats.record(time.perf_counter() - start)
+        return connection
+
+    def recreate(self):
+        # the counters survive engine.dispose() which recreates the pool
+        pool = super().recreate()
+        pool.stats = self.stats
+        return pool
+
+
+def pool_stats(engine) -> dict:
+    """Returns the state of the connection pool of an engine"""
+    pool = engine.pool
+    stats = {"pool": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        stats.update(
+            size=pool.size(),
+            checked_in=pool.checkedin(),
+            checked_out=pool.checkedout(),
+            overflow=max(pool.overflow(), 0),
+            timeout=pool.timeout(),
+        )
+    if isinstance(pool, InstrumentedQueuePool):
+        stats.update(pool.stats.serialize())
+    return stats
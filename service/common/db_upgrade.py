@@ -0,0 +1,136 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Schema Upgrades
+
+db.create_all() creates the missing tables but never changes the tables that
+exist. upgrade_schema() brings the tables of an existing database up to the
+models: it adds the columns that the models gained, replaces the totals
+function, creates the missing totals triggers, merges the items that hold a
+product twice so the product index can be unique and then recomputes the
+totals of the Shopcarts. Every step looks at the database first, so
+`flask db-init` can run it before every deploy.
+"""
+
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateColumn, CreateIndex
+from service.models import db, Shopcart
+from service.models.totals import POSTGRESQL_FUNCTION, POSTGRESQL_TRIGGERS, SQLITE_TRIGGERS
+
+# The columns that were added to the tables after they were first created
+UPGRADE_COLUMNS = {
+    "shopcart": ("total_price", "item_count", "version"),
+    "item": ("version",),
+}
+
+# The index that makes a product unique in a Shopcart, which the upserts of
+# the items need, and the statements that merge the items of a product into
+# the one created first
+PRODUCT_INDEX = "ix_item_shopcart_id_item_id"
+MERGE_DUPLICATE_ITEMS = (
+    text(
+        """
+UPDATE item SET quantity = (
+    SELECT SUM(d.quantity) FROM item AS d
+    WHERE d.shopcart_id = item.shopcart_id AND d.item_id = item.item_id
+), version = version + 1
+WHERE id IN (SELECT MIN(id) FROM item GROUP BY shopcart_id, item_id HAVING COUNT(*) > 1)
+"""
+    ),
+    text("DELETE FROM item WHERE id NOT IN (SELECT MIN(id) FROM item GROUP BY shopcart_id, item_id)"),
+)
+
+# The totals triggers of each database and the query of the installed ones
+TRIGGERS = {"postgresql": POSTGRESQL_TRIGGERS, "sqlite": SQLITE_TRIGGERS}
+TRIGGER_NAMES = {
+    "postgresql": text("SELECT tgname FROM pg_trigger WHERE tgrelid = 'item'::regclass AND NOT tgisinternal"),
+    "sqlite": text("SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'item'"),
+}
+
+
+def upgrade_schema() -> list:
+    """Upgrades the existing tables to the models
+
+    Returns:
+        list: a description of every change, empty when the tables were up to date
+    """
+    with db.engine.begin() as connection:
+        changes = (
+            add_missing_columns(connection)
+            + install_totals_triggers(connection)
+            + unique_product_index(connection)
+        )
+    if changes:
+        # the new columns start at zero and the totals missed the item
+        # changes made without the triggers or the merged items
+        drifted = Shopcart.reconcile_totals(repair=True)
+        changes.append(f"recomputed the totals of {len(drifted)} shopcarts")
+    return changes
+
+
+def add_missing_columns(connection) -> list:
+    """Adds the columns of UPGRADE_COLUMNS that the tables lack"""
+    inspector = inspect(connection)
+    # another db-init may add the same column meanwhile
+    if_not_exists = "IF NOT EXISTS " if connection.dialect.name == "postgresql" else ""
+    changes = []
+    for table_name, names in UPGRADE_COLUMNS.items():
+        table = db.metadata.tables[table_name]
+        existing = {column["name"] for column in inspector.get_columns(table_name)}
+        for name in names:
+            if name in existing:
+                continue
+            column = CreateColumn(table.c[name]).compile(dialect=connection.dialect)
+            connection.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {if_not_exists}{column}"))
+            changes.append(f"added column {table_name}.{name}")
+    return changes
+
+
+def install_totals_triggers(connection) -> list:
+    """Replaces the totals function and creates the missing totals triggers"""
+    dialect = connection.dialect.name
+    if dialect not in TRIGGERS:
+        return []
+    if dialect == "postgresql":
+        connection.execute(POSTGRESQL_FUNCTION)
+    existing = set(connection.execute(TRIGGER_NAMES[dialect]).scalars())
+    changes = []
+    for name, trigger in TRIGGERS[dialect].items():
+        if name not in existing:
+            connection.execute(trigger)
+            changes.append(f"created trigger {name}")
+    return changes
+
+
+def unique_product_index(connection) -> list:
+    """Merges the items of the same product and rebuilds the product index as unique"""
+    indexes = {index["name"]: index for index in inspect(connection).get_indexes("item")}
+    existing = indexes.get(PRODUCT_INDEX)
+    if existing and existing["unique"]:
+        return []
+    changes = []
+    # the quantities add up in the item that was created first
+    merged = connection.execute(MERGE_DUPLICATE_ITEMS[0]).rowcount
+    if merged:
+        removed = connection.execute(MERGE_DUPLICATE_ITEMS[1]).rowcount
+        changes.append(f"merged {removed} duplicate items into {merged} items")
+    if existing:
+        connection.execute(text(f"DROP INDEX {PRODUCT_INDEX}"))
+    index = next(index for index in db.metadata.tables["item"].indexes if index.name == PRODUCT_INDEX)
+    connection.execute(CreateIndex(index))
+    changes.append(f"created unique index {PRODUCT_INDEX}")
+    return changes
@@ -17,6 +17,8 @@
 Module: error_handlers
 """
 from flask import current_app as app  # Import Flask application
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.orm.exc import StaleDataError
 from service import api
 from service.models import DataValidationError
 from . import status
@@ -35,3 +37,26 @@ def request_validation_error(error):
         "error": "Bad Request",
         "message": message,
     }, status.HTTP_400_BAD_REQUEST
+
+
+@api.errorhandler(StaleDataError)
+def version_conflict(error):
+    """Handles writes to records that another request changed since they were read"""
+    app.logger.warning(str(error))
+    return {
+        "status_code": status.HTTP_409_CONFLICT,
+        "error": "Conflict",
+        "message": "The resource was changed by another request, read it again and retry",
+    }, status.HTTP_409_CONFLICT
+
+
+@api.errorhandler(PoolTimeoutError)
+def pool_timeout(error):
+    """Handles requests that timed out waiting for a database connection"""
+    message = str(error)
+    app.logger.error(message)
+    return {
+        "status_code": status.HTTP_503_SERVICE_UNAVAILABLE,
+        "error": "Service Unavailable",
+        "message": message,
+    }, status.HTTP_503_SERVICE_UNAVAILABLE
@@ -0,0 +1,52 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Entity Tags
+
+The entity tag of a Shopcart or an Item names its id and version, so a
+conditional request is answered from the version alone. Both the WSGI and
+the ASGI routes compare the tags of If-Match and If-None-Match with these.
+"""
+
+from service.common.compression import decode_etag
+
+
+def shopcart_etag(shopcart_id: int, version: int) -> str:
+    """Returns the entity tag of a version of a Shopcart"""
+    return f"shopcart-{shopcart_id}-{version}"
+
+
+def item_etag(item_id: int, version: int) -> str:
+    """Returns the entity tag of a version of an Item"""
+    return f"item-{item_id}-{version}"
+
+
+def held_etag(tags, etag: str, weak: bool = False):
+    """Returns the tag of an If-Match or If-None-Match header that names an
+    entity tag in any content coding, or None
+
+    Args:
+        tags (ETags): the tags of the header
+        etag (str): the entity tag of the resource
+        weak (bool): compare weakly like If-None-Match, not strongly like If-Match
+    """
+    if tags.star_tag:
+        return etag
+    for tag in tags.as_set(include_weak=weak):
+        if decode_etag(tag) == etag:
+            return tag
+    return None
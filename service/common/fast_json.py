@@ -0,0 +1,126 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Fast JSON Responses
+
+This module encodes the responses with orjson. OrjsonProvider is the JSON
+provider of the app and output_json the flask-restx representation.
+compile_model turns a flask-restx model into a function that reads the
+fields of a model object straight into the dict that marshal() would
+return. The resources can then skip serialize() and marshal() and send the
+bytes with json_response, while the models still document them in Swagger.
+"""
+
+import orjson
+from flask import current_app
+from flask.json.provider import DefaultJSONProvider
+from flask_restx import fields
+
+OPTIONS = orjson.OPT_NON_STR_KEYS
+
+
+def dumps(data) -> bytes:
+    """Encodes data as JSON bytes"""
+    return orjson.dumps(data, default=DefaultJSONProvider.default, option=OPTIONS)
+
+
+######################################################################
+# JSON provider and representation
+######################################################################
+class OrjsonProvider(DefaultJSONProvider):
+    """A JSON provider of the app that encodes and decodes with orjson"""
+
+    # the keys keep the order of the models
+    sort_keys = False
+
+    def dumps(self, obj, **kwargs) -> str:
+        """Encodes an object as a JSON string"""
+        return dumps(obj).decode()
+
+    def loads(self, s, **kwargs):
+        """Decodes a JSON string or bytes"""
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        """Returns a JSON response without decoding the bytes first"""
+        data = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps(data), mimetype=self.mimetype)
+
+
+def output_json(data, code, headers=None):
+    """Makes the flask-restx responses, such as the errors, with orjson"""
+    return json_response(data, code, headers)
+
+
+def json_response(data, code: int = 200, headers=None):
+    """Returns a response with data encoded straight to bytes"""
+    return current_app.response_class(dumps(data), code, headers, mimetype="application/json")
+
+
+######################################################################
+# Compiled models
+######################################################################
+def compile_model(model):
+    """Returns a function that converts an object to the dict marshal() makes
+
+    Args:
+        model: a flask-restx model of Integer, Float, Boolean, String, Raw,
+            Nested and List fields
+
+    Raises:
+        TypeError: when the model has a field of another type
+    """
+    # an inherited model holds the fields of its parents in "resolved"
+    model = getattr(model, "resolved", model)
+    getters = tuple((name, _compile_field(name, field)) for name, field in model.items())
+
+    def convert(obj) -> dict:
+        return {name: getter(obj) for name, getter in getters}
+
+    return convert
+
+
+def _compile_field(name: str, field):
+    if isinstance(field, type):
+        field = field()
+    attribute = field.attribute or name
+    if isinstance(field, fields.List):
+        convert = _compile_value(field.container)
+
+        def get_list(obj):
+            values = getattr(obj, attribute, None)
+            return None if values is None else [convert(value) for value in values]
+
+        return get_list
+
+    convert = _compile_value(field)
+    return lambda obj: convert(getattr(obj, attribute, None))
+
+
+def _compile_value(field):
+    if isinstance(field, fields.Nested):
+        return _optional(compile_model(field.nested))
+    for kind, convert in ((fields.Integer, int), (fields.Float, float), (fields.Boolean, bool), (fields.String, str)):
+        if isinstance(field, kind):
+            return _optional(convert)
+    if type(field) is fields.Raw:  # pylint: disable=unidiomatic-typecheck
+        return lambda value: value
+    raise TypeError(f"Cannot compile a {type(field).__name__} field")
+
+
+def _optional(convert):
+    return lambda value: None if value is None else convert(value)
@@ -18,19 +18,136 @@
 Log Handlers
 
 This module contains utility functions to set up logging
-consistently
+consistently. The app and the models log into a queue and a background
+thread writes the records to the handlers of the server, so a request
+never waits on log I/O. The lines are JSON objects or plain text, and the
+INFO lines of only a sample of the requests are kept.
 """
+import atexit
+import copy
 import logging
+import os
+import queue
+import random
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from flask import has_request_context, request
+from service.common.fast_json import dumps
+
+TEXT_FORMAT = "[%(asctime)s] [%(levelname)s] [%(module)s] %(message)s"
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S %z"
+
+# Logger of the models
+MODELS_LOGGER = "flask.app"
+
+# The listeners of this process with the handler that feeds each one
+_listeners = []
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats every record as one JSON object"""
+
+    def format(self, record) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "module": record.module,
+            "message": record.getMessage(),
+        }
+        if getattr(record, "http_method", None):
+            entry["method"] = record.http_method
+            entry["path"] = record.http_path
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return dumps(entry).decode()
+
+
+class LocalQueueHandler(QueueHandler):
+    """Queues the records for a writer thread of the same process
+
+    QueueHandler.prepare() formats the whole record, traceback included, into
+    the message and drops exc_info so that a record can be pickled. A thread
+    needs no pickling, so only the message is merged with its arguments here
+    and the formatter of the writer still sees the exception.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        # the arguments may change once the request goes on
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+class RequestSampler(logging.Filter):
+    """Adds the request to the records and keeps the INFO lines of a sample of the requests
+
+    The decision is made once per request, so a sampled request logs all of
+    its lines. Warnings, errors and records outside of requests always pass.
+    """
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record) -> bool:
+        if not has_request_context():
+            return True
+        record.http_method = request.method
+        record.http_path = request.path
+        if record.levelno >= logging.WARNING or self.rate >= 1:
+            return True
+        return request.environ.setdefault("service.log_sampled", random.random() < self.rate)
 
 
 def init_logging(app, logger_name: str):
     """Set up logging for production"""
-    app.logger.propagate = False
-    gunicorn_logger = logging.getLogger(logger_name)
-    app.logger.handlers = gunicorn_logger.handlers
-    app.logger.setLevel(gunicorn_logger.level)
+    server_logger = logging.getLogger(logger_name)
+    handlers = list(server_logger.handlers)
     # Make all log formats consistent
-    formatter = logging.Formatter("[%(asctime)s] [%(levelname)s] [%(module)s] %(message)s", "%Y-%m-%d %H:%M:%S %z")
-    for handler in app.logger.handlers:
+    if app.config.get("LOG_FORMAT", "json") == "json":
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter(TEXT_FORMAT, DATE_FORMAT)
+    for handler in handlers:
         handler.setFormatter(formatter)
+
+    if handlers:
+        queue_handler = start_queue(handlers)
+        queue_handler.addFilter(RequestSampler(app.config.get("LOG_SAMPLE_RATE", 1.0)))
+        handlers = [queue_handler]
+
+    for logger in (app.logger, logging.getLogger(MODELS_LOGGER)):
+        logger.propagate = False
+        logger.handlers = handlers
+        logger.setLevel(app.config.get("LOGGING_LEVEL", server_logger.level))
     app.logger.info("Logging handler established")
+
+
+def start_queue(handlers: list) -> QueueHandler:
+    """Starts a thread that writes the records of the returned handler to some handlers"""
+    records = queue.SimpleQueue()
+    listener = QueueListener(records, *handlers, respect_handler_level=True)
+    listener.start()
+    # write out the queued records when the process exits
+    atexit.register(listener.stop)
+    queue_handler = LocalQueueHandler(records)
+    _listeners.append((listener, queue_handler))
+    return queue_handler
+
+
+def _restart_listeners() -> None:
+    """Gives a forked worker new queues and writer threads of its own"""
+    for index, (listener, queue_handler) in enumerate(_listeners):
+        # the thread of the parent does not exist here
+        atexit.unregister(listener.stop)
+        records = queue.SimpleQueue()
+        queue_handler.queue = records
+        listener = QueueListener(records, *listener.handlers, respect_handler_level=listener.respect_handler_level)
+        listener.start()
+        atexit.register(listener.stop)
+        _listeners[index] = (listener, queue_handler)
+
+
+os.register_at_fork(after_in_child=_restart_listeners)
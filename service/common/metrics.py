@@ -0,0 +1,153 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Prometheus Metrics
+
+This module counts the requests by route, method and status, measures their
+latency and the database queries they issue, and renders everything in the
+Prometheus text format. When PROMETHEUS_MULTIPROC_DIR is set the metrics of
+all of the gunicorn workers are written there and aggregated on every scrape.
+"""
+
+import os
+import time
+from flask import g, has_request_context, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# prometheus_client writes the files of this process to the directory as soon
+# as the metrics below are created, and only gunicorn.conf.py creates it
+if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+    os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"], exist_ok=True)
+
+# Buckets of the per request database query counts
+QUERY_COUNT_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100, 250, float("inf"))
+
+REQUESTS = Counter(
+    "http_requests_total",
+    "Number of HTTP requests",
+    ["method", "route", "status"],
+)
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "Latency of the HTTP requests",
+    ["method", "route"],
+)
+REQUESTS_IN_PROGRESS = Gauge(
+    "http_requests_in_progress",
+    "Number of HTTP requests being served",
+    ["method", "route"],
+    multiprocess_mode="livesum",
+)
+REQUEST_QUERIES = Histogram(
+    "http_request_db_queries",
+    "Number of database queries issued by an HTTP request",
+    ["method", "route"],
+    buckets=QUERY_COUNT_BUCKETS,
+)
+REQUEST_QUERY_TIME = Histogram(
+    "http_request_db_duration_seconds",
+    "Time an HTTP request spent in database queries",
+    ["method", "route"],
+)
+QUERIES = Counter("db_queries_total", "Number of database queries")
+QUERY_LATENCY = Histogram("db_query_duration_seconds", "Latency of the database queries")
+
+
+######################################################################
+# Request hooks
+######################################################################
+def init_metrics(app) -> None:
+    """Installs the hooks that measure the requests of an app"""
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.teardown_request(_end_request)
+
+
+def _route() -> str:
+    """Returns the URL rule of the request so that ids don't become labels"""
+    return request.url_rule.rule if request.url_rule else "unmatched"
+
+
+def _start_request() -> None:
+    g.metrics_route = _route()
+    g.metrics_start = time.perf_counter()
+    g.db_queries = 0
+    g.db_seconds = 0.0
+    REQUESTS_IN_PROGRESS.labels(request.method, g.metrics_route).inc()
+
+
+def _finish_request(response):
+    if "metrics_start" not in g:
+        return response
+    labels = (request.method, g.metrics_route)
+    REQUESTS.labels(*labels, str(response.status_code)).inc()
+    REQUEST_LATENCY.labels(*labels).observe(time.perf_counter() - g.metrics_start)
+    REQUEST_QUERIES.labels(*labels).observe(g.db_queries)
+    REQUEST_QUERY_TIME.labels(*labels).observe(g.db_seconds)
+    return response
+
+
+def _end_request(_exception) -> None:
+    if "metrics_route" in g:
+        REQUESTS_IN_PROGRESS.labels(request.method, g.metrics_route).dec()
+
+
+######################################################################
+# Database hooks
+######################################################################
+@event.listens_for(Engine, "before_cursor_execute")
+def _start_query(_conn, _cursor, _statement, _parameters, context, _executemany):
+    context.metrics_start = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _end_query(_conn, _cursor, _statement, _parameters, context, _executemany):
+    elapsed = time.perf_counter() - context.metrics_start
+    QUERIES.inc()
+    QUERY_LATENCY.observe(elapsed)
+    if has_request_context() and "db_queries" in g:
+        g.db_queries += 1
+        g.db_seconds += elapsed
+
+
+######################################################################
+# Exposition
+######################################################################
+def render_metrics() -> tuple:
+    """Returns the metrics of all of the workers in the Prometheus text format"""
+    registry = REGISTRY
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def mark_process_dead(pid: int) -> None:
+    """Removes the live gauges of a worker that exited"""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        multiprocess.mark_process_dead(pid)
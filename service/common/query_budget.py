@@ -0,0 +1,105 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+SQL Statement Budgets
+
+In debug or test mode every request records the SQL statements it sends.
+Resources declare how many statements they may use with @query_budget and
+requests that repeat an identical statement SQL_REPEAT_THRESHOLD times are
+flagged as N+1 patterns. Depending on SQL_BUDGET_ACTION a violation is
+logged as a warning or raises QueryBudgetExceeded.
+"""
+
+from collections import Counter
+from functools import wraps
+from flask import current_app, g, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+class QueryBudgetExceeded(Exception):
+    """Used when a request sends more SQL statements than it should"""
+
+
+def init_query_budget(app) -> None:
+    """Installs the hooks that record the statements of every request"""
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+
+
+def _enabled() -> bool:
+    return current_app.debug or current_app.testing
+
+
+def _start_request() -> None:
+    # g outlives the request when an app context was already pushed
+    g.sql_statements = [] if _enabled() else None
+
+
+def _finish_request(response):
+    statements = g.get("sql_statements")
+    if statements is None:
+        return response
+    response.headers["X-SQL-Queries"] = str(len(statements))
+    threshold = current_app.config["SQL_REPEAT_THRESHOLD"]
+    for statement, count in Counter(statements).most_common():
+        if count < threshold:
+            break
+        violation(f"N+1 pattern: the same statement ran {count} times: {statement}")
+    return response
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _record_statement(_conn, _cursor, statement, _parameters, _context, _executemany):
+    if has_request_context() and g.get("sql_statements") is not None:
+        g.sql_statements.append(statement)
+
+
+def violation(message: str) -> None:
+    """Logs or raises a violation of a budget according to SQL_BUDGET_ACTION"""
+    if current_app.config["SQL_BUDGET_ACTION"] == "raise":
+        raise QueryBudgetExceeded(message)
+    current_app.logger.warning(message)
+
+
+######################################################################
+# Decorator
+######################################################################
+def query_budget(limit: int):
+    """Declares the largest number of SQL statements a resource method may send
+
+    Args:
+        limit (int): the number of statements, serialization included
+    """
+
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            statements = g.get("sql_statements")
+            if statements is None:
+                return function(*args, **kwargs)
+            start = len(statements)
+            result = function(*args, **kwargs)
+            used = len(statements) - start
+            if used > limit:
+                violation(f"{function.__qualname__} sent {used} SQL statements, its budget is {limit}")
+            return result
+
+        wrapper.query_budget = limit
+        return wrapper
+
+    return decorator
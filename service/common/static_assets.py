@@ -0,0 +1,143 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Static Assets
+
+`flask build-static` copies the static files into STATIC_BUILD_FOLDER under
+fingerprinted names such as js/rest_api.1a2b3c4d5e6f.js, writes .br and .gz
+copies next to the text files at the highest compression levels and records
+the names in manifest.json. The built index.html links the fingerprinted
+files. Because the name of an asset changes with its content, /assets serves
+them with an immutable Cache-Control header for a year, picking the
+precompressed copy that the client accepts.
+"""
+
+import hashlib
+import json
+import mimetypes
+import os
+from flask import abort, send_from_directory
+from werkzeug.security import safe_join
+from .compression import COMPRESSIBLE_TYPES, available_encodings, compress, negotiate
+
+INDEX = "index.html"
+MANIFEST = "manifest.json"
+
+# Extensions of the precompressed copies, the preferred encoding first
+SUFFIXES = {"br": ".br", "gzip": ".gz"}
+
+# Levels of the precompressed copies, which are only compressed once
+BUILD_LEVELS = {"br": 11, "gzip": 9}
+
+# Seconds that clients may keep a fingerprinted asset
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+
+def fingerprinted(name: str, data: bytes) -> str:
+    """Returns the name of a file with a hash of its content in it"""
+    root, extension = os.path.splitext(name)
+    return f"{root}.{hashlib.sha256(data).hexdigest()[:12]}{extension}"
+
+
+def build_assets(source: str, target: str, min_size: int = 0) -> dict:
+    """Writes fingerprinted and precompressed copies of the static files
+
+    Args:
+        source (str): the folder of the static files
+        target (str): the folder to write the assets to
+        min_size (int): the smallest file in bytes that is precompressed
+
+    Returns:
+        dict: the fingerprinted name of every static file by its name
+    """
+    manifest = {}
+    for folder, _, files in os.walk(source):
+        for file in sorted(files):
+            path = os.path.join(folder, file)
+            name = os.path.relpath(path, source).replace(os.sep, "/")
+            if name == INDEX:
+                continue
+            with open(path, "rb") as asset:
+                data = asset.read()
+            manifest[name] = fingerprinted(name, data)
+            write_asset(target, manifest[name], data, min_size)
+
+    # index.html keeps its name so that it can link the new files
+    if os.path.isfile(os.path.join(source, INDEX)):
+        with open(os.path.join(source, INDEX), encoding="utf-8") as index:
+            html = index.read()
+        for name, asset_name in manifest.items():
+            html = html.replace(f"static/{name}", f"assets/{asset_name}")
+        write_asset(target, INDEX, html.encode("utf-8"), min_size)
+
+    with open(os.path.join(target, MANIFEST), "w", encoding="utf-8") as file:
+        json.dump(manifest, file, indent=2, sort_keys=True)
+    return manifest
+
+
+def write_asset(target: str, name: str, data: bytes, min_size: int = 0) -> None:
+    """Writes a file and, if it is text, its compressed copies"""
+    path = os.path.join(target, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as asset:
+        asset.write(data)
+    if len(data) < min_size or mimetypes.guess_type(name)[0] not in COMPRESSIBLE_TYPES:
+        return
+    for encoding in available_encodings():
+        compressed = compress(data, encoding, BUILD_LEVELS[encoding])
+        if len(compressed) < len(data):
+            with open(path + SUFFIXES[encoding], "wb") as asset:
+                asset.write(compressed)
+
+
+def send_asset(folder: str, name: str):
+    """Returns a fingerprinted asset that clients may cache for good"""
+    if name in (INDEX, MANIFEST):
+        abort(404)
+    response = _send(folder, name, IMMUTABLE_MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+def send_index(folder: str):
+    """Returns the built index.html, or None when build-static has not run"""
+    if not os.path.isfile(os.path.join(folder, INDEX)):
+        return None
+    # the name stays the same, so every use has to revalidate it
+    response = _send(folder, INDEX, 0)
+    response.cache_control.no_cache = True
+    return response
+
+
+def _send(folder: str, name: str, max_age: int):
+    path = safe_join(folder, name)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    encodings = [encoding for encoding, suffix in SUFFIXES.items() if os.path.isfile(path + suffix)]
+    encoding = negotiate(encodings)
+    response = send_from_directory(
+        folder,
+        name + SUFFIXES[encoding] if encoding else name,
+        mimetype=mimetypes.guess_type(name)[0] or "application/octet-stream",
+        max_age=max_age,
+    )
+    if encoding:
+        response.headers["Content-Encoding"] = encoding
+    if encodings:
+        response.vary.add("Accept-Encoding")
+    return response
@@ -0,0 +1,188 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Write Coalescing
+
+With QUANTITY_COALESCE_WINDOW above zero, a PUT of an Item that only changes
+its quantity is not written right away. QuantityBuffer keeps the latest
+quantity of every such Item and a background thread writes all of them every
+window with one executemany UPDATE, so a burst of +/- clicks costs a single
+write per Item.
+
+Before any other request on a Shopcart the pending quantities of that
+Shopcart are flushed, and before a list of Shopcarts all of them, so the
+requests served by this process read the writes it acknowledged. Other
+processes would only see a quantity once it is flushed, so gunicorn.conf.py
+refuses to start several workers with coalescing on. A buffered PUT is
+answered with 202 Accepted and without an ETag. The buffer also flushes when
+it holds QUANTITY_COALESCE_MAX_PENDING Items and when the process exits,
+which is how gunicorn stops a worker gracefully.
+
+A quantity is only in memory until its flush: a process that is killed
+(SIGKILL, the OOM killer) or a database that stays unreachable loses the
+quantities accepted in the last window.
+"""
+
+import atexit
+import logging
+import os
+import threading
+from flask import current_app, request
+from sqlalchemy import bindparam, update
+from service.models import db, Item
+from service.models.persistent_base import cache_key
+from .cache import cache
+
+logger = logging.getLogger("flask.app")
+
+EXTENSION = "quantity_buffer"
+
+# The background thread never waits less than this many seconds
+MIN_INTERVAL = 0.01
+
+
+def init_write_coalescing(app) -> None:
+    """Gives an app a QuantityBuffer and flushes it before the requests that read it"""
+    app.extensions[EXTENSION] = QuantityBuffer(app)
+    app.before_request(_flush_before_request)
+
+
+def quantity_buffer() -> "QuantityBuffer":
+    """Returns the QuantityBuffer of the current app"""
+    return current_app.extensions[EXTENSION]
+
+
+def _flush_before_request() -> None:
+    buffer = quantity_buffer()
+    view_args = request.view_args or {}
+    # an update of an Item decides itself whether to flush
+    if not buffer or (request.method == "PUT" and "item_id" in view_args):
+        return
+    if "shopcart_id" in view_args:
+        flushed = buffer.flush(view_args["shopcart_id"])
+    elif request.path.startswith("/api/"):
+        flushed = buffer.flush()
+    else:
+        return
+    if flushed:
+        # the objects that the session still holds are older than the flush
+        db.session.expire_all()
+
+
+######################################################################
+#  Q U A N T I T Y   B U F F E R
+######################################################################
+class QuantityBuffer:
+    """The latest unwritten quantity of every Item, flushed in batches"""
+
+    def __init__(self, app):
+        self.app = app
+        self._pending = {}  # Item id -> (Shopcart id, quantity)
+        self._lock = threading.Lock()
+        # one flush at a time, so that an older batch never lands after a newer one
+        self._flushing = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    @property
+    def enabled(self) -> bool:
+        """Whether quantity updates are coalesced"""
+        return self.app.config["QUANTITY_COALESCE_WINDOW"] > 0
+
+    def put(self, shopcart_id: int, item_id: int, quantity: int) -> None:
+        """Keeps the quantity of an Item until the next flush"""
+        with self._lock:
+            self._pending[item_id] = (shopcart_id, quantity)
+            pending = len(self._pending)
+            if self._thread is None:
+                self._start()
+        if pending >= self.app.config["QUANTITY_COALESCE_MAX_PENDING"]:
+            self.flush()
+
+    def flush(self, shopcart_id: int = None) -> int:
+        """Writes the pending quantities, of one Shopcart or of all of them
+
+        Returns:
+            int: the number of Items that were written
+        """
+        with self._flushing:
+            with self._lock:
+                batch = {
+                    item_id: entry
+                    for item_id, entry in self._pending.items()
+                    if shopcart_id is None or entry[0] == shopcart_id
+                }
+            if not batch:
+                return 0
+            try:
+                self._write(batch)
+            except Exception as error:  # pylint: disable=broad-except
+                # the quantities stay pending for the next flush
+                logger.error("Error writing %d pending quantities: %s", len(batch), error)
+                return 0
+            # until now a read had to wait for this flush, and a quantity
+            # that came in meanwhile stays pending
+            with self._lock:
+                for item_id, entry in batch.items():
+                    if self._pending.get(item_id) == entry:
+                        del self._pending[item_id]
+        logger.info("Flushed the quantities of %d items", len(batch))
+        return len(batch)
+
+    def close(self) -> None:
+        """Stops the background thread and writes what is left"""
+        self._stopped.set()
+        self.flush()
+
+    def _write(self, batch: dict) -> None:
+        table = Item.__table__
+        statement = (
+            update(table)
+            .where(table.c.id == bindparam("item_pk"), table.c.shopcart_id == bindparam("cart_pk"))
+            .values(quantity=bindparam("new_quantity"), version=table.c.version + 1)
+        )
+        rows = [
+            {"item_pk": item_id, "cart_pk": shopcart_id, "new_quantity": quantity}
+            for item_id, (shopcart_id, quantity) in batch.items()
+        ]
+        with self.app.app_context(), db.engine.begin() as connection:
+            connection.execute(statement, rows)
+        cache.invalidate(*{cache_key("shopcart", shopcart_id) for shopcart_id, _ in batch.values()})
+
+    def _start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="quantity-buffer", daemon=True)
+        self._thread.start()
+        # registered after the log writer, so it runs before the writer stops
+        atexit.register(self.close)
+
+    def _run(self) -> None:
+        while True:
+            window = self.app.config["QUANTITY_COALESCE_WINDOW"] / 1000
+            if self._stopped.wait(max(window, MIN_INTERVAL)):
+                return
+            self.flush()
+
+    def _after_fork(self) -> None:
+        # a forked worker starts empty and without the thread of its parent
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flushing = threading.Lock()
+        self._thread = None
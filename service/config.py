@@ -2,7 +2,6 @@
 Global Configuration for Application
 """
 import os
-import logging
 
 # Get configuration from environment
 DATABASE_URI = os.getenv(
@@ -13,8 +12,85 @@ DATABASE_URI = os.getenv(
 # Configure SQLAlchemy
 SQLALCHEMY_DATABASE_URI = DATABASE_URI
 SQLALCHEMY_TRACK_MODIFICATIONS = False
-# SQLALCHEMY_POOL_SIZE = 2
+
+# Connection pool of the engine, sized to the workers and threads of the server
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("true", "1", "yes")
+# Longest a statement may run in milliseconds, 0 means no limit
+DB_STATEMENT_TIMEOUT = int(os.getenv("DB_STATEMENT_TIMEOUT", "0"))
+
+SQLALCHEMY_ENGINE_OPTIONS = {
+    "pool_size": DB_POOL_SIZE,
+    "max_overflow": DB_MAX_OVERFLOW,
+    "pool_timeout": DB_POOL_TIMEOUT,
+    "pool_recycle": DB_POOL_RECYCLE,
+    "pool_pre_ping": DB_POOL_PRE_PING,
+    "connect_args": {"options": f"-c statement_timeout={DB_STATEMENT_TIMEOUT}"},
+} if DATABASE_URI.startswith("postgresql") else {}
+
+# Create the missing tables when the app starts. Off by default so that a
+# worker boots without waiting on the database, run `flask db-init` instead
+DB_CREATE_TABLES = os.getenv("DB_CREATE_TABLES", "false").lower() in ("true", "1", "yes")
+
+# Loading strategy of the Shopcart items on read paths: selectin, joined or lazy
+SHOPCART_ITEMS_LOADING = os.getenv("SHOPCART_ITEMS_LOADING", "selectin")
+
+# Pagination of collection endpoints
+DEFAULT_PAGE_SIZE = int(os.getenv("DEFAULT_PAGE_SIZE", "100"))
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "1000"))
+
+# Largest number of items accepted by one batch request
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "500"))
+
+# Bearer token of the /api/admin endpoints, which are disabled without one
+ADMIN_API_TOKEN = os.getenv("ADMIN_API_TOKEN", "")
+
+# Milliseconds that the PUTs which only change the quantity of an Item are
+# coalesced before one UPDATE writes them, 0 writes every PUT at once
+QUANTITY_COALESCE_WINDOW = int(os.getenv("QUANTITY_COALESCE_WINDOW", "0"))
+# Pending quantities that make the buffer flush before the window is over
+QUANTITY_COALESCE_MAX_PENDING = int(os.getenv("QUANTITY_COALESCE_MAX_PENDING", "1000"))
+
+# Read cache of the serialized Shopcarts: "none", "lru" or "memory" in this
+# process, or "redis" shared through the server at CACHE_URL
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "none")
+CACHE_URL = os.getenv("CACHE_URL", "redis://localhost:6379/0")
+# Seconds that an entry is kept, which bounds how stale another process can be
+CACHE_TTL = float(os.getenv("CACHE_TTL", "60"))
+# Entries that the lru backend keeps
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "10000"))
+# Compare the version of a cached Shopcart with the database on every hit,
+# one primary key lookup; without it a hit sends no query but an entry that
+# a read stored while a write committed is served until CACHE_TTL
+CACHE_CHECK_VERSION = os.getenv("CACHE_CHECK_VERSION", "true").lower() in ("true", "1", "yes")
+
+# SQL statement budgets of the resources, checked when DEBUG or TESTING is on:
+# "log" a warning or "raise" QueryBudgetExceeded when a request exceeds them
+SQL_BUDGET_ACTION = os.getenv("SQL_BUDGET_ACTION", "log")
+# Identical statements in one request that are reported as an N+1 pattern
+SQL_REPEAT_THRESHOLD = int(os.getenv("SQL_REPEAT_THRESHOLD", "5"))
+
+# Text responses of at least COMPRESS_MIN_SIZE bytes are compressed with
+# brotli or gzip, whichever the client accepts, at these levels
+COMPRESS_RESPONSES = os.getenv("COMPRESS_RESPONSES", "true").lower() in ("true", "1", "yes")
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", "1024"))
+COMPRESS_GZIP_LEVEL = int(os.getenv("COMPRESS_GZIP_LEVEL", "6"))
+COMPRESS_BROTLI_QUALITY = int(os.getenv("COMPRESS_BROTLI_QUALITY", "4"))
+
+# Fingerprinted and precompressed static files written by `flask build-static`
+STATIC_BUILD_FOLDER = os.getenv(
+    "STATIC_BUILD_FOLDER", os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets")
+)
 
 # Secret for session management
 SECRET_KEY = os.getenv("SECRET_KEY", "sup3r-s3cr3t")
-LOGGING_LEVEL = logging.INFO
+
+# Logging: the level, "json" or "text" lines, the share of the requests whose
+# INFO lines are kept and whether request bodies are logged
+LOGGING_LEVEL = os.getenv("LOGGING_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.1"))
+LOG_PAYLOADS = os.getenv("LOG_PAYLOADS", "false").lower() in ("true", "1", "yes")
@@ -4,6 +4,9 @@ Models for ShopCart
 All of the models are stored in this package
 """
 
-from .persistent_base import db, DataValidationError
+from .persistent_base import db, DataValidationError, database_error
+from .async_session import async_db
 from .shopcart import Shopcart
 from .item import Item
+from .import_checkpoint import ImportCheckpoint
+from . import totals
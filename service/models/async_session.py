@@ -0,0 +1,38 @@
+"""
+Asynchronous database access for the ASGI service
+
+The models are shared with the WSGI service. Only the engine and the
+session differ: the engine runs on psycopg's async driver and every asyncio
+task (one per request) gets its own AsyncSession.
+"""
+
+from asyncio import current_task
+from sqlalchemy.ext.asyncio import (
+    async_scoped_session,
+    async_sessionmaker,
+    create_async_engine,
+)
+
+
+class AsyncDatabase:
+    """Holds the async engine and the task scoped AsyncSession"""
+
+    def __init__(self):
+        self.engine = None
+        # the items are loaded up front so nothing may expire on commit
+        self.session = async_scoped_session(
+            async_sessionmaker(expire_on_commit=False), scopefunc=current_task
+        )
+
+    def init(self, database_uri: str, **engine_options) -> None:
+        """Creates the async engine and binds the sessions to it"""
+        self.engine = create_async_engine(database_uri, **engine_options)
+        self.session.session_factory.configure(bind=self.engine)
+
+    async def dispose(self) -> None:
+        """Closes all of the connections of the engine"""
+        if self.engine is not None:
+            await self.engine.dispose()
+
+
+async_db = AsyncDatabase()
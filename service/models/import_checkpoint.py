@@ -0,0 +1,23 @@
+"""
+Progress of the bulk imports
+"""
+
+from .persistent_base import db
+
+######################################################################
+#  I M P O R T   C H E C K P O I N T   M O D E L
+######################################################################
+
+
+class ImportCheckpoint(db.Model):  # pylint: disable=too-few-public-methods
+    """
+    Class that remembers how many records of a bulk import source were
+    committed so that a crashed import can be resumed
+    """
+
+    # Table Schema
+    source = db.Column(db.String(255), primary_key=True)
+    records = db.Column(db.BigInteger, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<ImportCheckpoint {self.source} records=[{self.records}]>"
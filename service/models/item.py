@@ -3,10 +3,20 @@ Persistent Base class for database CRUD functions
 """
 
 import logging
-from .persistent_base import db, PersistentBase, DataValidationError
+from sqlalchemy import inspect, select
+from sqlalchemy.dialects import postgresql, sqlite
+from service.common.cache import cache
+from .persistent_base import db, PersistentBase, DataValidationError, cache_key, database_error
+from .async_session import async_db
 
 logger = logging.getLogger("flask.app")
 
+# INSERT ... ON CONFLICT of the databases that support it
+UPSERTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+# What adding a product that a Shopcart already holds does to its line
+CONFLICT_MODES = ("error", "increment", "replace")
+
 ######################################################################
 #  I T E M  M O D E L
 ######################################################################
@@ -20,12 +30,27 @@ class Item(db.Model, PersistentBase):
     # Table Schema
     id = db.Column(db.Integer, primary_key=True)
     shopcart_id = db.Column(
-        db.Integer, db.ForeignKey("shopcart.id", ondelete="CASCADE"), nullable=False
+        db.Integer,
+        db.ForeignKey("shopcart.id", ondelete="CASCADE"),
+        nullable=False,
+        index=True,
     )
     item_id = db.Column(db.String(16), nullable=False)
     description = db.Column(db.String(64), nullable=False)
     quantity = db.Column(db.Integer, nullable=False)
     price = db.Column(db.Integer, nullable=False)
+    # bumped by every update of the item, so that a write can tell that
+    # another one changed the item since it was read
+    version = db.Column(db.Integer, nullable=False, server_default="1")
+
+    # Indexes for the item lookups and filters of a shopcart, a product is
+    # held once by a shopcart
+    __table_args__ = (
+        db.Index("ix_item_shopcart_id_item_id", "shopcart_id", "item_id", unique=True),
+        db.Index("ix_item_shopcart_id_price", "shopcart_id", "price"),
+        db.Index("ix_item_shopcart_id_quantity", "shopcart_id", "quantity"),
+    )
+    __mapper_args__ = {"version_id_col": version}
 
     def __repr__(self):
         return f"<Item {self.item_id} id=[{self.id}] shopcart[{self.shopcart_id}]>"
@@ -33,6 +58,12 @@ class Item(db.Model, PersistentBase):
     def __str__(self):
         return f"{self.item_id}: {self.description}, {self.quantity}, {self.price}"
 
+    def cache_keys(self) -> list:
+        """Returns the key of the cached Shopcart, and the one it left if it moved"""
+        history = inspect(self).attrs.shopcart_id.history
+        shopcart_ids = {*history.added, *history.unchanged, *history.deleted} - {None}
+        return [cache_key("shopcart", shopcart_id) for shopcart_id in sorted(shopcart_ids)]
+
     def serialize(self) -> dict:
         """Converts an Address into a dictionary"""
         return {
@@ -89,6 +120,119 @@ class Item(db.Model, PersistentBase):
 
         return self
 
+    @classmethod
+    def create_batch(cls, items: list, atomic: bool = True) -> list:
+        """
+        Creates many Items with a single multi-row INSERT in one transaction
+
+        The Items must be of different products. An Item whose product its
+        Shopcart already holds is not inserted.
+
+        Args:
+            items (list): the Items to create
+            atomic (bool): create none of the Items when one is not inserted
+
+        Returns:
+            list: the Items that were not inserted, the others have their
+            generated ids
+        """
+        logger.info("Creating a batch of %d items", len(items))
+        table = cls.__table__
+        columns = [column.key for column in table.columns if column.key not in ("id", "version")]
+        rows = [{key: getattr(item, key) for key in columns} for item in items]
+        statement = (
+            UPSERTS[db.session.get_bind().dialect.name](table)
+            .on_conflict_do_nothing(index_elements=["shopcart_id", "item_id"])
+            .returning(table.c.id, table.c.shopcart_id, table.c.item_id)
+        )
+        try:
+            ids = {(shopcart_id, item_id): pk for pk, shopcart_id, item_id in db.session.execute(statement, rows)}
+            skipped = [item for item in items if (item.shopcart_id, str(item.item_id)) not in ids]
+            if skipped and atomic:
+                db.session.rollback()
+                return skipped
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error("Error creating a batch of %d items", len(items))
+            raise database_error(e) from e
+        cache.invalidate(*{cache_key("shopcart", row["shopcart_id"]) for row in rows})
+        for item in items:
+            item.id = ids.get((item.shopcart_id, str(item.item_id)))
+        return skipped
+
+    @classmethod
+    def upsert_statement(cls, item, on_conflict: str, dialect: str):
+        """
+        Returns an INSERT of an Item that resolves a conflict with the line of
+        the same product in a single statement
+
+        Args:
+            item (Item): the Item to add
+            on_conflict (str): "error" to insert nothing, "increment" to add
+                the quantity to the line or "replace" to overwrite the line
+            dialect (str): the name of the database dialect
+        """
+        if on_conflict not in CONFLICT_MODES:
+            raise DataValidationError(f"Invalid on_conflict: must be one of {', '.join(CONFLICT_MODES)}")
+        table = cls.__table__
+        columns = [column.key for column in table.columns if column.key not in ("id", "version")]
+        statement = UPSERTS[dialect](table).values({key: getattr(item, key) for key in columns})
+        keys = ["shopcart_id", "item_id"]
+        if on_conflict == "increment":
+            statement = statement.on_conflict_do_update(
+                index_elements=keys,
+                set_={"quantity": table.c.quantity + statement.excluded.quantity, "version": table.c.version + 1},
+            )
+        elif on_conflict == "replace":
+            statement = statement.on_conflict_do_update(
+                index_elements=keys,
+                set_={
+                    **{key: statement.excluded[key] for key in ("description", "quantity", "price")},
+                    "version": table.c.version + 1,
+                },
+            )
+        else:
+            statement = statement.on_conflict_do_nothing(index_elements=keys)
+        return statement.returning(*table.columns)
+
+    @classmethod
+    def upsert(cls, item, on_conflict: str = "error"):
+        """
+        Adds an Item to its Shopcart or merges it into the line of the same product
+
+        Returns:
+            Item: the line as stored, or None when the Shopcart already holds
+            the product and on_conflict is "error"
+        """
+        logger.info("Upserting %s with on_conflict=%s", item, on_conflict)
+        statement = cls.upsert_statement(item, on_conflict, db.session.get_bind().dialect.name)
+        try:
+            row = db.session.execute(statement).first()
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error("Error upserting record: %s", item)
+            raise database_error(e) from e
+        cache.invalidate(cache_key("shopcart", item.shopcart_id))
+        # a detached copy of the row, so reading it sends no query
+        return cls(**row._asdict()) if row else None
+
+    @classmethod
+    async def upsert_async(cls, item, on_conflict: str = "error"):
+        """Adds an Item to its Shopcart like upsert() does"""
+        logger.info("Upserting %s with on_conflict=%s", item, on_conflict)
+        statement = cls.upsert_statement(item, on_conflict, async_db.engine.dialect.name)
+        try:
+            row = (await async_db.session.execute(statement)).first()
+            await async_db.session.commit()
+        except Exception as e:
+            await async_db.session.rollback()
+            logger.error("Error upserting record: %s", item)
+            raise database_error(e) from e
+        cache.invalidate(cache_key("shopcart", item.shopcart_id))
+        return cls(**row._asdict()) if row else None
+
     @classmethod
     def find_by_id(cls, shopcart_id):
         """Returns all items with the given id
@@ -99,6 +243,21 @@ class Item(db.Model, PersistentBase):
         logger.info("Processing id query for %s ...", shopcart_id)
         return cls.query.filter(cls.id == shopcart_id)
 
+    @classmethod
+    def find_version(cls, item_id: int):
+        """Returns the version of an Item without loading it
+
+        Args:
+            item_id (int): the id of the Item
+
+        Returns:
+            int: the version, or None if there is no such Item
+        """
+        logger.info("Processing version lookup for id %s ...", item_id)
+        return db.session.execute(
+            select(cls.version).where(cls.id == item_id)
+        ).scalar_one_or_none()
+
     @classmethod
     def find_by_price(cls, price):
         """Returns all items with the given price
@@ -128,3 +287,76 @@ class Item(db.Model, PersistentBase):
         """
         logger.info("Processing id query for %s ...", quantity)
         return cls.query.filter(cls.quantity == quantity)
+
+    # pylint: disable=too-many-arguments
+    @classmethod
+    def find_by_shopcart_id(
+        cls,
+        shopcart_id,
+        *,
+        quantity=None,
+        price=None,
+        price_min=None,
+        price_max=None,
+        quantity_gte=None,
+    ):
+        """Returns the items of a Shopcart that match all of the given filters
+
+        Args:
+            shopcart_id (integer): the id of the Shopcart the items belong to
+            quantity (integer): the exact quantity to match
+            price (integer): the exact price to match
+            price_min (integer): the lowest price to match
+            price_max (integer): the highest price to match
+            quantity_gte (integer): the lowest quantity to match
+        """
+        logger.info("Processing item query for shopcart %s ...", shopcart_id)
+        criteria = cls.shopcart_criteria(
+            shopcart_id,
+            quantity=quantity,
+            price=price,
+            price_min=price_min,
+            price_max=price_max,
+            quantity_gte=quantity_gte,
+        )
+        return cls.query.filter(*criteria).order_by(cls.id)
+
+    @classmethod
+    async def find_by_shopcart_id_async(cls, shopcart_id, **filters) -> list:
+        """Returns the items of a Shopcart like find_by_shopcart_id() does"""
+        logger.info("Processing item query for shopcart %s ...", shopcart_id)
+        statement = select(cls).where(*cls.shopcart_criteria(shopcart_id, **filters))
+        return (await async_db.session.scalars(statement.order_by(cls.id))).all()
+
+    @classmethod
+    async def find_version_async(cls, item_id: int):
+        """Returns the version of an Item like find_version() does"""
+        logger.info("Processing version lookup for id %s ...", item_id)
+        result = await async_db.session.execute(select(cls.version).where(cls.id == item_id))
+        return result.scalar_one_or_none()
+
+    # pylint: disable=too-many-arguments
+    @classmethod
+    def shopcart_criteria(
+        cls,
+        shopcart_id,
+        *,
+        quantity=None,
+        price=None,
+        price_min=None,
+        price_max=None,
+        quantity_gte=None,
+    ) -> list:
+        """Returns the WHERE criteria of find_by_shopcart_id()"""
+        criteria = [cls.shopcart_id == shopcart_id]
+        if quantity is not None:
+            criteria.append(cls.quantity == quantity)
+        if quantity_gte is not None:
+            criteria.append(cls.quantity >= quantity_gte)
+        if price is not None:
+            criteria.append(cls.price == price)
+        if price_min is not None:
+            criteria.append(cls.price >= price_min)
+        if price_max is not None:
+            criteria.append(cls.price <= price_max)
+        return criteria
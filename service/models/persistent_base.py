@@ -21,6 +21,11 @@ Persistent Base class for database CRUD functions
 import logging
 from abc import abstractmethod
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import select
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm.exc import StaleDataError
+from service.common.cache import cache
+from .async_session import async_db
 
 logger = logging.getLogger("flask.app")
 
@@ -31,6 +36,22 @@ class DataValidationError(Exception):
     """Used for an data validation errors when deserializing"""
 
 
+def database_error(error: Exception) -> DataValidationError:
+    """Returns the DataValidationError of a failed write without the SQL and parameters of its statement"""
+    if isinstance(error, DataValidationError):
+        return error
+    if isinstance(error, DBAPIError):
+        # the primary message of the server, e.g. the violated constraint
+        diag = getattr(error.orig, "diag", None)
+        return DataValidationError(getattr(diag, "message_primary", None) or type(error.orig).__name__)
+    return DataValidationError(str(error))
+
+
+def cache_key(table: str, by_id: int) -> str:
+    """Returns the key of the cached entry of a record"""
+    return f"{table}:{by_id}"
+
+
 ######################################################################
 #  P E R S I S T E N T   B A S E   M O D E L
 ######################################################################
@@ -48,6 +69,10 @@ class PersistentBase:
     def deserialize(self, data: dict) -> None:
         """Convert a dictionary into an object"""
 
+    def cache_keys(self) -> list:
+        """Returns the keys of the cached entries that a change of this record makes stale"""
+        return []
+
     def create(self) -> None:
         """
         Creates a Account to the database
@@ -55,13 +80,15 @@ class PersistentBase:
         logger.info("Creating %s", self)
         # id must be none to generate next primary key
         self.id = None
+        keys = self.cache_keys()
         try:
             db.session.add(self)
             db.session.commit()
         except Exception as e:
             db.session.rollback()
             logger.error("Error creating record: %s", self)
-            raise DataValidationError(e) from e
+            raise database_error(e) from e
+        cache.invalidate(*keys)
 
     def update(self) -> None:
         """
@@ -70,23 +97,37 @@ class PersistentBase:
         logger.info("Updating %s", self)
         if not self.id:
             raise DataValidationError("Update called with empty ID field")
+        # the keys are read before the commit expires the attributes
+        keys = self.cache_keys()
         try:
             db.session.commit()
+        except StaleDataError:
+            # the version of the record changed since it was read
+            db.session.rollback()
+            logger.warning("Conflicting update of %s", self)
+            raise
         except Exception as e:
             db.session.rollback()
             logger.error("Error updating record: %s", self)
-            raise DataValidationError(e) from e
+            raise database_error(e) from e
+        cache.invalidate(*keys)
 
     def delete(self) -> None:
         """Removes a Account from the data store"""
         logger.info("Deleting %s", self)
+        keys = self.cache_keys()
         try:
             db.session.delete(self)
             db.session.commit()
+        except StaleDataError:
+            db.session.rollback()
+            logger.warning("Conflicting delete of %s", self)
+            raise
         except Exception as e:
             db.session.rollback()
             logger.error("Error deleting record: %s", self)
-            raise DataValidationError(e) from e
+            raise database_error(e) from e
+        cache.invalidate(*keys)
 
     @classmethod
     def all(cls):
@@ -95,9 +136,145 @@ class PersistentBase:
         # pylint: disable=no-member
         return cls.query.all()
 
+    @classmethod
+    def paginate(cls, query, limit: int, cursor: int = None):
+        """Returns one page of records using keyset pagination on the id
+
+        Args:
+            query: the query to page through
+            limit (int): the maximum number of records to return
+            cursor (int): the id of the last record of the previous page
+
+        Returns:
+            a tuple of the records and the cursor of the next page,
+            which is None when there are no more records
+        """
+        logger.info("Processing page query of %s after id %s ...", limit, cursor)
+        if cursor is not None:
+            query = query.filter(cls.id > cursor)
+        # fetch one extra record to find out if there is a next page
+        records = query.order_by(cls.id).limit(limit + 1).all()
+        next_cursor = None
+        if len(records) > limit:
+            records = records[:limit]
+            next_cursor = records[-1].id
+        return records, next_cursor
+
+    @classmethod
+    def paginate_offset(cls, query, limit: int, cursor: int = None):
+        """Returns one page of the records of a query that is ranked by something else than the id
+
+        Args:
+            query: the ordered query to page through
+            limit (int): the maximum number of records to return
+            cursor (int): the number of records of the previous pages
+
+        Returns:
+            a tuple of the records and the cursor of the next page,
+            which is None when there are no more records
+        """
+        logger.info("Processing page query of %s after %s records ...", limit, cursor)
+        offset = cursor or 0
+        records = query.offset(offset).limit(limit + 1).all()
+        next_cursor = None
+        if len(records) > limit:
+            records = records[:limit]
+            next_cursor = offset + limit
+        return records, next_cursor
+
     @classmethod
     def find(cls, by_id):
         """Finds a record by it's ID"""
         logger.info("Processing lookup for id %s ...", by_id)
         # pylint: disable=no-member
         return cls.query.session.get(cls, by_id)
+
+    ##################################################
+    # ASYNC EQUIVALENTS FOR THE ASGI SERVICE
+    ##################################################
+
+    async def create_async(self) -> None:
+        """Creates a record in the database without blocking the event loop"""
+        logger.info("Creating %s", self)
+        # id must be none to generate next primary key
+        self.id = None
+        keys = self.cache_keys()
+        session = async_db.session
+        try:
+            session.add(self)
+            await session.commit()
+        except Exception as e:
+            await session.rollback()
+            logger.error("Error creating record: %s", self)
+            raise database_error(e) from e
+        cache.invalidate(*keys)
+        await self.refresh_async()
+
+    async def update_async(self) -> None:
+        """Updates a record in the database without blocking the event loop"""
+        logger.info("Updating %s", self)
+        if not self.id:
+            raise DataValidationError("Update called with empty ID field")
+        keys = self.cache_keys()
+        session = async_db.session
+        try:
+            await session.commit()
+        except StaleDataError:
+            await session.rollback()
+            logger.warning("Conflicting update of %s", self)
+            raise
+        except Exception as e:
+            await session.rollback()
+            logger.error("Error updating record: %s", self)
+            raise database_error(e) from e
+        cache.invalidate(*keys)
+        await self.refresh_async()
+
+    async def refresh_async(self) -> None:
+        """Reloads a record after a commit since nothing expires on commit"""
+        await async_db.session.refresh(self)
+
+    async def delete_async(self) -> None:
+        """Removes a record from the database without blocking the event loop"""
+        logger.info("Deleting %s", self)
+        keys = self.cache_keys()
+        session = async_db.session
+        try:
+            await session.delete(self)
+            await session.commit()
+        except StaleDataError:
+            await session.rollback()
+            logger.warning("Conflicting delete of %s", self)
+            raise
+        except Exception as e:
+            await session.rollback()
+            logger.error("Error deleting record: %s", self)
+            raise database_error(e) from e
+        cache.invalidate(*keys)
+
+    @classmethod
+    async def all_async(cls, *options):
+        """Returns all of the records in the database"""
+        logger.info("Processing all records")
+        return (await async_db.session.scalars(select(cls).options(*options))).all()
+
+    @classmethod
+    async def paginate_async(cls, statement, limit: int, cursor: int = None):
+        """Returns one page of records of a select() like paginate() does"""
+        logger.info("Processing page query of %s after id %s ...", limit, cursor)
+        if cursor is not None:
+            statement = statement.where(cls.id > cursor)
+        statement = statement.order_by(cls.id).limit(limit + 1)
+        records = (await async_db.session.scalars(statement)).all()
+        next_cursor = None
+        if len(records) > limit:
+            records = records[:limit]
+            next_cursor = records[-1].id
+        return records, next_cursor
+
+    @classmethod
+    async def find_async(cls, by_id, *options):
+        """Finds a record by it's ID without blocking the event loop"""
+        logger.info("Processing lookup for id %s ...", by_id)
+        # refresh the record in case the task scoped session already holds it
+        return await async_db.session.get(cls, by_id, options=options, populate_existing=True)
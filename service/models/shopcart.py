@@ -3,34 +3,79 @@ Persistent Base class for database CRUD functions
 """
 
 import logging
-from .persistent_base import db, PersistentBase, DataValidationError
+from flask import current_app
+from sqlalchemy import DDL, case, cast, delete, event, func, literal, or_, select, update
+from sqlalchemy.orm import joinedload, lazyload, selectinload
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.orm.exc import StaleDataError
+from service.common.cache import cache
+from .persistent_base import db, PersistentBase, DataValidationError, cache_key, database_error
 from .item import Item
+from .async_session import async_db
 
 logger = logging.getLogger("flask.app")
 
+# Loader options that can be selected with SHOPCART_ITEMS_LOADING
+ITEMS_LOADERS = {
+    "selectin": selectinload,
+    "joined": joinedload,
+    "lazy": lazyload,
+}
+
+# How search_by_name() compares the names with the searched text
+NAME_MATCHES = ("prefix", "substring", "fuzzy")
+
 ######################################################################
 #  S H O P C A R T   M O D E L
 ######################################################################
 
 
-class Shopcart(db.Model, PersistentBase):
+class Shopcart(db.Model, PersistentBase):  # pylint: disable=too-many-public-methods
     """
     Class that represents an Shopcart
     """
 
     # Table Schema
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(64), nullable=False)
-    items = db.relationship("Item", backref="shopcart", passive_deletes=True)
+    name = db.Column(db.String(64), nullable=False, index=True)
+    # maintained by the database triggers in totals.py
+    total_price = db.Column(db.BigInteger, nullable=False, server_default="0")
+    item_count = db.Column(db.Integer, nullable=False, server_default="0")
+    # bumped by every update of the shopcart and of its items
+    version = db.Column(db.Integer, nullable=False, server_default="1")
+
+    # Case-insensitive name searches: a pattern index for prefixes and, on
+    # PostgreSQL, a trigram index for substrings and fuzzy matches
+    __table_args__ = (
+        db.Index(
+            "ix_shopcart_name_lower",
+            func.lower(name).label("name_lower"),
+            postgresql_ops={"name_lower": "text_pattern_ops"},
+        ),
+        db.Index(
+            "ix_shopcart_name_trgm",
+            func.lower(name).label("name_trgm"),
+            postgresql_using="gin",
+            postgresql_ops={"name_trgm": "gin_trgm_ops"},
+        ).ddl_if(callable_=lambda ddl, target, bind, dialect, **kw: trigram_index_created(dialect, bind)),
+    )
+    __mapper_args__ = {"version_id_col": version}
+    items = db.relationship("Item", backref="shopcart", passive_deletes=True, order_by="Item.id")
 
     def __repr__(self):
         return f"<Shopcart {self.name} id=[{self.id}]>"
 
+    def cache_keys(self) -> list:
+        """Returns the key of the cached Shopcart"""
+        return [cache_key(self.__tablename__, self.id)] if self.id else []
+
     def serialize(self):
         """Converts an Account into a dictionary"""
         shopcart = {
             "id": self.id,
             "name": self.name,
+            "total_price": self.total_price,
+            "item_count": self.item_count,
             "items": [],
         }
         for item in self.items:
@@ -47,13 +92,20 @@ class Shopcart(db.Model, PersistentBase):
         try:
             self.name = data["name"]
 
-            # handle inner list of items
+            # handle inner list of items, a product that the Shopcart holds
+            # already is updated instead of added a second time
             product_list = data.get("items")
+            held = {str(item.item_id): item for item in self.items}
 
             for json_product in product_list:
-                item = Item()
-                item.deserialize(json_product)
-                self.items.append(item)
+                product = {**json_product, "shopcart_id": self.id}
+                item = held.get(str(product["item_id"]))
+                if item is None:
+                    item = Item().deserialize(product)
+                    self.items.append(item)
+                    held[str(item.item_id)] = item
+                else:
+                    item.deserialize(product)
 
         except AttributeError as error:
             raise DataValidationError("Invalid attribute: " + error.args[0]) from error
@@ -69,26 +121,403 @@ class Shopcart(db.Model, PersistentBase):
 
         return self
 
+    def clear(self) -> None:
+        """Removes all of the items of a Shopcart with a single statement
+
+        The version of the Shopcart is bumped first, in the same transaction,
+        only if it is still the version that was read. Otherwise nothing is
+        removed and StaleDataError is raised like for the other writes.
+        """
+        logger.info("Clearing %s", self)
+        keys = self.cache_keys()
+        try:
+            self.claim_version(db.session.execute(self.bump_version_statement()).rowcount)
+            db.session.execute(delete(Item).where(Item.shopcart_id == self.id))
+            db.session.commit()
+        except StaleDataError:
+            db.session.rollback()
+            logger.warning("Conflicting clear of %s", self)
+            raise
+        except Exception as e:
+            db.session.rollback()
+            logger.error("Error clearing record: %s", self)
+            raise database_error(e) from e
+        cache.invalidate(*keys)
+        # the cart is known to be empty so there is no need to reload the items
+        set_committed_value(self, "items", [])
+
+    def bump_version_statement(self):
+        """Returns the UPDATE that bumps the version of the Shopcart if it was not changed since it was read"""
+        table = type(self).__table__
+        return (
+            update(table)
+            .where(table.c.id == self.id, table.c.version == self.version)
+            .values(version=table.c.version + 1)
+        )
+
+    def claim_version(self, rowcount: int) -> None:
+        """Raises StaleDataError unless the UPDATE of bump_version_statement() matched the Shopcart"""
+        if rowcount != 1:
+            raise StaleDataError(f"{self} was changed or deleted since version {self.version} was read")
+
     @classmethod
-    def find_by_name(cls, name):
+    def items_loader(cls):
+        """Returns the configured loader option for the items of a Shopcart"""
+        strategy = current_app.config["SHOPCART_ITEMS_LOADING"]
+        return ITEMS_LOADERS[strategy](cls.items)
+
+    @classmethod
+    def with_items(cls):
+        """Returns a query of Shopcarts that loads their items up front"""
+        return cls.query.options(cls.items_loader())
+
+    @classmethod
+    def all(cls):
+        """Returns all of the Shopcarts with their items"""
+        logger.info("Processing all records")
+        return cls.with_items().all()
+
+    @classmethod
+    def find_with_items(cls, by_id):
+        """Finds a Shopcart by it's ID and loads its items with it"""
+        logger.info("Processing lookup with items for id %s ...", by_id)
+        return db.session.get(cls, by_id, options=[cls.items_loader()])
+
+    @classmethod
+    def select_columns(cls, *names):
+        """Returns a query of rows with only some columns of the Shopcarts
+
+        The rows are not tracked by the session and the item table is not
+        read at all.
+
+        Args:
+            names (string): the names of the columns, such as "id" and "name"
+        """
+        return db.session.query(*(getattr(cls, name) for name in names))
+
+    @classmethod
+    def find_columns(cls, by_id, *names):
+        """Finds some columns of a Shopcart by it's ID, or returns None"""
+        logger.info("Processing lookup of %s for id %s ...", ", ".join(names), by_id)
+        return cls.select_columns(*names).filter(cls.id == by_id).one_or_none()
+
+    @classmethod
+    def find_by_name(cls, name, query=None):
         """Returns the unique Shopcart with the given name
 
         Args:
             name (string): the name of the Accounts you want to match
+            query: the query to filter, the Shopcarts with their items by default
         """
         logger.info("Processing name query for %s ...", name)
-        return cls.query.filter(cls.name == name)
+        if query is None:
+            query = cls.with_items()
+        return query.filter(cls.name == name)
+
+    @classmethod
+    def search_by_name(cls, text: str, match: str = "substring", query=None):
+        """Returns the Shopcarts whose name matches a text, best matches first
+
+        Args:
+            text (string): the text to look for, the case is ignored
+            match (string): "prefix" for names that start with the text,
+                "substring" for names that contain it or "fuzzy" for names
+                that are similar to it
+            query: the query to filter, the Shopcarts with their items by default
+        """
+        logger.info("Processing %s name search for %s ...", match, text)
+        if match not in NAME_MATCHES:
+            raise DataValidationError(f"Invalid match: must be one of {', '.join(NAME_MATCHES)}")
+        # only the fuzzy search uses pg_trgm, the others use the pattern index
+        trigram_index = match == "fuzzy" and has_trigrams(db.session)
+        criterion, ranking = cls.name_search(text, match, db.session.get_bind().dialect.name, trigram_index)
+        if query is None:
+            query = cls.with_items()
+        return query.filter(criterion).order_by(*ranking, cls.id)
+
+    # pylint: disable=too-many-arguments
+    @classmethod
+    def name_search(cls, text: str, match: str, dialect: str, trigram_index: bool = False) -> tuple:
+        """Returns the WHERE criterion and the ORDER BY of a name search
+
+        Args:
+            text (string): the text to look for
+            match (string): one of NAME_MATCHES
+            dialect (string): the name of the database dialect
+            trigram_index (bool): whether the database has pg_trgm
+        """
+        term = text.strip().lower()
+        name = func.lower(cls.name)
+
+        def like(pattern: str):
+            # the pattern is rendered into the SQL so that the planner can see
+            # its prefix and use the pattern index
+            return name.like(literal(pattern, literal_execute=True), escape="\\")
+
+        contains = like(f"%{escape_like(term)}%")
+        if match == "prefix":
+            return like(f"{escape_like(term)}%"), [func.length(cls.name)]
+        if match == "substring":
+            # names where the text shows up earlier come first
+            position = func.strpos(name, term) if dialect == "postgresql" else func.instr(name, term)
+            return contains, [position, func.length(cls.name)]
+        if trigram_index:
+            # the % operator of pg_trgm finds similar names with the trigram index
+            return or_(name.op("%")(term), contains), [func.similarity(name, term).desc()]
+        # elsewhere count the trigrams of the text that a name contains
+        matches = [like(f"%{escape_like(trigram)}%") for trigram in trigrams(term)]
+        shared = sum((case((criterion, 1), else_=0) for criterion in matches), start=0)
+        return or_(*matches), [shared.desc(), func.length(cls.name)]
+
+    @classmethod
+    def find_serialized(cls, shopcart_id: int, serialize, version: int = None) -> dict:
+        """Returns a Shopcart with its items as serialize() converts it, from the cache if it is there
+
+        A cached Shopcart is checked against the version in the database when
+        CACHE_CHECK_VERSION is on or the caller knows the version, so the cache
+        saves the load of the items and the serialization, not the lookup.
+
+        Args:
+            shopcart_id (int): the id of the Shopcart
+            serialize (callable): converts a Shopcart into a dictionary
+            version (int): the current version, if the caller read it already
+
+        Returns:
+            dict: the "version" and the serialized "shopcart", or None if
+            there is no such Shopcart
+        """
+
+        def load():
+            shopcart = cls.find_with_items(shopcart_id)
+            if shopcart is None:
+                return None
+            return {"version": shopcart.version, "shopcart": serialize(shopcart)}
+
+        def fresh(found):
+            # every change of the Shopcart or its items bumps the version, so
+            # one primary key lookup tells whether the entry is current
+            current = version if version is not None else cls.find_version(shopcart_id)
+            return found["version"] == current
+
+        check = version is not None or current_app.config["CACHE_CHECK_VERSION"]
+        return cache.fetch(cache_key(cls.__tablename__, shopcart_id), load, fresh if check else None)
+
+    @classmethod
+    def find_version(cls, shopcart_id: int):
+        """Returns the version of a Shopcart without loading it
+
+        Args:
+            shopcart_id (int): the id of the Shopcart
+
+        Returns:
+            int: the version, or None if there is no such Shopcart
+        """
+        logger.info("Processing version lookup for id %s ...", shopcart_id)
+        return db.session.execute(
+            select(cls.version).where(cls.id == shopcart_id)
+        ).scalar_one_or_none()
 
     @classmethod
     def calculate_total_price(cls, shopcart_id: int):
-        """_summary_
+        """Returns the stored total price of a Shopcart
+
+        Args:
+            shopcart_id (int): the id of the Shopcart
+
+        Returns:
+            int: the total price, or None if there is no such Shopcart
+        """
+        logger.info("Processing total price lookup for id %s ...", shopcart_id)
+        return db.session.execute(
+            select(cls.total_price).where(cls.id == shopcart_id)
+        ).scalar_one_or_none()
+
+    ##################################################
+    # ASYNC EQUIVALENTS FOR THE ASGI SERVICE
+    ##################################################
+
+    async def refresh_async(self) -> None:
+        """Reloads a Shopcart with the totals and items the triggers changed"""
+        await async_db.session.refresh(self, ["total_price", "item_count", "version", "items"])
+
+    async def clear_async(self) -> None:
+        """Removes all of the items of a Shopcart like clear() does"""
+        logger.info("Clearing %s", self)
+        keys = self.cache_keys()
+        session = async_db.session
+        try:
+            self.claim_version((await session.execute(self.bump_version_statement())).rowcount)
+            await session.execute(delete(Item).where(Item.shopcart_id == self.id))
+            await session.commit()
+        except StaleDataError:
+            await session.rollback()
+            logger.warning("Conflicting clear of %s", self)
+            raise
+        except Exception as e:
+            await session.rollback()
+            logger.error("Error clearing record: %s", self)
+            raise database_error(e) from e
+        cache.invalidate(*keys)
+        set_committed_value(self, "items", [])
+        await async_db.session.refresh(self, ["total_price", "item_count", "version"])
+
+    @classmethod
+    def select_with_items(cls, name: str = None):
+        """Returns a select() of Shopcarts, optionally by name, with their items"""
+        # an AsyncSession cannot load lazily so the items always come up front
+        statement = select(cls).options(selectinload(cls.items))
+        if name is not None:
+            statement = statement.where(cls.name == name)
+        return statement
+
+    @classmethod
+    async def all_async(cls, *options):
+        """Returns all of the Shopcarts with their items"""
+        return await super().all_async(selectinload(cls.items), *options)
+
+    @classmethod
+    async def find_with_items_async(cls, by_id):
+        """Finds a Shopcart by it's ID with its items without blocking the event loop"""
+        return await cls.find_async(by_id, selectinload(cls.items))
+
+    @classmethod
+    async def calculate_total_price_async(cls, shopcart_id: int):
+        """Returns the stored total price of a Shopcart like calculate_total_price() does"""
+        logger.info("Processing total price lookup for id %s ...", shopcart_id)
+        result = await async_db.session.execute(
+            select(cls.total_price).where(cls.id == shopcart_id)
+        )
+        return result.scalar_one_or_none()
+
+    @classmethod
+    async def find_version_async(cls, shopcart_id: int):
+        """Returns the version of a Shopcart like find_version() does"""
+        logger.info("Processing version lookup for id %s ...", shopcart_id)
+        result = await async_db.session.execute(select(cls.version).where(cls.id == shopcart_id))
+        return result.scalar_one_or_none()
+
+    @classmethod
+    def reconcile_totals(cls, repair: bool = False) -> list:
+        """Finds the Shopcarts whose stored totals drifted from their items
 
         Args:
-            id (_type_): _description_
+            repair (bool): recompute the totals of the drifted Shopcarts
 
         Returns:
-            _type_: _description_
+            list: a dictionary for each drifted Shopcart with the stored
+            and the actual totals
         """
-        shopcart = cls.find(shopcart_id)
-        total_price = sum(item.quantity * item.price for item in shopcart.items)
-        return total_price
+        logger.info("Processing totals reconciliation ...")
+        line_total = cast(Item.quantity, db.BigInteger) * Item.price
+        actual = (
+            select(
+                Item.shopcart_id,
+                func.sum(line_total).label("total_price"),
+                func.count(Item.id).label("item_count"),
+            )
+            .group_by(Item.shopcart_id)
+            .subquery()
+        )
+        actual_price = func.coalesce(actual.c.total_price, 0)  # pylint: disable=assignment-from-no-return
+        actual_count = func.coalesce(actual.c.item_count, 0)  # pylint: disable=assignment-from-no-return
+        rows = db.session.execute(
+            select(
+                cls.id,
+                cls.total_price,
+                cls.item_count,
+                actual_price.label("actual_total_price"),
+                actual_count.label("actual_item_count"),
+            )
+            .outerjoin(actual, actual.c.shopcart_id == cls.id)
+            .where(or_(cls.total_price != actual_price, cls.item_count != actual_count))
+            .order_by(cls.id)
+        )
+        drifted = [dict(row._mapping) for row in rows]
+        if repair and drifted:
+            logger.info("Repairing the totals of %d shopcarts", len(drifted))
+            try:
+                # recompute inside the UPDATE so concurrent item changes are not lost
+                db.session.execute(
+                    update(cls)
+                    .where(cls.id.in_([row["id"] for row in drifted]))
+                    .values(
+                        total_price=select(func.coalesce(func.sum(line_total), 0))
+                        .where(Item.shopcart_id == cls.id)
+                        .scalar_subquery(),
+                        item_count=select(func.count(Item.id))
+                        .where(Item.shopcart_id == cls.id)
+                        .scalar_subquery(),
+                        version=cls.version + 1,
+                    )
+                    .execution_options(synchronize_session=False)
+                )
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                logger.error("Error repairing the shopcart totals")
+                raise database_error(e) from e
+            cache.invalidate(*(cache_key(cls.__tablename__, row["id"]) for row in drifted))
+        return drifted
+
+
+def escape_like(text: str) -> str:
+    """Escapes the wildcards of LIKE in a text"""
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def trigrams(text: str) -> list:
+    """Returns the distinct three letter pieces of a text, or the text if it is shorter"""
+    if len(text) < 3:
+        return [text]
+    return sorted({text[start:start + 3] for start in range(len(text) - 2)})
+
+
+######################################################################
+#  T R I G R A M   I N D E X
+######################################################################
+# pg_trgm ships with the contrib modules of PostgreSQL, which a server may
+# not have. Without it there is no trigram index and fuzzy searches count
+# the trigrams of the names instead.
+TRIGRAM_EXTENSION = DDL(
+    """
+DO $$
+BEGIN
+    IF EXISTS (SELECT FROM pg_available_extensions WHERE name = 'pg_trgm') THEN
+        CREATE EXTENSION IF NOT EXISTS pg_trgm;
+    END IF;
+END
+$$
+"""
+)
+TRIGRAMS_AVAILABLE = "SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'"
+TRIGRAMS_INSTALLED = "SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'"
+
+
+def trigrams_available(bind) -> bool:
+    """Returns True when pg_trgm can be installed in the database, so that
+    the trigram index is created"""
+    return bind is None or bind.exec_driver_sql(TRIGRAMS_AVAILABLE).first() is not None
+
+
+def trigram_index_created(dialect, bind) -> bool:
+    """Returns True on the databases where the models create the trigram
+    index of the names, the condition of its ddl_if()"""
+    return dialect.name == "postgresql" and trigrams_available(bind)
+
+
+def has_trigrams(session) -> bool:
+    """Returns True when pg_trgm is installed in the database of a session
+
+    The lookup is a statement of the request, so installing the extension
+    takes effect without a restart.
+    """
+    if session.get_bind().dialect.name != "postgresql":
+        return False
+    return session.connection().exec_driver_sql(TRIGRAMS_INSTALLED).first() is not None
+
+
+# The extension is installed right before the index, also when an existing
+# database gets the index from `flask db-index-report --create`
+for index in Shopcart.__table__.indexes:
+    if index.name == "ix_shopcart_name_trgm":
+        event.listen(index, "before_create", TRIGRAM_EXTENSION.execute_if(dialect="postgresql"))
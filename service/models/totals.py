@@ -0,0 +1,148 @@
+"""
+Database triggers that maintain the Shopcart totals
+
+The total_price and item_count columns of a Shopcart are kept up to date
+by the database itself whenever rows of the item table are inserted,
+updated or deleted. This covers the ORM as well as bulk statements that
+never load the items into Python. Every change also bumps the version of
+the Shopcart so that its ETag changes with its items.
+"""
+
+from sqlalchemy import DDL, event
+from .item import Item
+
+######################################################################
+#  P O S T G R E S Q L
+######################################################################
+# Statement level triggers with transition tables apply one aggregated
+# UPDATE per statement no matter how many items it touched
+POSTGRESQL_FUNCTION = DDL(
+    """
+CREATE OR REPLACE FUNCTION shopcart_totals() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        UPDATE shopcart AS s
+        SET total_price = s.total_price + d.total_price,
+            item_count = s.item_count + d.item_count,
+            version = s.version + 1
+        FROM (
+            SELECT shopcart_id,
+                   SUM(quantity::bigint * price) AS total_price,
+                   COUNT(*) AS item_count
+            FROM new_items GROUP BY shopcart_id
+        ) AS d
+        WHERE s.id = d.shopcart_id;
+    ELSIF TG_OP = 'DELETE' THEN
+        UPDATE shopcart AS s
+        SET total_price = s.total_price - d.total_price,
+            item_count = s.item_count - d.item_count,
+            version = s.version + 1
+        FROM (
+            SELECT shopcart_id,
+                   SUM(quantity::bigint * price) AS total_price,
+                   COUNT(*) AS item_count
+            FROM old_items GROUP BY shopcart_id
+        ) AS d
+        WHERE s.id = d.shopcart_id;
+    ELSE
+        UPDATE shopcart AS s
+        SET total_price = s.total_price + d.total_price,
+            item_count = s.item_count + d.item_count,
+            version = s.version + 1
+        FROM (
+            SELECT shopcart_id,
+                   SUM(total_price) AS total_price,
+                   SUM(item_count) AS item_count
+            FROM (
+                SELECT shopcart_id, quantity::bigint * price AS total_price, 1 AS item_count
+                FROM new_items
+                UNION ALL
+                SELECT shopcart_id, -(quantity::bigint * price), -1
+                FROM old_items
+            ) AS changes
+            GROUP BY shopcart_id
+        ) AS d
+        WHERE s.id = d.shopcart_id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql
+"""
+)
+
+# The triggers by name, so that an upgrade can install the missing ones
+POSTGRESQL_TRIGGERS = {
+    "item_totals_insert": DDL(
+        "CREATE TRIGGER item_totals_insert AFTER INSERT ON item "
+        "REFERENCING NEW TABLE AS new_items "
+        "FOR EACH STATEMENT EXECUTE FUNCTION shopcart_totals()"
+    ),
+    "item_totals_update": DDL(
+        "CREATE TRIGGER item_totals_update AFTER UPDATE ON item "
+        "REFERENCING OLD TABLE AS old_items NEW TABLE AS new_items "
+        "FOR EACH STATEMENT EXECUTE FUNCTION shopcart_totals()"
+    ),
+    "item_totals_delete": DDL(
+        "CREATE TRIGGER item_totals_delete AFTER DELETE ON item "
+        "REFERENCING OLD TABLE AS old_items "
+        "FOR EACH STATEMENT EXECUTE FUNCTION shopcart_totals()"
+    ),
+}
+
+######################################################################
+#  S Q L I T E
+######################################################################
+SQLITE_TRIGGERS = {
+    "item_totals_insert": DDL(
+        """
+CREATE TRIGGER item_totals_insert AFTER INSERT ON item
+BEGIN
+    UPDATE shopcart
+    SET total_price = total_price + NEW.quantity * NEW.price,
+        item_count = item_count + 1,
+        version = version + 1
+    WHERE id = NEW.shopcart_id;
+END
+"""
+    ),
+    "item_totals_update": DDL(
+        """
+CREATE TRIGGER item_totals_update AFTER UPDATE ON item
+BEGIN
+    UPDATE shopcart
+    SET total_price = total_price - OLD.quantity * OLD.price,
+        item_count = item_count - 1,
+        version = version + 1
+    WHERE id = OLD.shopcart_id;
+    UPDATE shopcart
+    SET total_price = total_price + NEW.quantity * NEW.price,
+        item_count = item_count + 1,
+        version = version + 1
+    WHERE id = NEW.shopcart_id;
+END
+"""
+    ),
+    "item_totals_delete": DDL(
+        """
+CREATE TRIGGER item_totals_delete AFTER DELETE ON item
+BEGIN
+    UPDATE shopcart
+    SET total_price = total_price - OLD.quantity * OLD.price,
+        item_count = item_count - 1,
+        version = version + 1
+    WHERE id = OLD.shopcart_id;
+END
+"""
+    ),
+}
+
+# The triggers are installed right after the item table is created
+event.listen(
+    Item.__table__,
+    "after_create",
+    POSTGRESQL_FUNCTION.execute_if(dialect="postgresql"),
+)
+for trigger in POSTGRESQL_TRIGGERS.values():
+    event.listen(Item.__table__, "after_create", trigger.execute_if(dialect="postgresql"))
+for trigger in SQLITE_TRIGGERS.values():
+    event.listen(Item.__table__, "after_create", trigger.execute_if(dialect="sqlite"))
@@ -1,3 +1,4 @@
+# pylint: disable=too-many-lines
 ######################################################################
 # Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
 #
@@ -21,11 +22,28 @@ This service implements a REST API that allows you to Create, Read, Update
 and Delete YourResourceModel
 """
 
+import functools
+import hmac
+import io
 from flask import request
 from flask import current_app as app  # Import Flask application
-from flask_restx import Resource, fields, reqparse
-from service.models import Shopcart, Item
+from flask_restx import Resource, fields, reqparse, inputs
+from werkzeug.datastructures import WWWAuthenticate
+from werkzeug.exceptions import Unauthorized
+from werkzeug.http import quote_etag
+from sqlalchemy.orm.exc import StaleDataError
+from service.models import db, Shopcart, Item, DataValidationError
+from service.models.item import CONFLICT_MODES
+from service.models.shopcart import NAME_MATCHES
 from service.common import status  # HTTP Status Codes
+from service.common.bulk_import import READERS, import_shopcarts
+from service.common.db_pool import pool_stats
+from service.common.etags import held_etag, item_etag, shopcart_etag
+from service.common.fast_json import compile_model, json_response
+from service.common.metrics import render_metrics
+from service.common.query_budget import query_budget
+from service.common.static_assets import send_asset, send_index
+from service.common.write_coalescing import quantity_buffer
 from . import api  # pylint: disable=cyclic-import
 
 
@@ -38,6 +56,25 @@ def health_check():
     return {"status": 200, "message": "Healthy"}, 200
 
 
+######################################################################
+# GET CONNECTION POOL STATISTICS
+######################################################################
+@app.route("/health/pool")
+def pool_health():
+    """Returns the state and the wait statistics of the connection pool"""
+    return pool_stats(db.engine), status.HTTP_200_OK
+
+
+######################################################################
+# GET PROMETHEUS METRICS
+######################################################################
+@app.route("/metrics")
+def prometheus_metrics():
+    """Returns the request and database metrics in the Prometheus text format"""
+    body, content_type = render_metrics()
+    return body, status.HTTP_200_OK, {"Content-Type": content_type}
+
+
 ######################################################################
 # GET INDEX
 ######################################################################
@@ -45,7 +82,17 @@ def health_check():
 def index():
     """Root URL response"""
     app.logger.info("Request for Root URL")
-    return app.send_static_file("index.html")
+    # after `flask build-static` the page links the fingerprinted assets
+    return send_index(app.config["STATIC_BUILD_FOLDER"]) or app.send_static_file("index.html")
+
+
+######################################################################
+# GET FINGERPRINTED STATIC ASSETS
+######################################################################
+@app.route("/assets/<path:filename>")
+def static_asset(filename):
+    """Returns a static file built by `flask build-static`"""
+    return send_asset(app.config["STATIC_BUILD_FOLDER"], filename)
 
 
 create_item_model = api.model(
@@ -91,10 +138,70 @@ shopcart_model = api.inherit(
             readOnly=True,
             description="The unique ID for shopcart",
         ),
+        "total_price": fields.Integer(
+            readOnly=True,
+            description="Total price of the items in the shopcart",
+        ),
+        "item_count": fields.Integer(
+            readOnly=True,
+            description="Number of items in the shopcart",
+        ),
+    },
+)
+
+batch_error_model = api.model(
+    "ItemBatchError",
+    {
+        "index": fields.Integer(description="Position of the Item in the batch"),
+        "message": fields.String(description="Why the Item was rejected"),
+    },
+)
+
+item_batch_model = api.model(
+    "ItemBatch",
+    {
+        "items": fields.List(
+            fields.Nested(item_model),
+            description="Items that were created",
+        ),
+        "errors": fields.List(
+            fields.Nested(batch_error_model),
+            description="Items that were rejected",
+        ),
+    },
+)
+
+import_model = api.model(
+    "ShopcartImport",
+    {
+        "shopcarts": fields.Integer(description="Number of Shopcarts imported"),
+        "items": fields.Integer(description="Number of Items imported"),
+        "skipped": fields.Integer(description="Records skipped by a resumed import"),
+        "checkpoint": fields.Integer(description="Records of the source committed so far, where a resume continues"),
     },
 )
 
-shopcart_args = reqparse.RequestParser()
+# Serialize the model objects in one pass with the fields of the Swagger models
+serialize_item = compile_model(item_model)
+serialize_shopcart = compile_model(shopcart_model)
+
+shopcart_fields_args = reqparse.RequestParser()
+shopcart_fields_args.add_argument(
+    "fields",
+    type=str,
+    location="args",
+    required=False,
+    help="Comma separated fields of the Shopcarts to return, the id is always returned",
+)
+shopcart_fields_args.add_argument(
+    "include_items",
+    type=inputs.boolean,
+    location="args",
+    default=True,
+    help="Return the Items of the Shopcarts, false skips reading them",
+)
+
+shopcart_args = shopcart_fields_args.copy()
 shopcart_args.add_argument(
     "name",
     type=str,
@@ -102,6 +209,35 @@ shopcart_args.add_argument(
     required=False,
     help="Name of the Shopcart",
 )
+shopcart_args.add_argument(
+    "q",
+    type=str,
+    location="args",
+    required=False,
+    help="Text to search for in the names of the Shopcarts, ignoring the case",
+)
+shopcart_args.add_argument(
+    "match",
+    type=str,
+    location="args",
+    choices=NAME_MATCHES,
+    default="substring",
+    help="How q is searched: names that start with it, contain it or are similar to it",
+)
+shopcart_args.add_argument(
+    "limit",
+    type=inputs.positive,
+    location="args",
+    required=False,
+    help="Maximum number of Shopcarts to return",
+)
+shopcart_args.add_argument(
+    "cursor",
+    type=inputs.natural,
+    location="args",
+    required=False,
+    help="Cursor of the next page returned by the previous page",
+)
 
 item_args = reqparse.RequestParser()
 item_args.add_argument(
@@ -118,6 +254,78 @@ item_args.add_argument(
     required=False,
     help="Price the Item",
 )
+item_args.add_argument(
+    "price_min",
+    type=int,
+    location="args",
+    required=False,
+    help="Lowest price of the Items",
+)
+item_args.add_argument(
+    "price_max",
+    type=int,
+    location="args",
+    required=False,
+    help="Highest price of the Items",
+)
+item_args.add_argument(
+    "quantity_gte",
+    type=int,
+    location="args",
+    required=False,
+    help="Lowest quantity of the Items",
+)
+
+item_create_args = reqparse.RequestParser()
+item_create_args.add_argument(
+    "on_conflict",
+    type=str,
+    location="args",
+    choices=CONFLICT_MODES,
+    default="error",
+    help="When the Shopcart already holds the product: error, increment the quantity or replace the line",
+)
+
+batch_args = reqparse.RequestParser()
+batch_args.add_argument(
+    "atomic",
+    type=inputs.boolean,
+    location="args",
+    required=False,
+    default=True,
+    help="Reject the whole batch when any Item is not valid",
+)
+
+import_args = reqparse.RequestParser()
+import_args.add_argument(
+    "source",
+    type=str,
+    location="args",
+    required=True,
+    help="Name under which the progress of the import is checkpointed",
+)
+import_args.add_argument(
+    "format",
+    type=str,
+    location="args",
+    choices=list(READERS),
+    default="ndjson",
+    help="Format of the request body",
+)
+import_args.add_argument(
+    "batch_size",
+    type=inputs.positive,
+    location="args",
+    default=1000,
+    help="Shopcarts written per transaction",
+)
+import_args.add_argument(
+    "resume",
+    type=inputs.boolean,
+    location="args",
+    default=False,
+    help="Skip the records committed by an earlier run of the same source",
+)
 
 ######################################################################
 #  PATH: /shopcarts/{id}
@@ -139,9 +347,14 @@ class ShopcartResource(Resource):
     # ------------------------------------------------------------------
     # RETRIEVE A SHOPCART
     # ------------------------------------------------------------------
+    # the version of If-None-Match, then the Shopcart and its items
+    @query_budget(3)
     @api.doc("get_shopcarts")
+    @api.expect(shopcart_fields_args, validate=True)
+    @api.response(200, "Success", shopcart_model)
+    @api.response(304, "Shopcart not modified since the If-None-Match ETag")
+    @api.response(400, "The fields were not valid")
     @api.response(404, "Shopcart not found")
-    @api.marshal_with(shopcart_model)
     def get(self, shopcart_id):
         """
         Retrieve a single Shopcart
@@ -150,29 +363,54 @@ class ShopcartResource(Resource):
         """
 
         app.logger.info("Request to Retrieve a shopcart with id: %s", shopcart_id)
-        shopcart = Shopcart.find(shopcart_id)
-        if not shopcart:
+        names = requested_fields(shopcart_fields_args.parse_args())
+
+        # answer revalidations from the version alone without loading the items
+        version = None
+        if request.if_none_match:
+            version = Shopcart.find_version(shopcart_id)
+            etag = shopcart_etag(shopcart_id, version)
+            held = held_etag(request.if_none_match, etag, weak=True) if version is not None else None
+            if held:
+                return not_modified(held)
+
+        if "items" in names:
+            # the whole Shopcart, which the read cache may hold
+            found = Shopcart.find_serialized(shopcart_id, serialize_shopcart, version)
+        else:
+            shopcart = Shopcart.find_columns(shopcart_id, *names, "version")
+            found = shopcart and {"version": shopcart.version, "shopcart": serialize_fields(names)(shopcart)}
+        if not found:
             abort(
                 status.HTTP_404_NOT_FOUND,
                 f"Shopcart with id {shopcart_id} was not found",
             )
 
-        app.logger.info("Returning shopcart: %s", shopcart.name)
-        return shopcart.serialize(), status.HTTP_200_OK
+        app.logger.info("Returning shopcart: %s", shopcart_id)
+        body = {name: found["shopcart"][name] for name in names}
+        etag = shopcart_etag(shopcart_id, found["version"])
+        return json_response(body, status.HTTP_200_OK, {"ETag": quote_etag(etag)})
 
     # ------------------------------------------------------------------
     # UPDATE AN EXISTING SHOPCART
     # ------------------------------------------------------------------
+    # the Shopcart, its items and their write, then the reload of both for
+    # the response; every Item that the body adds or changes adds a statement
+    @query_budget(7)
     @api.doc("update_shopcarts")
     @api.response(404, "Shopcart not found")
     @api.response(400, "The posted Shopcart data was not valid")
+    @api.response(409, "Shopcart changed by another request while it was updated")
+    @api.response(412, "Shopcart changed since the If-Match ETag")
     @api.expect(shopcart_model)
-    @api.marshal_with(shopcart_model)
+    @api.response(200, "Success", shopcart_model)
     def put(self, shopcart_id):
         """
         Update a Shopcart
 
-        This endpoint will update an Shopcart based on the body that is posted
+        This endpoint will update an Shopcart based on the body that is posted.
+        The Items of the body update the lines of the same product and add
+        the other products, so the body of a GET can be sent back.
         """
 
         app.logger.info("Request to update shopcart with id: %s", shopcart_id)
@@ -182,20 +420,26 @@ class ShopcartResource(Resource):
                 status.HTTP_404_NOT_FOUND,
                 f"shopcart with id '{shopcart_id}' was not found.",
             )
+        check_if_match(shopcart_etag(shopcart.id, shopcart.version))
 
-        app.logger.info("Processing: %s", api.payload)
+        log_payload(api.payload)
 
         shopcart.deserialize(api.payload)
         shopcart.id = shopcart_id
         shopcart.update()
 
-        return shopcart.serialize(), status.HTTP_200_OK
+        body = serialize_shopcart(shopcart)
+        etag = shopcart_etag(shopcart.id, shopcart.version)
+        return json_response(body, status.HTTP_200_OK, {"ETag": quote_etag(etag)})
 
     # ------------------------------------------------------------------
     # DELETE A SHOPCART
     # ------------------------------------------------------------------
+    @query_budget(2)
     @api.doc("delete_shopcarts")
     @api.response(204, "Shopcart deleted")
+    @api.response(409, "Shopcart changed by another request while it was deleted")
+    @api.response(412, "Shopcart changed since the If-Match ETag")
     def delete(self, shopcart_id):
         """
         Delete a Shopcart
@@ -205,6 +449,7 @@ class ShopcartResource(Resource):
 
         app.logger.info("Request to Delete a shopcart with id: %s", shopcart_id)
         shopcart = Shopcart.find(shopcart_id)
+        check_if_match(shopcart_etag(shopcart.id, shopcart.version) if shopcart else None)
         if shopcart:
             app.logger.info("Shopcart with ID: %d found", shopcart_id)
             shopcart.delete()
@@ -222,36 +467,69 @@ class ShopcartCollection(Resource):
     # ------------------------------------------------------------------
     # LIST ALL SHOPCARTS
     # ------------------------------------------------------------------
+    # a fuzzy search looks up pg_trgm before the Shopcarts and their items
+    @query_budget(3)
     @api.doc("list_shopcarts")
+    @api.response(400, "The pagination, search or fields arguments were not valid")
     @api.expect(shopcart_args, validate=True)
-    @api.marshal_list_with(shopcart_model)
+    @api.response(200, "Success", [shopcart_model])
     def get(self):
-        """Returns all of the Shopcarts"""
+        """Returns all of the Shopcarts
+
+        With q the Shopcarts are searched by name, best matches first
+        """
 
         app.logger.info("Request for Shopcart list")
-        shopcarts = []
 
         args = shopcart_args.parse_args()
+        names = requested_fields(args)
+        # without the items only the requested columns are read
+        query = Shopcart.with_items() if "items" in names else Shopcart.select_columns(*names)
+        limit = min(
+            args["limit"] or app.config["DEFAULT_PAGE_SIZE"],
+            app.config["MAX_PAGE_SIZE"],
+        )
 
-        if args["name"]:
-            app.logger.info("Filtering by name: %s", args["name"])
-            shopcarts = Shopcart.find_by_name(args["name"])
+        if args["q"] and args["name"]:
+            abort(status.HTTP_400_BAD_REQUEST, "Filter by either name or q.")
+        if args["q"]:
+            # ranked results are paged by their position instead of their id
+            app.logger.info("Searching names for: %s", args["q"])
+            query = Shopcart.search_by_name(args["q"], args["match"], query)
+            shopcarts, next_cursor = Shopcart.paginate_offset(query, limit, args["cursor"])
         else:
-            app.logger.info("Returning unfiltered list")
-            shopcarts = Shopcart.all()
+            shopcarts, next_cursor = Shopcart.paginate(filter_by_name(args["name"], query), limit, args["cursor"])
 
-        shopcarts = [shopcart.serialize() for shopcart in shopcarts]
+        serialize = serialize_fields(names)
+        shopcarts = [serialize(shopcart) for shopcart in shopcarts]
         app.logger.info("Returning [%d] shopcarts", len(shopcarts))
 
-        return shopcarts, status.HTTP_200_OK
+        headers = {}
+        if next_cursor is not None:
+            next_url = api.url_for(
+                ShopcartCollection,
+                name=args["name"],
+                q=args["q"],
+                match=args["match"] if args["q"] else None,
+                fields=args["fields"],
+                include_items=None if args["include_items"] else "false",
+                limit=limit,
+                cursor=next_cursor,
+                _external=True,
+            )
+            headers["Link"] = f'<{next_url}>; rel="next"'
+            headers["X-Next-Cursor"] = str(next_cursor)
+
+        return json_response(shopcarts, status.HTTP_200_OK, headers)
 
     # ------------------------------------------------------------------
     # CREATE A NEW SHOPCART
     # ------------------------------------------------------------------
+    @query_budget(4)
     @api.doc("create_shopcarts")
     @api.response(400, "The posted Shopcart data was not valid")
     @api.expect(create_shopcart_model)
-    @api.marshal_with(shopcart_model, code=201)
+    @api.response(201, "Shopcart created", shopcart_model)
     def post(self):
         """
         Creates a Shopcart
@@ -260,7 +538,7 @@ class ShopcartCollection(Resource):
         """
 
         app.logger.info("Request to create a Shopcart")
-        app.logger.info("Processing: %s", api.payload)
+        log_payload(api.payload)
 
         shopcart = Shopcart()
         shopcart.deserialize(request.get_json())
@@ -271,7 +549,9 @@ class ShopcartCollection(Resource):
             ShopcartResource, shopcart_id=shopcart.id, _external=True
         )
 
-        return shopcart.serialize(), status.HTTP_201_CREATED, {"Location": location_url}
+        return json_response(
+            serialize_shopcart(shopcart), status.HTTP_201_CREATED, {"Location": location_url}
+        )
 
 
 ######################################################################
@@ -284,8 +564,12 @@ class ClearResource(Resource):
     Clear action on a Shopcart
     """
 
+    @query_budget(4)
     @api.doc("clear_shopcarts")
+    @api.response(200, "Success", shopcart_model)
     @api.response(404, "Shopcart not found")
+    @api.response(409, "Shopcart changed by another request while it was cleared")
+    @api.response(412, "Shopcart changed since the If-Match ETag")
     def put(self, shopcart_id):
         """
         Clear a Shopcart
@@ -297,14 +581,20 @@ class ClearResource(Resource):
         shopcart = Shopcart.find(shopcart_id)
         if not shopcart:
             abort(status.HTTP_404_NOT_FOUND, f"No such shopcart : {shopcart_id}.")
+        check_if_match(shopcart_etag(shopcart.id, shopcart.version))
 
-        for item in shopcart.items:
-            item.delete()
+        try:
+            shopcart.clear()
+        except StaleDataError:
+            # the Shopcart changed after its ETag was checked
+            if request.if_match:
+                abort(
+                    status.HTTP_412_PRECONDITION_FAILED,
+                    "The resource was changed since it was read, read it again and retry",
+                )
+            raise
 
-        shopcart.id = shopcart_id
-        shopcart.update()
-
-        return shopcart.serialize(), status.HTTP_200_OK
+        return json_response(serialize_shopcart(shopcart), status.HTTP_200_OK)
 
 
 ######################################################################
@@ -317,6 +607,7 @@ class CalculateTotalPriceResource(Resource):
     Calculate total price for selected or all items in a Shopcart
     """
 
+    @query_budget(1)
     @api.doc("calculate_total_price")
     @api.response(404, "Shopcart not found")
     def get(self, shopcart_id):
@@ -329,11 +620,10 @@ class CalculateTotalPriceResource(Resource):
             "Request to calculate total price for all items in Shopcart %s", shopcart_id
         )
 
-        shopcart = Shopcart.find(shopcart_id)
-        if not shopcart:
+        total_price = Shopcart.calculate_total_price(shopcart_id)
+        if total_price is None:
             abort(status.HTTP_404_NOT_FOUND, f"No such shopcart: {shopcart_id}.")
 
-        total_price = Shopcart.calculate_total_price(shopcart_id)
         app.logger.info(
             "Total price for all items in Shopcart %s is %d", shopcart_id, total_price
         )
@@ -360,9 +650,11 @@ class ItemResource(Resource):
     # ------------------------------------------------------------------
     # RETRIEVE AN ITEM FROM A SHOPCART
     # ------------------------------------------------------------------
+    @query_budget(2)
     @api.doc("get_items")
+    @api.response(200, "Success", item_model)
+    @api.response(304, "Item not modified since the If-None-Match ETag")
     @api.response(404, "Item not found")
-    @api.marshal_with(item_model)
     def get(self, shopcart_id, item_id):
         """
         Retrieve a Item from Shopcart
@@ -372,6 +664,13 @@ class ItemResource(Resource):
             "Request to retrieve Item %s for Account id: %s", (item_id, shopcart_id)
         )
 
+        if request.if_none_match:
+            version = Item.find_version(item_id)
+            etag = item_etag(item_id, version)
+            held = held_etag(request.if_none_match, etag, weak=True) if version is not None else None
+            if held:
+                return not_modified(held)
+
         item = Item.find(item_id)
         if not item:
             abort(
@@ -379,16 +678,21 @@ class ItemResource(Resource):
                 f"Account with id '{item_id}' could not be found.",
             )
 
-        return item.serialize(), status.HTTP_200_OK
+        etag = item_etag(item.id, item.version)
+        return json_response(serialize_item(item), status.HTTP_200_OK, {"ETag": quote_etag(etag)})
 
     # ------------------------------------------------------------------
     # UPDATE A SHOPCART ITEM
     # ------------------------------------------------------------------
+    @query_budget(4)
     @api.doc("update_item")
     @api.response(404, "Item not found")
     @api.response(400, "The Item data was not valid")
+    @api.response(409, "Item changed by another request while it was updated")
+    @api.response(412, "Item changed since the If-Match ETag")
     @api.expect(item_model)
-    @api.marshal_with(item_model)
+    @api.response(200, "Success", item_model)
+    @api.response(202, "Quantity accepted, written with the next flush of the write coalescing buffer", item_model)
     def put(self, shopcart_id, item_id):
         """
         Update an Item
@@ -405,16 +709,30 @@ class ItemResource(Resource):
                 f"Item with id '{item_id}' could not be found.",
             )
 
+        buffered = coalesce_quantity(shopcart_id, item, api.payload)
+        if buffered:
+            # only in memory until the flush, which also changes the version,
+            # so there is no ETag yet
+            return json_response(serialize_item(buffered), status.HTTP_202_ACCEPTED)
+        # a quantity written later must not overwrite this update
+        if quantity_buffer().flush(shopcart_id):
+            db.session.refresh(item)
+        check_if_match(item_etag(item.id, item.version))
+
         item.deserialize(api.payload)
         item.update()
 
-        return item.serialize(), status.HTTP_200_OK
+        body = serialize_item(item)
+        return json_response(body, status.HTTP_200_OK, {"ETag": quote_etag(item_etag(item.id, item.version))})
 
     # ------------------------------------------------------------------
     # DELETE A SHOPCART ITEM
     # ------------------------------------------------------------------
+    @query_budget(3)
     @api.doc("delete_item")
     @api.response(204, "Item deleted")
+    @api.response(409, "Item changed by another request while it was deleted")
+    @api.response(412, "Item changed since the If-Match ETag")
     def delete(self, shopcart_id, item_id):
         """
         Delete an Item from a Shopcart
@@ -432,6 +750,7 @@ class ItemResource(Resource):
             )
 
         item = Item.query.filter_by(id=item_id, shopcart_id=shopcart_id).first()
+        check_if_match(item_etag(item.id, item.version) if item else None)
         if item:
             # Delete the item if it exists
             item.delete()
@@ -457,9 +776,10 @@ class ItemCollection(Resource):
     # ------------------------------------------------------------------
     # LIST ALL ITEMS IN A SHOPCART
     # ------------------------------------------------------------------
+    @query_budget(2)
     @api.doc("list_shopcart_items")
     @api.expect(item_args, validate=True)
-    @api.marshal_list_with(item_model)
+    @api.response(200, "Success", [item_model])
     def get(self, shopcart_id):
         """
         List all items in a Shopcart
@@ -475,67 +795,177 @@ class ItemCollection(Resource):
                 f"Shopcart with id '{shopcart_id}' was not found.",
             )
 
-        items = shopcart.items
-
-        # Get the query parameters
+        # Get the query parameters and let the database do the filtering
         args = item_args.parse_args()
-        quantity = args.get("quantity")
-        price = args.get("price")
+        app.logger.info("Filtering by: %s", args)
+        items = Item.find_by_shopcart_id(shopcart_id, **args)
 
-        if quantity:
-            app.logger.info("Filtering by quantity: %s", quantity)
-            items = [item for item in items if item.quantity == quantity]
-        if price:
-            app.logger.info("Filtering by price: %s", price)
-            items = [item for item in items if item.price == price]
-
-        result = [item.serialize() for item in items]
+        result = [serialize_item(item) for item in items]
 
         app.logger.info("Returning %d items from Shopcart %s", len(result), shopcart_id)
 
-        return result, status.HTTP_200_OK
+        return json_response(result, status.HTTP_200_OK)
 
     # ------------------------------------------------------------------
     # CREATE AN ITEM
     # ------------------------------------------------------------------
+    @query_budget(2)
     @api.doc("create_shopcart_items")
     @api.response(400, "The posted Shopcart Item data was not valid")
-    @api.expect(create_item_model)
-    @api.marshal_with(item_model, code=201)
+    @api.response(404, "Shopcart not found")
+    @api.response(409, "The Shopcart already holds the product and on_conflict is error")
+    @api.expect(item_create_args, create_item_model)
+    @api.response(201, "Item created or merged into the line of the same product", item_model)
     def post(self, shopcart_id):
         """
         Create a Item on a Shopcart
+
+        A Shopcart holds every product once. Adding a product again is
+        rejected unless on_conflict asks to increment the quantity of its
+        line or to replace the line, which takes a single statement.
         """
         app.logger.info(
             "Request to create a Item for Shopcart with id: %s", shopcart_id
         )
+        args = item_create_args.parse_args()
 
-        shopcart = Shopcart.find(shopcart_id)
-        if not shopcart:
+        if Shopcart.find_version(shopcart_id) is None:
             abort(
                 status.HTTP_404_NOT_FOUND,
                 f"Shopcart with id '{shopcart_id}' could not be found.",
             )
 
         data = api.payload
-
-        app.logger.info("Processing: %s", data)
+        log_payload(data)
 
         item = Item()
         item.deserialize(data)
+        item.shopcart_id = shopcart_id
 
-        shopcart.items.append(item)
-        shopcart.update()
+        line = Item.upsert(item, args["on_conflict"])
+        if line is None:
+            abort(
+                status.HTTP_409_CONFLICT,
+                f"Shopcart '{shopcart_id}' already holds item '{item.item_id}', "
+                "post it with on_conflict=increment or on_conflict=replace.",
+            )
 
         # Return the location of the new item
         location_url = api.url_for(
             ItemResource,
-            item_id=item.id,
+            item_id=line.id,
             shopcart_id=shopcart_id,
             _external=True,
         )
 
-        return item.serialize(), status.HTTP_201_CREATED, {"Location": location_url}
+        return json_response(serialize_item(line), status.HTTP_201_CREATED, {"Location": location_url})
+
+
+######################################################################
+#  BATCH ACTION => PATH: /shopcarts/{id}/items:batch
+######################################################################
+@api.route("/shopcarts/<int:shopcart_id>/items:batch")
+@api.param("shopcart_id", "The Shopcart identifier")
+class ItemBatchResource(Resource):
+    """Adds many Items to a Shopcart at once"""
+
+    @query_budget(2)
+    @api.doc("create_shopcart_items_batch")
+    @api.response(404, "Shopcart not found")
+    @api.response(400, "The posted Items were not valid", item_batch_model)
+    @api.response(207, "Some of the posted Items were not valid", item_batch_model)
+    @api.response(413, "Too many Items in the batch")
+    @api.expect(batch_args, [create_item_model])
+    @api.response(201, "Items created", item_batch_model)
+    def post(self, shopcart_id):
+        """
+        Create many Items on a Shopcart
+
+        All valid Items are inserted with a single statement. With atomic=true
+        (the default) one invalid Item rejects the whole batch, otherwise the
+        valid Items are created and the rejected ones are reported by position.
+        An Item is invalid when an earlier Item of the batch or the Shopcart
+        holds its product.
+        """
+        app.logger.info(
+            "Request to create a batch of Items for Shopcart with id: %s", shopcart_id
+        )
+        shopcart = Shopcart.find(shopcart_id)
+        if not shopcart:
+            abort(
+                status.HTTP_404_NOT_FOUND,
+                f"Shopcart with id '{shopcart_id}' could not be found.",
+            )
+
+        lines = api.payload
+        if not isinstance(lines, list):
+            abort(status.HTTP_400_BAD_REQUEST, "The batch must be a list of Items.")
+        if len(lines) > app.config["MAX_BATCH_SIZE"]:
+            abort(
+                status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                f"A batch can hold at most {app.config['MAX_BATCH_SIZE']} Items.",
+            )
+
+        atomic = batch_args.parse_args()["atomic"]
+        positions, errors = deserialize_items(shopcart_id, lines)
+        if positions and not (errors and atomic):
+            # the products that the Shopcart already holds are skipped
+            skipped = {id(item) for item in Item.create_batch(list(positions.values()), atomic)}
+            errors.extend(
+                {"index": position, "message": f"Invalid Item: product {item.item_id} is already in the Shopcart"}
+                for position, item in positions.items()
+                if id(item) in skipped
+            )
+            errors.sort(key=lambda error: error["index"])
+        if errors and atomic:
+            app.logger.info("Rejecting batch with %d invalid Items", len(errors))
+            return json_response({"items": [], "errors": errors}, status.HTTP_400_BAD_REQUEST)
+
+        items = [item for item in positions.values() if item.id is not None]
+        app.logger.info("Created %d Items in Shopcart %s", len(items), shopcart_id)
+
+        result = {"items": [serialize_item(item) for item in items], "errors": errors}
+        if errors:
+            return json_response(result, status.HTTP_207_MULTI_STATUS)
+        return json_response(result, status.HTTP_201_CREATED)
+
+
+######################################################################
+#  IMPORT ACTION => PATH: /admin/shopcarts:import
+######################################################################
+@api.route("/admin/shopcarts:import")
+class ShopcartImportResource(Resource):
+    """Bulk import of Shopcarts from another system"""
+
+    @api.doc("import_shopcarts", security="bearer")
+    @api.response(400, "The posted Shopcarts were not valid")
+    @api.response(401, "The Authorization header does not hold the admin token")
+    @api.response(403, "Imports are disabled because ADMIN_API_TOKEN is not set")
+    @api.expect(import_args)
+    @api.marshal_with(import_model)
+    def post(self):
+        """
+        Import Shopcarts
+
+        This endpoint streams Shopcarts and their Items from an NDJSON or CSV
+        body into the database in batches and returns how many it imported.
+        It needs the ADMIN_API_TOKEN as a Bearer token.
+        """
+        check_admin_token()
+        args = import_args.parse_args()
+        app.logger.info("Request to import shopcarts from %s", args["source"])
+
+        # the new ids are not collected, so the response stays small for any
+        # body; `flask db-import --id-map` records them
+        lines = io.TextIOWrapper(request.stream, encoding="utf-8")
+        stats = import_shopcarts(
+            READERS[args["format"]](lines),
+            args["source"],
+            batch_size=args["batch_size"],
+            resume=args["resume"],
+        )
+
+        return stats, status.HTTP_200_OK
 
 
 ######################################################################
@@ -547,3 +977,123 @@ def abort(error_code: int, message: str):
     """Logs errors before aborting"""
     app.logger.error(message)
     api.abort(error_code, message)
+
+
+def log_payload(payload) -> None:
+    """Logs a request body when LOG_PAYLOADS is on"""
+    if app.config["LOG_PAYLOADS"]:
+        app.logger.info("Processing: %s", payload)
+
+
+def deserialize_items(shopcart_id: int, lines: list) -> tuple:
+    """Deserializes a batch of Items and collects the errors by position
+
+    Returns:
+        tuple: the valid Items by position and the errors
+    """
+    items, errors, products = {}, [], {}
+    for position, line in enumerate(lines):
+        try:
+            if not isinstance(line, dict):
+                raise DataValidationError("Invalid Item: must be an object")
+            item = Item()
+            item.deserialize({**line, "shopcart_id": shopcart_id})
+            if item.item_id in products:
+                raise DataValidationError(
+                    f"Invalid Item: product {item.item_id} is repeated from index {products[item.item_id]}"
+                )
+            products[item.item_id] = position
+            items[position] = item
+        except DataValidationError as error:
+            errors.append({"index": position, "message": str(error)})
+    return items, errors
+
+
+def filter_by_name(name: str, query):
+    """Filters a query of Shopcarts by name when a name is given"""
+    if name:
+        app.logger.info("Filtering by name: %s", name)
+        return Shopcart.find_by_name(name, query)
+    app.logger.info("Returning unfiltered list")
+    return query
+
+
+def requested_fields(args) -> tuple:
+    """Returns the fields of shopcart_model that ?fields= and ?include_items= ask for
+
+    The fields keep the order of the model and always include the id.
+    Aborts with 400 Bad Request when a field is not in the model.
+    """
+    model = shopcart_model.resolved
+    names = set(model)
+    if args["fields"]:
+        names = {name.strip() for name in args["fields"].split(",") if name.strip()}
+        unknown = names.difference(model)
+        if unknown:
+            abort(status.HTTP_400_BAD_REQUEST, f"Unknown fields: {', '.join(sorted(unknown))}")
+        names.add("id")
+    if not args["include_items"]:
+        names.discard("items")
+    return tuple(name for name in model if name in names)
+
+
+@functools.lru_cache(maxsize=None)
+def serialize_fields(names: tuple):
+    """Returns a compiled serializer of some of the fields of shopcart_model"""
+    model = shopcart_model.resolved
+    return compile_model({name: model[name] for name in names})
+
+
+def coalesce_quantity(shopcart_id: int, item: Item, payload: dict):
+    """Buffers an update that only changes the quantity of an Item
+
+    Returns:
+        the updated Item, which is not in the session, or None when the
+        update has to be written at once
+    """
+    buffer = quantity_buffer()
+    if not buffer.enabled or request.if_match or item.shopcart_id != shopcart_id:
+        return None
+    updated = Item().deserialize(payload)
+    if any(getattr(updated, name) != getattr(item, name) for name in ("shopcart_id", "item_id", "description", "price")):
+        return None
+    app.logger.info("Buffering quantity %s of Item %s", updated.quantity, item.id)
+    buffer.put(shopcart_id, item.id, updated.quantity)
+    updated.id, updated.version = item.id, item.version
+    return updated
+
+
+def check_if_match(etag: str = None) -> None:
+    """Aborts with 412 Precondition Failed unless If-Match holds the current entity tag
+
+    Args:
+        etag (str): the entity tag of the resource, or None if it does not exist
+    """
+    if request.if_match and (etag is None or held_etag(request.if_match, etag) is None):
+        abort(
+            status.HTTP_412_PRECONDITION_FAILED,
+            "The resource was changed since it was read, read it again and retry",
+        )
+
+
+def check_admin_token() -> None:
+    """Aborts unless the request authorizes itself with the ADMIN_API_TOKEN"""
+    token = app.config["ADMIN_API_TOKEN"]
+    if not token:
+        abort(status.HTTP_403_FORBIDDEN, "The admin endpoints are disabled")
+    authorization = request.authorization
+    if (
+        authorization is None
+        or authorization.type != "bearer"
+        or not hmac.compare_digest((authorization.token or "").encode(), token.encode())
+    ):
+        app.logger.error("Admin request without a valid token")
+        raise Unauthorized("A valid admin Bearer token is required", www_authenticate=WWWAuthenticate("bearer"))
+
+
+def not_modified(etag: str):
+    """Returns an empty 304 Not Modified response with the entity tag the client holds"""
+    app.logger.info("Returning 304 Not Modified for %s", etag)
+    response = app.response_class(status=status.HTTP_304_NOT_MODIFIED)
+    response.set_etag(etag)
+    return response
@@ -187,10 +187,11 @@ $(function () {
     $("#search-btn").click(function () {
         let shopcart_name = $("#shopcart_name").val();
 
-        let queryString = "";
+        // the list only shows the ids and the names
+        let queryString = "fields=id,name";
 
         if (shopcart_name) {
-            queryString += 'name=' + shopcart_name;
+            queryString += '&name=' + shopcart_name;
         }
 
         // if (product_name) {
@@ -204,7 +205,7 @@ $(function () {
 
         let ajax = $.ajax({
             type: "GET",
-            url: `/api/shopcarts${queryString ? '?' + queryString : ''}`,
+            url: `/api/shopcarts?${queryString}`,
             contentType: "application/json",
             data: ''
         });
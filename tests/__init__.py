@@ -0,0 +1,10 @@
+"""
+Test package
+
+The service leaves the schema to `flask db-init`, the tests let the app
+create its tables when it starts
+"""
+
+import os
+
+os.environ.setdefault("DB_CREATE_TABLES", "true")
@@ -42,7 +42,7 @@ class ItemFactory(Factory):
 
     id = Sequence(lambda n: n)
     shopcart_id = None
-    item_id = FuzzyInteger(1, 20)
+    item_id = Sequence(lambda n: n + 1)
     description = FuzzyText(length=12)
     quantity = FuzzyInteger(1, 30)
     price = FuzzyInteger(100, 1000)
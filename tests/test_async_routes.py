@@ -0,0 +1,317 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+ASGI Server Tests
+"""
+
+# pylint: disable=duplicate-code
+import logging
+from unittest import IsolatedAsyncioTestCase
+from sqlalchemy import delete
+from asgi import app
+from service.common import status
+from service.models import async_db, db, Shopcart, DataValidationError
+from tests.factories import ShopcartFactory, ItemFactory
+
+BASE_URL = "/api/shopcarts"
+
+
+######################################################################
+#  T E S T   C A S E S
+######################################################################
+class TestAsyncShopcartService(IsolatedAsyncioTestCase):
+    """ASGI Server Tests"""
+
+    @classmethod
+    def setUpClass(cls):
+        """Run once before all tests"""
+        app.config["TESTING"] = True
+        app.logger.setLevel(logging.CRITICAL)
+
+    async def asyncSetUp(self):
+        """Runs before each test"""
+        self.client = app.test_client()
+        async with async_db.engine.begin() as connection:
+            await connection.run_sync(db.metadata.create_all)
+            await connection.execute(delete(Shopcart))
+
+    async def asyncTearDown(self):
+        """This runs after each test"""
+        # every test runs on an event loop of its own
+        await async_db.dispose()
+
+    async def _create_shopcart(self, item_count=0) -> dict:
+        """Creates a Shopcart with items through the API"""
+        shopcart = ShopcartFactory()
+        data = {
+            "name": shopcart.name,
+            "items": [
+                {
+                    "shopcart_id": 0,
+                    "item_id": item.item_id,
+                    "description": item.description,
+                    "quantity": item.quantity,
+                    "price": item.price,
+                }
+                for item in ItemFactory.build_batch(item_count, id=None, shopcart=None)
+            ],
+        }
+        response = await self.client.post(BASE_URL, json=data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return await response.get_json()
+
+    ######################################################################
+    #  S H O P C A R T   T E S T   C A S E S
+    ######################################################################
+
+    async def test_health(self):
+        """It should be healthy"""
+        response = await self.client.get("/health")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual((await response.get_json())["message"], "Healthy")
+
+    async def test_create_shopcart(self):
+        """It should Create a Shopcart with its items and totals"""
+        shopcart = await self._create_shopcart(item_count=2)
+        self.assertEqual(len(shopcart["items"]), 2)
+        self.assertEqual(shopcart["item_count"], 2)
+        expected = sum(item["quantity"] * item["price"] for item in shopcart["items"])
+        self.assertEqual(shopcart["total_price"], expected)
+
+        response = await self.client.get(f"{BASE_URL}/{shopcart['id']}")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(await response.get_json(), shopcart)
+
+    async def test_create_bad_shopcart(self):
+        """It should not Create a Shopcart without a name"""
+        response = await self.client.post(BASE_URL, json={"items": []})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    async def test_get_shopcart_not_found(self):
+        """It should return 404 for a missing Shopcart"""
+        response = await self.client.get(f"{BASE_URL}/0")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertIn("was not found", (await response.get_json())["message"])
+
+    async def test_list_shopcarts(self):
+        """It should page through the Shopcarts and filter them by name"""
+        shopcarts = [await self._create_shopcart(item_count=1) for _ in range(3)]
+        response = await self.client.get(BASE_URL, query_string={"limit": 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(await response.get_json()), 2)
+        cursor = response.headers["X-Next-Cursor"]
+
+        response = await self.client.get(BASE_URL, query_string={"limit": 2, "cursor": cursor})
+        self.assertEqual([shopcart["id"] for shopcart in await response.get_json()], [shopcarts[2]["id"]])
+        self.assertNotIn("Link", response.headers)
+
+        response = await self.client.get(BASE_URL, query_string={"name": shopcarts[0]["name"]})
+        self.assertIn(shopcarts[0], await response.get_json())
+
+        response = await self.client.get(BASE_URL, query_string={"limit": "zero"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = await self.client.get(BASE_URL, query_string={"limit": 0})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    async def test_update_shopcart(self):
+        """It should Update the name of a Shopcart"""
+        shopcart = await self._create_shopcart(item_count=1)
+        response = await self.client.put(f"{BASE_URL}/{shopcart['id']}", json={"name": "renamed", "items": []})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual((await response.get_json())["name"], "renamed")
+
+    async def test_delete_shopcart(self):
+        """It should Delete a Shopcart"""
+        shopcart = await self._create_shopcart()
+        response = await self.client.delete(f"{BASE_URL}/{shopcart['id']}")
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        response = await self.client.get(f"{BASE_URL}/{shopcart['id']}")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    async def test_clear_and_total_price(self):
+        """It should report the total price and clear a Shopcart"""
+        shopcart = await self._create_shopcart(item_count=2)
+        response = await self.client.get(f"{BASE_URL}/{shopcart['id']}/calculate_total_price")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual((await response.get_json())["total_price"], shopcart["total_price"])
+
+        response = await self.client.put(f"{BASE_URL}/{shopcart['id']}/clear")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = await response.get_json()
+        self.assertEqual(data["items"], [])
+        self.assertEqual(data["total_price"], 0)
+
+        response = await self.client.get(f"{BASE_URL}/0/calculate_total_price")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    async def test_shopcart_conditional_requests(self):
+        """It should answer If-None-Match and If-Match on a Shopcart like the WSGI service"""
+        shopcart = await self._create_shopcart(item_count=1)
+        url = f"{BASE_URL}/{shopcart['id']}"
+        response = await self.client.get(url)
+        etag = response.headers["ETag"]
+        self.assertRegex(etag, rf'^"shopcart-{shopcart["id"]}-\d+"$')
+
+        response = await self.client.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response.headers["ETag"], etag)
+        response = await self.client.get(f"{BASE_URL}/0", headers={"If-None-Match": "*"})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        response = await self.client.put(url, json={"name": "renamed", "items": []}, headers={"If-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response.headers["ETag"], etag)
+        response = await self.client.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        # the ETag that the update replaced no longer matches
+        for method in (self.client.put, self.client.delete):
+            response = await method(url, json={"name": "stale", "items": []}, headers={"If-Match": etag})
+            self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        response = await self.client.put(f"{url}/clear", headers={"If-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        response = await self.client.delete(f"{BASE_URL}/0", headers={"If-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        self.assertEqual((await (await self.client.get(url)).get_json())["name"], "renamed")
+
+    ######################################################################
+    #  I T E M   T E S T   C A S E S
+    ######################################################################
+
+    async def test_item_lifecycle(self):
+        """It should Create, Read, Update, List and Delete an Item"""
+        shopcart = await self._create_shopcart()
+        url = f"{BASE_URL}/{shopcart['id']}/items"
+        data = {"shopcart_id": 0, "item_id": "A1", "description": "pen", "quantity": 2, "price": 150}
+
+        response = await self.client.post(url, json=data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        item = await response.get_json()
+        self.assertEqual(item["shopcart_id"], shopcart["id"])
+        self.assertIn(f"{url}/{item['id']}", response.headers["Location"])
+
+        response = await self.client.put(f"{url}/{item['id']}", json={**item, "quantity": 5})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual((await response.get_json())["quantity"], 5)
+
+        response = await self.client.get(f"{url}/{item['id']}")
+        self.assertEqual((await response.get_json())["quantity"], 5)
+
+        response = await self.client.get(url, query_string={"quantity_gte": 3})
+        self.assertEqual([line["id"] for line in await response.get_json()], [item["id"]])
+        response = await self.client.get(url, query_string={"price_max": 100})
+        self.assertEqual(await response.get_json(), [])
+
+        response = await self.client.get(f"{BASE_URL}/{shopcart['id']}")
+        self.assertEqual((await response.get_json())["total_price"], 750)
+
+        response = await self.client.delete(f"{url}/{item['id']}")
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        response = await self.client.get(f"{url}/{item['id']}")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    async def test_item_conditional_requests(self):
+        """It should answer If-None-Match and If-Match on an Item like the WSGI service"""
+        shopcart = await self._create_shopcart(item_count=1)
+        item = shopcart["items"][0]
+        url = f"{BASE_URL}/{shopcart['id']}/items/{item['id']}"
+        response = await self.client.get(url)
+        etag = response.headers["ETag"]
+        self.assertRegex(etag, rf'^"item-{item["id"]}-\d+"$')
+
+        response = await self.client.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        response = await self.client.put(url, json={**item, "quantity": 7}, headers={"If-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response.headers["ETag"], etag)
+
+        response = await self.client.put(url, json={**item, "quantity": 9}, headers={"If-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        response = await self.client.delete(url, headers={"If-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        self.assertEqual((await (await self.client.get(url)).get_json())["quantity"], 7)
+
+    async def test_item_of_other_shopcart(self):
+        """It should not Read, Update or Delete an Item through another Shopcart"""
+        owner = await self._create_shopcart(item_count=1)
+        other = await self._create_shopcart()
+        item = owner["items"][0]
+        url = f"{BASE_URL}/{other['id']}/items/{item['id']}"
+
+        self.assertEqual((await self.client.get(url)).status_code, status.HTTP_404_NOT_FOUND)
+        response = await self.client.put(url, json={**item, "quantity": 99})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual((await self.client.delete(url)).status_code, status.HTTP_204_NO_CONTENT)
+
+        response = await self.client.get(f"{BASE_URL}/{owner['id']}/items/{item['id']}")
+        self.assertEqual((await response.get_json())["quantity"], item["quantity"])
+        # the body cannot move an Item to another Shopcart either
+        response = await self.client.put(
+            f"{BASE_URL}/{owner['id']}/items/{item['id']}", json={**item, "shopcart_id": other["id"]}
+        )
+        self.assertEqual((await response.get_json())["shopcart_id"], owner["id"])
+
+    async def test_items_of_missing_shopcart(self):
+        """It should return 404 for the Items of a missing Shopcart"""
+        url = f"{BASE_URL}/0/items"
+        data = {"shopcart_id": 0, "item_id": "A1", "description": "pen", "quantity": 2, "price": 150}
+        self.assertEqual((await self.client.get(url)).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual((await self.client.post(url, json=data)).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual((await self.client.delete(f"{url}/1")).status_code, status.HTTP_404_NOT_FOUND)
+
+    async def test_create_bad_item(self):
+        """It should not Create an Item with bad data"""
+        shopcart = await self._create_shopcart()
+        data = {"shopcart_id": 0, "item_id": "A1", "description": "pen", "quantity": "two", "price": 150}
+        response = await self.client.post(f"{BASE_URL}/{shopcart['id']}/items", json=data)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    ######################################################################
+    #  A S Y N C   M O D E L   T E S T   C A S E S
+    ######################################################################
+
+    async def test_all_async(self):
+        """It should list all of the Shopcarts with their items"""
+        created = await self._create_shopcart(item_count=2)
+        async with app.app_context():
+            shopcarts = await Shopcart.all_async()
+            self.assertEqual([shopcart.serialize() for shopcart in shopcarts], [created])
+
+    async def test_async_write_errors(self):
+        """It should roll back and raise DataValidationError on bad writes"""
+        async with app.app_context():
+            shopcart = Shopcart(name=None)
+            with self.assertRaises(DataValidationError):
+                await shopcart.create_async()
+            with self.assertRaises(DataValidationError):
+                await Shopcart(name="no id").update_async()
+
+    async def test_add_item_twice(self):
+        """It should reject, increment or replace a product added twice"""
+        shopcart = await self._create_shopcart()
+        url = f"{BASE_URL}/{shopcart['id']}/items"
+        data = {"shopcart_id": 0, "item_id": "A1", "description": "pen", "quantity": 2, "price": 150}
+        first = await (await self.client.post(url, json=data)).get_json()
+
+        response = await self.client.post(url, json=data)
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        response = await self.client.post(url, json=data, query_string={"on_conflict": "increment"})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        line = await response.get_json()
+        self.assertEqual((line["id"], line["quantity"]), (first["id"], 4))
+        response = await self.client.post(url, json=data, query_string={"on_conflict": "sum"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
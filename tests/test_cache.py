@@ -0,0 +1,252 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Test cases for the Read Cache
+"""
+
+# pylint: disable=duplicate-code
+import importlib.util
+import logging
+import time
+from unittest import TestCase, skipUnless
+from unittest.mock import patch
+from prometheus_client import REGISTRY
+from wsgi import app
+from service.common.cache import Cache, LRUCache, MemoryCache, NullCache, RedisCache, cache, make_backend
+from service.models import db, Shopcart, Item
+from tests.factories import ShopcartFactory, ItemFactory
+
+CONFIG = {"CACHE_BACKEND": "memory", "CACHE_URL": "redis://localhost:6379/15", "CACHE_TTL": 60, "CACHE_MAX_ENTRIES": 2}
+
+
+def sample(name: str, **labels) -> float:
+    """Returns the current value of a sample of the default registry"""
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+######################################################################
+#  B A C K E N D   T E S T   C A S E S
+######################################################################
+class TestBackends(TestCase):
+    """Cache Backend Tests"""
+
+    def test_memory_expiry(self):
+        """It should forget an entry after its TTL"""
+        backend = MemoryCache()
+        backend.set("a", b"1", 60)
+        backend.set("b", b"2", 0.01)
+        self.assertEqual(backend.get("a"), b"1")
+        time.sleep(0.02)
+        self.assertIsNone(backend.get("b"))
+        self.assertEqual(len(backend), 1)
+        backend.delete("a", "missing")
+        self.assertIsNone(backend.get("a"))
+
+    def test_lru_eviction(self):
+        """It should evict the least recently used entry when it is full"""
+        backend = LRUCache(2)
+        backend.set("a", b"1", 60)
+        backend.set("b", b"2", 60)
+        backend.get("a")
+        backend.set("c", b"3", 60)
+        self.assertEqual(len(backend), 2)
+        self.assertIsNone(backend.get("b"))
+        self.assertEqual(backend.get("a"), b"1")
+
+    def test_make_backend(self):
+        """It should make the backend that CACHE_BACKEND names"""
+        for name, kind in (("none", NullCache), ("memory", MemoryCache), ("lru", LRUCache)):
+            self.assertIsInstance(make_backend({**CONFIG, "CACHE_BACKEND": name}), kind)
+        self.assertEqual(make_backend({**CONFIG, "CACHE_BACKEND": "lru"}).max_entries, 2)
+        self.assertRaises(ValueError, make_backend, {**CONFIG, "CACHE_BACKEND": "memcached"})
+
+    @skipUnless(importlib.util.find_spec("redis"), "redis is not installed")
+    def test_redis_backend(self):
+        """It should prefix the keys on the Redis-protocol server"""
+        backend = make_backend({**CONFIG, "CACHE_BACKEND": "redis"})
+        self.assertIsInstance(backend, RedisCache)
+        with patch.object(backend, "client") as client:
+            backend.set("a", b"1", 1.5)
+            client.set.assert_called_once_with("shopcarts:a", b"1", px=1500)
+            backend.delete("a", "b")
+            client.delete.assert_called_once_with("shopcarts:a", "shopcarts:b")
+
+
+######################################################################
+#  C A C H E   T E S T   C A S E S
+######################################################################
+class TestCache(TestCase):
+    """Read Cache Tests"""
+
+    def setUp(self):
+        """Runs before each test"""
+        self.cache = Cache()
+        self.cache.init(CONFIG)
+
+    def test_disabled(self):
+        """It should store nothing without a backend"""
+        self.cache.init({**CONFIG, "CACHE_BACKEND": "none"})
+        self.assertFalse(self.cache.enabled)
+        self.cache.set("a", {"id": 1})
+        self.assertIsNone(self.cache.get("a"))
+        self.assertEqual(self.cache.fetch("a", lambda: {"id": 1}), {"id": 1})
+
+    def test_fetch(self):
+        """It should load a missing value once and count the hits and misses"""
+        hits = sample("cache_hits_total", backend="memory")
+        misses = sample("cache_misses_total", backend="memory")
+        loads = []
+
+        def load():
+            loads.append(1)
+            return {"id": 1, "items": []}
+
+        self.assertEqual(self.cache.fetch("a", load), {"id": 1, "items": []})
+        self.assertEqual(self.cache.fetch("a", load), {"id": 1, "items": []})
+        self.assertEqual(len(loads), 1)
+        self.assertEqual(sample("cache_hits_total", backend="memory"), hits + 1)
+        self.assertEqual(sample("cache_misses_total", backend="memory"), misses + 1)
+
+        # nothing is stored for a missing record
+        self.assertIsNone(self.cache.fetch("b", lambda: None))
+        self.assertIsNone(self.cache.backend.get("b"))
+
+        self.cache.invalidate("a")
+        self.assertIsNone(self.cache.get("a"))
+
+    def test_fetch_fresh(self):
+        """It should load and store a value again when fresh() rejects the stored one"""
+        misses = sample("cache_misses_total", backend="memory")
+        self.cache.set("a", {"version": 1})
+        loaded = self.cache.fetch("a", lambda: {"version": 2}, lambda value: value["version"] == 2)
+        self.assertEqual(loaded, {"version": 2})
+        self.assertEqual(self.cache.get("a"), {"version": 2})
+        self.assertEqual(sample("cache_misses_total", backend="memory"), misses + 1)
+
+    def test_failing_backend(self):
+        """It should treat a backend that fails like a miss"""
+        with patch.object(MemoryCache, "get", side_effect=ConnectionError("down")), \
+                patch.object(MemoryCache, "set", side_effect=ConnectionError("down")), \
+                patch.object(MemoryCache, "delete", side_effect=ConnectionError("down")):
+            self.assertEqual(self.cache.fetch("a", lambda: {"id": 1}), {"id": 1})
+            self.cache.invalidate("a")
+
+
+######################################################################
+#  I N V A L I D A T I O N   T E S T   C A S E S
+######################################################################
+class TestInvalidation(TestCase):
+    """Write-through Invalidation Tests"""
+
+    @classmethod
+    def setUpClass(cls):
+        """Run once before all tests"""
+        app.config["TESTING"] = True
+        app.logger.setLevel(logging.CRITICAL)
+        app.app_context().push()
+
+    def setUp(self):
+        """Creates a Shopcart with an Item and caches it"""
+        db.session.query(Shopcart).delete()
+        db.session.commit()
+        cache.init({**app.config, "CACHE_BACKEND": "memory"})
+        self.shopcart = ShopcartFactory(id=None)
+        self.shopcart.items.append(ItemFactory(id=None, shopcart=None))
+        self.shopcart.create()
+        self.key = f"shopcart:{self.shopcart.id}"
+
+    def tearDown(self):
+        """This runs after each test"""
+        cache.init(app.config)
+        db.session.remove()
+
+    def cached(self) -> dict:
+        """Reads the Shopcart through the cache"""
+        return Shopcart.find_serialized(self.shopcart.id, Shopcart.serialize)
+
+    def test_find_serialized(self):
+        """It should keep the serialized Shopcart with its version"""
+        entry = self.cached()
+        self.assertEqual(entry["version"], self.shopcart.version)
+        self.assertEqual(entry["shopcart"]["items"][0]["id"], self.shopcart.items[0].id)
+        self.assertIsNotNone(cache.backend.get(self.key))
+        self.assertIsNone(Shopcart.find_serialized(0, Shopcart.serialize))
+
+    def test_stale_entry(self):
+        """It should not serve an entry that a read stored after a write invalidated it"""
+        stale = self.cached()
+        item = self.shopcart.items[0]
+        item.quantity = 1000
+        item.update()
+        # the read that raced the update stores what it loaded before it
+        cache.set(self.key, stale)
+        entry = self.cached()
+        self.assertEqual(entry["version"], Shopcart.find_version(self.shopcart.id))
+        self.assertEqual(entry["shopcart"]["items"][0]["quantity"], 1000)
+        self.assertEqual(cache.get(self.key), entry)
+
+    def test_known_version(self):
+        """It should check an entry against the version the caller read"""
+        entry = self.cached()
+        version = entry["version"]
+        self.assertEqual(Shopcart.find_serialized(self.shopcart.id, Shopcart.serialize, version), entry)
+        cache.set(self.key, {**entry, "version": version - 1})
+        self.assertEqual(Shopcart.find_serialized(self.shopcart.id, Shopcart.serialize, version), entry)
+
+    def test_unchecked_entry(self):
+        """It should serve an entry until it is invalidated when CACHE_CHECK_VERSION is off"""
+        entry = self.cached()
+        stale = {**entry, "version": entry["version"] - 1}
+        cache.set(self.key, stale)
+        with patch.dict(app.config, {"CACHE_CHECK_VERSION": False}):
+            self.assertEqual(self.cached(), stale)
+        self.assertEqual(self.cached(), entry)
+
+    def test_item_changes(self):
+        """It should drop the cached Shopcart when its Items change"""
+        item = self.shopcart.items[0]
+        self.cached()
+        item.quantity = 1000
+        item.update()
+        self.assertIsNone(cache.backend.get(self.key))
+
+        self.cached()
+        Item.upsert(ItemFactory(id=None, shopcart=None, shopcart_id=self.shopcart.id))
+        self.assertIsNone(cache.backend.get(self.key))
+
+        self.cached()
+        Item.create_batch([ItemFactory(id=None, shopcart=None, shopcart_id=self.shopcart.id)])
+        self.assertIsNone(cache.backend.get(self.key))
+
+        # moving an Item drops the Shopcart that it left as well
+        other = ShopcartFactory(id=None)
+        other.create()
+        self.cached()
+        Shopcart.find_serialized(other.id, Shopcart.serialize)
+        item.shopcart_id = other.id
+        self.assertEqual(item.cache_keys(), sorted([self.key, f"shopcart:{other.id}"]))
+        item.update()
+        self.assertIsNone(cache.backend.get(self.key))
+        self.assertIsNone(cache.backend.get(f"shopcart:{other.id}"))
+
+    def test_repair(self):
+        """It should drop the cached Shopcarts whose totals are repaired"""
+        db.session.execute(Shopcart.__table__.update().values(total_price=0, item_count=0))
+        db.session.commit()
+        self.cached()
+        self.assertEqual(len(Shopcart.reconcile_totals(repair=True)), 1)
+        self.assertIsNone(cache.backend.get(self.key))
@@ -21,13 +21,34 @@ CLI Command Extensions for Flask
 
 # pylint: disable=duplicate-code
 import os
+import shutil
+import tempfile
 from unittest import TestCase
 from unittest.mock import patch, MagicMock
 from click.testing import CliRunner
 
-# pylint: disable=unused-import
-from wsgi import app  # noqa: F401
-from service.common.cli_commands import db_create  # noqa: E402
+from wsgi import app
+from service.common.cli_commands import (  # noqa: E402
+    db_create,
+    db_init,
+    db_reconcile_totals,
+    db_import,
+    db_index_report,
+    build_static,
+)
+from service.common.db_indexes import declared_for, describe
+from service.models import db, Shopcart, Item
+from service.models.shopcart import trigrams_available
+
+DRIFTED = [
+    {
+        "id": 1,
+        "total_price": 10,
+        "item_count": 1,
+        "actual_total_price": 30,
+        "actual_item_count": 2,
+    }
+]
 
 
 class TestFlaskCLI(TestCase):
@@ -43,3 +64,116 @@ class TestFlaskCLI(TestCase):
         with patch.dict(os.environ, {"FLASK_APP": "wsgi:app"}, clear=True):
             result = self.runner.invoke(db_create)
             self.assertEqual(result.exit_code, 0)
+
+    @patch("service.common.cli_commands.upgrade_schema")
+    @patch("service.common.cli_commands.db")
+    def test_db_init(self, db_mock, upgrade_mock):
+        """It should create the missing tables and upgrade the existing ones without dropping any"""
+        upgrade_mock.return_value = ["added column shopcart.total_price"]
+        result = self.runner.invoke(db_init)
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn("added column shopcart.total_price", result.output)
+        self.assertIn("up to date", result.output)
+        db_mock.create_all.assert_called_once_with()
+        db_mock.drop_all.assert_not_called()
+        upgrade_mock.assert_called_once_with()
+
+    @patch("service.common.cli_commands.Shopcart")
+    def test_db_reconcile_totals(self, shopcart_mock):
+        """It should report consistent shopcart totals"""
+        shopcart_mock.reconcile_totals.return_value = []
+        result = self.runner.invoke(db_reconcile_totals)
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn("consistent", result.output)
+        shopcart_mock.reconcile_totals.assert_called_once_with(repair=False)
+
+    @patch("service.common.cli_commands.Shopcart")
+    def test_db_reconcile_totals_drift(self, shopcart_mock):
+        """It should fail when shopcart totals drifted"""
+        shopcart_mock.reconcile_totals.return_value = DRIFTED
+        result = self.runner.invoke(db_reconcile_totals)
+        self.assertEqual(result.exit_code, 1)
+        self.assertIn("shopcart 1: total_price 10 != 30", result.output)
+
+    @patch("service.common.cli_commands.Shopcart")
+    def test_db_reconcile_totals_repair(self, shopcart_mock):
+        """It should repair drifted shopcart totals"""
+        shopcart_mock.reconcile_totals.return_value = DRIFTED
+        result = self.runner.invoke(db_reconcile_totals, ["--repair"])
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn("Repaired 1 shopcarts", result.output)
+        shopcart_mock.reconcile_totals.assert_called_once_with(repair=True)
+
+    @patch("service.common.cli_commands.import_shopcarts")
+    def test_db_import(self, import_mock):
+        """It should import shopcarts from a file"""
+
+        def import_shopcarts(records, _source, **kwargs):
+            records = list(records)
+            stats = {"shopcarts": len(records), "items": 0, "skipped": 0, "id_map": [(7, 1)]}
+            kwargs["progress"](stats)
+            return stats
+
+        import_mock.side_effect = import_shopcarts
+        with tempfile.TemporaryDirectory() as folder:
+            carts = os.path.join(folder, "carts.csv")
+            ids = os.path.join(folder, "ids.csv")
+            with open(carts, "w", encoding="utf-8") as csv_file:
+                csv_file.write("id,name,item_id\n7,Ann,\n")
+            result = self.runner.invoke(db_import, [carts, "--id-map", ids, "--resume"])
+            self.assertEqual(result.exit_code, 0)
+            self.assertIn("Done: 1 shopcarts imported", result.output)
+            with open(ids, encoding="utf-8") as id_file:
+                self.assertEqual(id_file.read(), "7,1\n")
+        self.assertEqual(import_mock.call_args.args[1], carts)
+        self.assertTrue(import_mock.call_args.kwargs["resume"])
+
+    def test_db_index_report(self):
+        """It should report and create the missing indexes"""
+        with app.app_context():
+            index = next(index for index in Item.__table__.indexes if index.name == "ix_item_shopcart_id_price")
+            index.drop(bind=db.engine, checkfirst=True)
+
+            result = self.runner.invoke(db_index_report)
+            self.assertEqual(result.exit_code, 1)
+            self.assertIn("missing: ix_item_shopcart_id_price ON item (shopcart_id, price)", result.output)
+            self.assertIn("1 indexes are missing", result.output)
+
+            result = self.runner.invoke(db_index_report, ["--create"])
+            self.assertEqual(result.exit_code, 0)
+            self.assertIn("created: ix_item_shopcart_id_price", result.output)
+
+            result = self.runner.invoke(db_index_report)
+            self.assertEqual(result.exit_code, 0)
+            self.assertNotIn("missing", result.output)
+            self.assertIn("unused: ", result.output)
+
+    def test_declared_for(self):
+        """It should only expect the trigram index where pg_trgm is available"""
+        with app.app_context(), db.engine.connect() as connection:
+            indexes = {index.name: index for index in Shopcart.__table__.indexes}
+            self.assertTrue(declared_for(indexes["ix_shopcart_name"], connection))
+            self.assertEqual(
+                declared_for(indexes["ix_shopcart_name_trgm"], connection),
+                connection.dialect.name == "postgresql" and trigrams_available(connection),
+            )
+
+    def test_describe(self):
+        """It should describe the columns and expressions of the indexes as SQL"""
+        with app.app_context():
+            indexes = {index.name: index for index in (*Shopcart.__table__.indexes, *Item.__table__.indexes)}
+            self.assertEqual(describe(indexes["ix_shopcart_name_lower"]), "lower(name)")
+            self.assertEqual(describe(indexes["ix_shopcart_name_trgm"]), "lower(name)")
+            self.assertEqual(describe(indexes["ix_item_shopcart_id_item_id"]), "shopcart_id, item_id")
+
+    def test_build_static(self):
+        """It should build the static assets into STATIC_BUILD_FOLDER"""
+        folder = tempfile.mkdtemp()
+        try:
+            with patch.dict(app.config, {"STATIC_BUILD_FOLDER": folder}):
+                result = self.runner.invoke(build_static)
+            self.assertEqual(result.exit_code, 0)
+            self.assertIn(f"static assets in {folder}", result.output)
+            self.assertTrue(os.path.isfile(os.path.join(folder, "manifest.json")))
+        finally:
+            shutil.rmtree(folder)
@@ -0,0 +1,214 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Test cases for the Response Compression and the Static Assets
+"""
+
+# pylint: disable=duplicate-code
+import gzip
+import json
+import logging
+import os
+import shutil
+import tempfile
+from unittest import TestCase, skipUnless
+from wsgi import app
+from service.common import compression, status
+from service.common.static_assets import IMMUTABLE_MAX_AGE, build_assets
+from service.models import db, Shopcart
+from tests.factories import ShopcartFactory, ItemFactory
+
+BASE_URL = "/api/shopcarts"
+
+
+######################################################################
+#  C O M P R E S S I O N   T E S T   C A S E S
+######################################################################
+class TestCompression(TestCase):
+    """Response Compression Tests"""
+
+    @classmethod
+    def setUpClass(cls):
+        """Run once before all tests"""
+        app.config["TESTING"] = True
+        app.logger.setLevel(logging.CRITICAL)
+        app.app_context().push()
+
+    def setUp(self):
+        """Runs before each test"""
+        self.client = app.test_client()
+        db.session.query(Shopcart).delete()
+        db.session.commit()
+        for _ in range(20):
+            ShopcartFactory(id=None).create()
+
+    def tearDown(self):
+        """This runs after each test"""
+        app.config["COMPRESS_RESPONSES"] = True
+        db.session.remove()
+
+    def test_gzip_large_responses(self):
+        """It should gzip a response above the threshold when the client accepts it"""
+        plain = self.client.get(BASE_URL)
+        self.assertNotIn("Content-Encoding", plain.headers)
+        self.assertIn("Accept-Encoding", plain.headers["Vary"])
+        self.assertGreater(len(plain.data), app.config["COMPRESS_MIN_SIZE"])
+
+        resp = self.client.get(BASE_URL, headers={"Accept-Encoding": "gzip, deflate"})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", resp.headers["Vary"])
+        self.assertLess(int(resp.headers["Content-Length"]), len(plain.data))
+        self.assertEqual(json.loads(gzip.decompress(resp.data)), plain.get_json())
+
+        # the Swagger document is compressed as well
+        resp = self.client.get("/api/swagger.json", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+
+    def test_small_responses_are_not_compressed(self):
+        """It should send responses below the threshold and refused encodings as they are"""
+        resp = self.client.get(f"{BASE_URL}?limit=1", headers={"Accept-Encoding": "gzip"})
+        self.assertNotIn("Content-Encoding", resp.headers)
+        resp = self.client.get(BASE_URL, headers={"Accept-Encoding": "gzip;q=0, identity"})
+        self.assertNotIn("Content-Encoding", resp.headers)
+        resp = self.client.get("/static/images/newapp-icon.png", headers={"Accept-Encoding": "gzip"})
+        self.assertNotIn("Content-Encoding", resp.headers)
+        resp.close()
+
+        app.config["COMPRESS_RESPONSES"] = False
+        resp = self.client.get(BASE_URL, headers={"Accept-Encoding": "gzip"})
+        self.assertNotIn("Content-Encoding", resp.headers)
+
+    def test_brotli_negotiation(self):
+        """It should only offer brotli when the brotli package is installed"""
+        resp = self.client.get(BASE_URL, headers={"Accept-Encoding": "br;q=1, gzip;q=0.5"})
+        expected = "br" if compression.brotli else "gzip"
+        self.assertEqual(resp.headers["Content-Encoding"], expected)
+
+    @skipUnless(compression.brotli, "brotli is not installed")
+    def test_brotli_responses(self):
+        """It should compress with brotli when the client prefers it"""
+        plain = self.client.get(BASE_URL)
+        resp = self.client.get(BASE_URL, headers={"Accept-Encoding": "gzip, br"})
+        self.assertEqual(resp.headers["Content-Encoding"], "br")
+        self.assertEqual(compression.brotli.decompress(resp.data), plain.data)
+
+    def test_encoded_etags(self):
+        """It should give every encoding its own ETag and accept them all as preconditions"""
+        shopcart = Shopcart.all()[0]
+        for _ in range(10):
+            shopcart.items.append(ItemFactory(id=None, shopcart=None))
+        shopcart.update()
+        url = f"{BASE_URL}/{shopcart.id}"
+        plain = self.client.get(url)
+        resp = self.client.get(url, headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+        etag = resp.headers["ETag"]
+        self.assertEqual(etag, plain.headers["ETag"][:-1] + '-gzip"')
+        self.assertEqual(compression.decode_etag(etag.strip('"')), plain.headers["ETag"].strip('"'))
+
+        resp = self.client.get(url, headers={"Accept-Encoding": "gzip", "If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(resp.headers["ETag"], etag)
+        resp = self.client.put(f"{url}/clear", headers={"Accept-Encoding": "gzip", "If-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        resp = self.client.put(f"{url}/clear", headers={"If-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+
+
+######################################################################
+#  S T A T I C   A S S E T   T E S T   C A S E S
+######################################################################
+class TestStaticAssets(TestCase):
+    """Static Asset Tests"""
+
+    @classmethod
+    def setUpClass(cls):
+        """Run once before all tests"""
+        app.config["TESTING"] = True
+        app.app_context().push()
+
+    def setUp(self):
+        """Builds the static files into a temporary folder"""
+        self.client = app.test_client()
+        self.saved_folder = app.config["STATIC_BUILD_FOLDER"]
+        self.folder = tempfile.mkdtemp()
+        app.config["STATIC_BUILD_FOLDER"] = self.folder
+        self.manifest = build_assets(app.static_folder, self.folder, 1024)
+
+    def tearDown(self):
+        """Removes the built files"""
+        app.config["STATIC_BUILD_FOLDER"] = self.saved_folder
+        shutil.rmtree(self.folder)
+
+    def test_build_assets(self):
+        """It should write fingerprinted and precompressed copies of the static files"""
+        script = self.manifest["js/rest_api.js"]
+        self.assertRegex(script, r"^js/rest_api\.[0-9a-f]{12}\.js$")
+        self.assertTrue(os.path.isfile(os.path.join(self.folder, script + ".gz")))
+        # images are not compressed and the HTML links the new names
+        icon = os.path.join(self.folder, self.manifest["images/newapp-icon.png"])
+        self.assertFalse(os.path.exists(icon + ".gz"))
+        with open(os.path.join(self.folder, "index.html"), encoding="utf-8") as index:
+            html = index.read()
+        self.assertIn(f'src="assets/{script}"', html)
+        self.assertNotIn('src="static/', html)
+        with open(os.path.join(self.folder, "manifest.json"), encoding="utf-8") as manifest:
+            self.assertEqual(json.load(manifest), self.manifest)
+
+        # the same content gets the same name
+        self.assertEqual(build_assets(app.static_folder, self.folder), self.manifest)
+
+    def test_send_asset(self):
+        """It should serve the precompressed asset with an immutable Cache-Control"""
+        url = "/assets/" + self.manifest["js/jquery-3.6.0.min.js"]
+        plain = self.client.get(url)
+        self.assertEqual(plain.status_code, status.HTTP_200_OK)
+        self.assertIn("javascript", plain.headers["Content-Type"])
+        self.assertNotIn("Content-Encoding", plain.headers)
+        self.assertEqual(plain.cache_control.max_age, IMMUTABLE_MAX_AGE)
+        self.assertTrue(plain.cache_control.immutable)
+        self.assertTrue(plain.cache_control.public)
+
+        resp = self.client.get(url, headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+        self.assertIn("javascript", resp.headers["Content-Type"])
+        self.assertIn("Accept-Encoding", resp.headers["Vary"])
+        self.assertEqual(gzip.decompress(resp.data), plain.data)
+        self.assertNotEqual(resp.headers["ETag"], plain.headers["ETag"])
+        resp = self.client.get(url, headers={"Accept-Encoding": "gzip", "If-None-Match": resp.headers["ETag"]})
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+        plain.close()
+
+        for name in ("missing.js", "manifest.json", "index.html", "../config.py"):
+            resp = self.client.get(f"/assets/{name}")
+            self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND, name)
+
+    def test_index(self):
+        """It should serve the built index.html that links the assets"""
+        resp = self.client.get("/", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+        self.assertTrue(resp.cache_control.no_cache)
+        self.assertIn(b"assets/js/rest_api.", gzip.decompress(resp.data))
+
+        # before a build the page links the static files
+        app.config["STATIC_BUILD_FOLDER"] = os.path.join(self.folder, "missing")
+        resp = self.client.get("/")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertIn(b"static/js/rest_api.js", resp.data)
+        resp.close()
@@ -0,0 +1,83 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Test cases for the Connection Pool Statistics
+"""
+
+import sqlite3
+from unittest import TestCase
+from sqlalchemy import create_engine
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import StaticPool
+from service.common.db_pool import InstrumentedQueuePool, pool_stats
+
+
+######################################################################
+#  C O N N E C T I O N   P O O L   T E S T   C A S E S
+######################################################################
+class TestConnectionPool(TestCase):
+    """Connection Pool Statistics Tests"""
+
+    def setUp(self):
+        """Runs before each test"""
+        self.engine = create_engine(
+            "sqlite://",
+            creator=lambda: sqlite3.connect(":memory:", check_same_thread=False),
+            poolclass=InstrumentedQueuePool,
+            pool_size=1,
+            max_overflow=1,
+            pool_timeout=0.01,
+        )
+
+    def tearDown(self):
+        """This runs after each test"""
+        self.engine.dispose()
+
+    def test_checkouts(self):
+        """It should count the checkouts and the connections in use"""
+        with self.engine.connect():
+            with self.engine.connect():
+                stats = pool_stats(self.engine)
+                self.assertEqual(stats["pool"], "InstrumentedQueuePool")
+                self.assertEqual(stats["checked_out"], 2)
+                self.assertEqual(stats["overflow"], 1)
+        stats = pool_stats(self.engine)
+        self.assertEqual(stats["checkouts"], 2)
+        self.assertEqual(stats["checked_out"], 0)
+        self.assertEqual(stats["timeouts"], 0)
+        self.assertGreaterEqual(stats["max_wait_seconds"], stats["avg_wait_seconds"])
+
+    def test_timeouts(self):
+        """It should count the checkouts that timed out"""
+        with self.engine.connect():
+            with self.engine.connect():
+                self.assertRaises(PoolTimeoutError, self.engine.connect)
+        stats = pool_stats(self.engine)
+        self.assertEqual(stats["timeouts"], 1)
+        self.assertGreaterEqual(stats["wait_seconds"], 0.01)
+
+    def test_dispose_keeps_stats(self):
+        """It should keep the statistics when the pool is recreated"""
+        with self.engine.connect():
+            pass
+        self.engine.dispose()
+        self.assertEqual(pool_stats(self.engine)["checkouts"], 1)
+
+    def test_other_pools(self):
+        """It should report the class of pools without statistics"""
+        engine = create_engine("sqlite://", poolclass=StaticPool)
+        self.assertEqual(pool_stats(engine), {"pool": "StaticPool"})
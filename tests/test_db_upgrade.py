@@ -0,0 +1,110 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Test cases for the Schema Upgrades
+"""
+
+# pylint: disable=duplicate-code
+import logging
+from unittest import TestCase
+from sqlalchemy import insert, text
+from wsgi import app
+from service.common.db_upgrade import PRODUCT_INDEX, TRIGGERS, UPGRADE_COLUMNS, upgrade_schema
+from service.models import db, Shopcart, Item
+from tests.factories import ItemFactory
+
+
+def downgrade_schema() -> None:
+    """Turns the tables back into the ones that an older release created"""
+    with db.engine.begin() as connection:
+        dialect = connection.dialect.name
+        for name in TRIGGERS[dialect]:
+            on_table = " ON item" if dialect == "postgresql" else ""
+            connection.execute(text(f"DROP TRIGGER IF EXISTS {name}{on_table}"))
+        for table_name, names in UPGRADE_COLUMNS.items():
+            for name in names:
+                connection.execute(text(f"ALTER TABLE {table_name} DROP COLUMN {name}"))
+        # older releases allowed a product twice in a Shopcart
+        connection.execute(text(f"DROP INDEX {PRODUCT_INDEX}"))
+        connection.execute(text(f"CREATE INDEX {PRODUCT_INDEX} ON item (shopcart_id, item_id)"))
+
+
+######################################################################
+#  S C H E M A   U P G R A D E   T E S T   C A S E S
+######################################################################
+class TestUpgradeSchema(TestCase):
+    """Schema Upgrade Tests"""
+
+    @classmethod
+    def setUpClass(cls):
+        """Run once before all tests"""
+        app.config["TESTING"] = True
+        app.logger.setLevel(logging.CRITICAL)
+        app.app_context().push()
+
+    def setUp(self):
+        """Runs before each test"""
+        db.session.query(Shopcart).delete()
+        db.session.commit()
+        db.session.remove()
+
+    def tearDown(self):
+        """Leaves the tables upgraded for the other tests"""
+        db.session.remove()
+        upgrade_schema()
+
+    def test_upgrade_existing_tables(self):
+        """It should add the new columns and triggers and backfill the totals"""
+        downgrade_schema()
+        with db.engine.begin() as connection:
+            shopcart_id = connection.execute(
+                text("INSERT INTO shopcart (name) VALUES ('legacy') RETURNING id")
+            ).scalar_one()
+            connection.execute(
+                insert(Item.__table__),
+                [
+                    {"shopcart_id": shopcart_id, "item_id": "A1", "description": "a", "quantity": 2, "price": 10},
+                    {"shopcart_id": shopcart_id, "item_id": "B2", "description": "b", "quantity": 1, "price": 5},
+                    {"shopcart_id": shopcart_id, "item_id": "A1", "description": "a", "quantity": 3, "price": 10},
+                ],
+            )
+
+        changes = upgrade_schema()
+        for table_name, names in UPGRADE_COLUMNS.items():
+            for name in names:
+                self.assertIn(f"added column {table_name}.{name}", changes)
+        self.assertIn("created trigger item_totals_insert", changes)
+        self.assertIn("merged 1 duplicate items into 1 items", changes)
+        self.assertIn(f"created unique index {PRODUCT_INDEX}", changes)
+        self.assertEqual(changes[-1], "recomputed the totals of 1 shopcarts")
+
+        shopcart = Shopcart.find(shopcart_id)
+        self.assertEqual({item.item_id: item.quantity for item in shopcart.items}, {"A1": 5, "B2": 1})
+        self.assertEqual((shopcart.total_price, shopcart.item_count), (55, 2))
+        # the triggers keep the totals from now on and the upserts find the index
+        Item.upsert(ItemFactory(id=None, shopcart=None, shopcart_id=shopcart_id, quantity=1, price=100))
+        self.assertEqual(Shopcart.calculate_total_price(shopcart_id), 155)
+        Item.upsert(
+            ItemFactory(id=None, shopcart=None, shopcart_id=shopcart_id, item_id="A1", quantity=1, price=10),
+            on_conflict="increment",
+        )
+        self.assertEqual(Shopcart.calculate_total_price(shopcart_id), 165)
+
+    def test_upgrade_is_idempotent(self):
+        """It should not change tables that are up to date"""
+        self.assertEqual(upgrade_schema(), [])
+        self.assertEqual(upgrade_schema(), [])
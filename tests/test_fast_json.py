@@ -0,0 +1,112 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Test cases for the Fast JSON Responses
+"""
+
+# pylint: disable=duplicate-code
+import logging
+from decimal import Decimal
+from unittest import TestCase
+from flask_restx import fields, marshal
+from wsgi import app
+from service import routes
+from service.common import status
+from service.common.fast_json import OrjsonProvider, compile_model
+from service.models import db, Shopcart
+from tests.factories import ShopcartFactory, ItemFactory
+
+
+######################################################################
+#  F A S T   J S O N   T E S T   C A S E S
+######################################################################
+class TestFastJson(TestCase):
+    """Fast JSON Response Tests"""
+
+    @classmethod
+    def setUpClass(cls):
+        """Run once before all tests"""
+        app.config["TESTING"] = True
+        app.logger.setLevel(logging.CRITICAL)
+        app.app_context().push()
+
+    def setUp(self):
+        """Runs before each test"""
+        self.client = app.test_client()
+        db.session.query(Shopcart).delete()
+        db.session.commit()
+
+    def tearDown(self):
+        """This runs after each test"""
+        db.session.remove()
+
+    def test_compiled_models_match_marshal(self):
+        """It should serialize a Shopcart exactly like marshal() does"""
+        shopcart = ShopcartFactory(id=None)
+        shopcart.items.append(ItemFactory(id=None, shopcart=None))
+        shopcart.items.append(ItemFactory(id=None, shopcart=None))
+        shopcart.create()
+        expected = marshal(shopcart.serialize(), routes.shopcart_model)
+        self.assertEqual(routes.serialize_shopcart(shopcart), expected)
+        self.assertEqual(list(routes.serialize_shopcart(shopcart)), list(expected))
+        item = shopcart.items[0]
+        self.assertEqual(routes.serialize_item(item), marshal(item.serialize(), routes.item_model))
+        self.assertIsInstance(routes.serialize_item(item)["id"], str)
+
+    def test_compile_fields(self):
+        """It should convert every kind of field and reject the others"""
+        model = {
+            "flag": fields.Boolean,
+            "ratio": fields.Float(attribute="value"),
+            "raw": fields.Raw,
+            "missing": fields.Integer,
+        }
+        record = type("Record", (), {"flag": 1, "value": Decimal("1.5"), "raw": {"a": 1}})
+        self.assertEqual(
+            compile_model(model)(record),
+            {"flag": True, "ratio": 1.5, "raw": {"a": 1}, "missing": None},
+        )
+        self.assertIsNone(compile_model({"items": fields.List(fields.Integer)})(record)["items"])
+        with self.assertRaises(TypeError):
+            compile_model({"when": fields.DateTime})
+
+    def test_provider(self):
+        """It should encode and decode JSON with orjson"""
+        self.assertIsInstance(app.json, OrjsonProvider)
+        self.assertEqual(app.json.dumps({1: Decimal("2.5")}), '{"1":"2.5"}')
+        self.assertEqual(app.json.loads(b'{"a": [1, 2]}'), {"a": [1, 2]})
+        response = self.client.get("/health")
+        self.assertEqual(response.get_json(), {"status": 200, "message": "Healthy"})
+        with app.test_request_context():
+            response = app.json.response(total=3)
+        self.assertEqual(response.get_data(), b'{"total":3}')
+
+    def test_error_representation(self):
+        """It should send the errors of flask-restx as JSON"""
+        response = self.client.get("/api/shopcarts/0")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(response.content_type, "application/json")
+        self.assertIn("was not found", response.get_json()["message"])
+
+    def test_swagger_models(self):
+        """It should still document the responses with the Swagger models"""
+        spec = self.client.get("/api/swagger.json").get_json()
+        self.assertIn("ShopcartModel", spec["definitions"])
+        responses = spec["paths"]["/shopcarts"]["get"]["responses"]
+        self.assertEqual(responses["200"]["schema"]["items"]["$ref"], "#/definitions/ShopcartModel")
+        responses = spec["paths"]["/shopcarts/{shopcart_id}/items/{item_id}"]["put"]["responses"]
+        self.assertEqual(responses["200"]["schema"]["$ref"], "#/definitions/ItemModel")
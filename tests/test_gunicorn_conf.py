@@ -0,0 +1,128 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Test cases for the Gunicorn configuration
+"""
+
+import os
+import runpy
+import tempfile
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+from wsgi import app
+from service.models import db
+
+CONFIG = os.path.join(os.path.dirname(os.path.dirname(__file__)), "gunicorn.conf.py")
+
+
+def load_config(**environment) -> dict:
+    """Evaluates the configuration with the given environment"""
+    with patch.dict(os.environ, environment):
+        return runpy.run_path(CONFIG)
+
+
+######################################################################
+#  G U N I C O R N   C O N F I G U R A T I O N   T E S T   C A S E S
+######################################################################
+class TestGunicornConfig(TestCase):
+    """Gunicorn Configuration Tests"""
+
+    def setUp(self):
+        """Runs before each test"""
+        self.config = load_config()
+        self.cgroup = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+
+    def tearDown(self):
+        """This runs after each test"""
+        self.cgroup.cleanup()
+
+    def _write(self, name, contents):
+        path = os.path.join(self.cgroup.name, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as file:
+            file.write(contents)
+
+    def test_cgroup_v2_quota(self):
+        """It should read the CPU quota of cgroup v2"""
+        self._write("cpu.max", "150000 100000\n")
+        self.assertEqual(self.config["cgroup_cpu_quota"](self.cgroup.name), 1.5)
+        self._write("cpu.max", "max 100000\n")
+        self.assertIsNone(self.config["cgroup_cpu_quota"](self.cgroup.name))
+
+    def test_cgroup_v1_quota(self):
+        """It should read the CPU quota of cgroup v1"""
+        self._write("cpu/cpu.cfs_quota_us", "50000")
+        self._write("cpu/cpu.cfs_period_us", "100000")
+        self.assertEqual(self.config["cgroup_cpu_quota"](self.cgroup.name), 0.5)
+        self._write("cpu/cpu.cfs_quota_us", "-1")
+        self.assertIsNone(self.config["cgroup_cpu_quota"](self.cgroup.name))
+
+    def test_available_cpus(self):
+        """It should round the quota up and never exceed the CPU affinity"""
+        self._write("cpu.max", "50000 100000")
+        self.assertEqual(self.config["available_cpus"](self.cgroup.name), 1)
+        self._write("cpu.max", "100000000 100000")
+        self.assertEqual(self.config["available_cpus"](self.cgroup.name), len(os.sched_getaffinity(0)))
+
+    def test_defaults(self):
+        """It should default to gthread workers sized to the CPUs"""
+        with patch.dict(os.environ, {}, clear=False):
+            for name in ("GUNICORN_WORKERS", "GUNICORN_WORKER_CLASS", "GUNICORN_PRELOAD"):
+                os.environ.pop(name, None)
+            config = runpy.run_path(CONFIG)
+        self.assertEqual(config["worker_class"], "gthread")
+        self.assertEqual(config["workers"], 2 * config["available_cpus"]() + 1)
+        self.assertTrue(config["preload_app"])
+        self.assertGreater(config["max_requests_jitter"], 0)
+
+    def test_environment(self):
+        """It should take the settings from the environment"""
+        config = load_config(GUNICORN_WORKERS="3", GUNICORN_WORKER_CLASS="gevent", GUNICORN_MAX_REQUESTS="0")
+        self.assertEqual(config["workers"], 3)
+        self.assertEqual(config["worker_class"], "gevent")
+        self.assertFalse(config["preload_app"])
+        self.assertEqual(config["max_requests"], 0)
+
+    def test_write_coalescing_workers(self):
+        """It should refuse to coalesce writes across several workers"""
+        self.assertRaises(RuntimeError, load_config, GUNICORN_WORKERS="3", QUANTITY_COALESCE_WINDOW="200")
+        config = load_config(GUNICORN_WORKERS="1", QUANTITY_COALESCE_WINDOW="200")
+        self.assertEqual(config["workers"], 1)
+
+    def test_post_fork(self):
+        """It should dispose of the inherited engine in preloaded workers"""
+        server, worker = MagicMock(), MagicMock()
+        worker.app.wsgi.return_value = app
+        with app.app_context():
+            engine = db.engine
+        with patch.object(type(engine), "dispose") as dispose:
+            server.cfg.preload_app = False
+            self.config["post_fork"](server, worker)
+            dispose.assert_not_called()
+            server.cfg.preload_app = True
+            self.config["post_fork"](server, worker)
+            dispose.assert_called_with(close=False)
+
+    def test_metrics_directory(self):
+        """It should empty the metrics directory when the server starts"""
+        with tempfile.TemporaryDirectory() as directory:
+            stale = os.path.join(directory, "counter_1.db")
+            open(stale, "w", encoding="utf-8").close()  # pylint: disable=consider-using-with
+            with patch.dict(os.environ, {"PROMETHEUS_MULTIPROC_DIR": directory}):
+                self.config["reset_metrics_directory"]()
+                self.config["child_exit"](MagicMock(), MagicMock(pid=1))
+            self.assertFalse(os.path.exists(stale))
@@ -1,4 +1,4 @@
-# pylint: disable=duplicate-code
+# pylint: disable=duplicate-code, too-many-public-methods
 """
 Test cases for Item Model
 """
@@ -6,8 +6,10 @@ Test cases for Item Model
 import logging
 import os
 from unittest import TestCase
+from sqlalchemy import update
+from sqlalchemy.orm.exc import StaleDataError
 from wsgi import app
-from service.models import Shopcart, Item, db
+from service.models import Shopcart, Item, DataValidationError, db
 from tests.factories import ShopcartFactory, ItemFactory
 
 DATABASE_URI = os.getenv(
@@ -190,6 +192,27 @@ class TestItem(TestCase):
         item = shopcart.items[0]
         self.assertEqual(item.price, 1024)
 
+    def test_update_stale_item(self):
+        """It should not Update or Delete an Item that changed since it was read"""
+        shopcart = ShopcartFactory(id=None)
+        shopcart.items.append(ItemFactory(id=None, shopcart=None))
+        shopcart.create()
+        item = shopcart.items[0]
+        self.assertEqual(item.version, 1)
+        self.assertEqual(Item.find_version(item.id), 1)
+        item.quantity += 1
+        item.update()
+        self.assertEqual(item.version, 2)
+
+        for write in (item.update, item.delete):
+            item.quantity += 1
+            # another session changes the item in the meantime
+            with db.engine.begin() as connection:
+                connection.execute(update(Item.__table__).values(version=Item.__table__.c.version + 1))
+            self.assertRaises(StaleDataError, write)
+        self.assertEqual(Item.find_version(item.id), 4)
+        self.assertIsNone(Item.find_version(0))
+
     # ----------------------------------------------------------
     # TEST DELETE
     # ----------------------------------------------------------
@@ -291,3 +314,64 @@ class TestItem(TestCase):
         same_item = Item.find_by_quantity(item.quantity)[0]
         self.assertEqual(same_item.item_id, item.item_id)
         self.assertEqual(same_item.quantity, item.quantity)
+
+    def test_find_by_shopcart_id(self):
+        """It should Find the items of a shopcart with filters"""
+        shopcart = ShopcartFactory()
+        for quantity, price in [(1, 100), (5, 200), (10, 300)]:
+            shopcart.items.append(ItemFactory(quantity=quantity, price=price))
+        shopcart.create()
+        other = ShopcartFactory()
+        other.items.append(ItemFactory(quantity=5, price=200))
+        other.create()
+
+        items = Item.find_by_shopcart_id(shopcart.id).all()
+        self.assertEqual(len(items), 3)
+        self.assertTrue(all(item.shopcart_id == shopcart.id for item in items))
+
+        items = Item.find_by_shopcart_id(shopcart.id, quantity=5, price=200).all()
+        self.assertEqual([item.quantity for item in items], [5])
+
+        items = Item.find_by_shopcart_id(shopcart.id, price_min=150, price_max=300).all()
+        self.assertEqual([item.price for item in items], [200, 300])
+
+        items = Item.find_by_shopcart_id(shopcart.id, quantity_gte=5, price_max=250).all()
+        self.assertEqual([item.quantity for item in items], [5])
+
+    def test_create_batch(self):
+        """It should Create a batch of items"""
+        shopcart = ShopcartFactory()
+        shopcart.create()
+        items = [ItemFactory(id=None, shopcart=None, shopcart_id=shopcart.id) for _ in range(3)]
+        self.assertEqual(Item.create_batch(items), [])
+        self.assertTrue(all(item.id is not None for item in items))
+        self.assertEqual(Item.find_by_shopcart_id(shopcart.id).count(), 3)
+        self.assertEqual(shopcart.item_count, 3)
+
+    def test_create_batch_held_products(self):
+        """It should not Create the items of products that the shopcart holds"""
+        shopcart = ShopcartFactory()
+        shopcart.create()
+        held = ItemFactory(id=None, shopcart=None, shopcart_id=shopcart.id)
+        Item.create_batch([held])
+        items = [ItemFactory(id=None, shopcart=None, shopcart_id=shopcart.id) for _ in range(2)]
+        items[1].item_id = held.item_id
+
+        # atomic batches create nothing
+        self.assertEqual(Item.create_batch(items), [items[1]])
+        self.assertEqual(Item.find_by_shopcart_id(shopcart.id).count(), 1)
+
+        self.assertEqual(Item.create_batch(items, atomic=False), [items[1]])
+        self.assertIsNotNone(items[0].id)
+        self.assertIsNone(items[1].id)
+        self.assertEqual(Item.find_by_shopcart_id(shopcart.id).count(), 2)
+
+    def test_create_batch_failed(self):
+        """It should not Create a batch of items for a missing shopcart"""
+        items = [ItemFactory(id=None, shopcart=None, shopcart_id=0) for _ in range(2)]
+        with self.assertRaises(DataValidationError) as context:
+            Item.create_batch(items)
+        # the message names the violation but not the SQL or its parameters
+        self.assertIn("foreign key", str(context.exception))
+        self.assertNotIn("INSERT", str(context.exception))
+        self.assertEqual(len(Item.all()), 0)
@@ -0,0 +1,180 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Test cases for the Log Handlers
+"""
+
+import io
+import json
+import logging
+import sys
+import time
+from unittest import TestCase
+from flask import Flask
+from wsgi import app
+from service.common import log_handlers, status
+from service.common.log_handlers import JsonFormatter, RequestSampler, init_logging
+from service.models import db, Shopcart
+
+
+def wait_for(stream: io.StringIO, text: str) -> str:
+    """Waits for the writer thread to write some text to a stream"""
+    deadline = time.monotonic() + 2
+    while text not in stream.getvalue() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return stream.getvalue()
+
+
+def make_record(level=logging.INFO, message="hello %s", args=("world",), exc_info=None):
+    """Returns a log record of the models logger"""
+    return logging.LogRecord("flask.app", level, __file__, 1, message, args, exc_info)
+
+
+######################################################################
+#  L O G   H A N D L E R   T E S T   C A S E S
+######################################################################
+class TestLogHandlers(TestCase):
+    """Log Handler Tests"""
+
+    def setUp(self):
+        """Saves the loggers that init_logging changes"""
+        self.server_logger = logging.getLogger("test.server")
+        self.stream = io.StringIO()
+        self.server_logger.handlers = [logging.StreamHandler(self.stream)]
+        self.models_logger = logging.getLogger(log_handlers.MODELS_LOGGER)
+        self.saved = (self.models_logger.handlers, self.models_logger.level, self.models_logger.propagate)
+        self.app = Flask("log_test")
+
+    def tearDown(self):
+        """Restores the loggers"""
+        self.models_logger.handlers, level, self.models_logger.propagate = self.saved
+        self.models_logger.setLevel(level)
+        self.server_logger.handlers = []
+
+    def test_json_formatter(self):
+        """It should format a record as one JSON object"""
+        record = None
+        try:
+            raise ValueError("boom")
+        except ValueError:
+            record = make_record(logging.ERROR, exc_info=sys.exc_info())
+        record.http_method, record.http_path = "GET", "/api/shopcarts"
+        entry = json.loads(JsonFormatter().format(record))
+        self.assertEqual(entry["level"], "ERROR")
+        self.assertEqual(entry["logger"], "flask.app")
+        self.assertEqual(entry["message"], "hello world")
+        self.assertEqual((entry["method"], entry["path"]), ("GET", "/api/shopcarts"))
+        self.assertIn("ValueError: boom", entry["exception"])
+        self.assertTrue(entry["time"].endswith("+00:00"))
+
+    def test_request_sampler(self):
+        """It should keep the INFO lines of a sample of the requests only"""
+        dropped, kept = RequestSampler(0), RequestSampler(1)
+        self.assertTrue(dropped.filter(make_record()))
+        with self.app.test_request_context("/api/shopcarts", method="POST"):
+            record = make_record()
+            self.assertFalse(dropped.filter(record))
+            self.assertEqual(record.http_method, "POST")
+            self.assertTrue(dropped.filter(make_record(logging.WARNING)))
+            self.assertTrue(kept.filter(make_record()))
+        with self.app.test_request_context():
+            sampler = RequestSampler(0.5)
+            first = sampler.filter(make_record())
+            self.assertTrue(all(sampler.filter(make_record()) == first for _ in range(20)))
+
+    def test_init_logging_json(self):
+        """It should write JSON lines from a background thread"""
+        self.app.config.update(LOGGING_LEVEL="WARNING", LOG_SAMPLE_RATE=1.0)
+        init_logging(self.app, "test.server")
+        self.assertIsInstance(self.app.logger.handlers[0], logging.handlers.QueueHandler)
+        self.assertIs(self.models_logger.handlers[0], self.app.logger.handlers[0])
+        self.app.logger.info("not written")
+        self.models_logger.warning("models %s", "warning")
+        lines = wait_for(self.stream, "models warning").splitlines()
+        self.assertEqual(json.loads(lines[-1])["message"], "models warning")
+        self.assertNotIn("not written", self.stream.getvalue())
+
+        # a forked worker starts a writer of its own
+        listener = log_handlers._listeners[-1][0]
+        log_handlers._restart_listeners()
+        self.assertIsNot(log_handlers._listeners[-1][0], listener)
+        self.app.logger.error("after fork")
+        self.assertIn("after fork", wait_for(self.stream, "after fork"))
+
+    def test_init_logging_exceptions(self):
+        """It should write the traceback of a logged exception to its own key"""
+        self.app.config.update(LOGGING_LEVEL="INFO", LOG_SAMPLE_RATE=1.0)
+        init_logging(self.app, "test.server")
+        try:
+            raise ValueError("boom")
+        except ValueError:
+            self.app.logger.exception("failed %s", "request")
+        entry = json.loads(wait_for(self.stream, "failed request").splitlines()[-1])
+        self.assertEqual(entry["message"], "failed request")
+        self.assertEqual(entry["level"], "ERROR")
+        self.assertIn("ValueError: boom", entry["exception"])
+
+    def test_init_logging_text(self):
+        """It should write text lines when LOG_FORMAT is text"""
+        self.app.config.update(LOGGING_LEVEL="INFO", LOG_FORMAT="text")
+        init_logging(self.app, "test.server")
+        self.app.logger.info("plain %d", 42)
+        self.assertIn("[INFO] [log_handlers] Logging handler established", wait_for(self.stream, "plain 42"))
+
+    def test_init_logging_without_server(self):
+        """It should not start a writer when the server has no handlers"""
+        self.server_logger.handlers = []
+        self.server_logger.setLevel(logging.DEBUG)
+        init_logging(self.app, "test.server")
+        self.assertEqual(self.app.logger.handlers, [])
+        self.assertEqual(self.app.logger.level, logging.DEBUG)
+
+
+######################################################################
+#  P A Y L O A D   L O G G I N G   T E S T   C A S E S
+######################################################################
+class TestPayloadLogging(TestCase):
+    """Payload Logging Tests"""
+
+    @classmethod
+    def setUpClass(cls):
+        """Run once before all tests"""
+        app.config["TESTING"] = True
+        app.app_context().push()
+
+    def setUp(self):
+        """Runs before each test"""
+        self.client = app.test_client()
+        db.session.query(Shopcart).delete()
+        db.session.commit()
+
+    def tearDown(self):
+        """This runs after each test"""
+        app.config["LOG_PAYLOADS"] = False
+        db.session.remove()
+
+    def test_payloads_are_opt_in(self):
+        """It should log request bodies only when LOG_PAYLOADS is on"""
+        with self.assertLogs(app.logger, logging.INFO) as logs:
+            response = self.client.post("/api/shopcarts", json={"name": "quiet", "items": []})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertFalse(any("Processing:" in line for line in logs.output))
+
+        app.config["LOG_PAYLOADS"] = True
+        with self.assertLogs(app.logger, logging.INFO) as logs:
+            self.client.post("/api/shopcarts", json={"name": "loud", "items": []})
+        self.assertTrue(any("Processing:" in line and "loud" in line for line in logs.output))
@@ -0,0 +1,112 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Test cases for the Prometheus Metrics
+"""
+
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+from prometheus_client import REGISTRY
+from wsgi import app
+from service.common import status
+from service.common.metrics import mark_process_dead, render_metrics
+from service.models import db, Shopcart
+from tests.factories import ShopcartFactory
+
+
+def sample(name: str, **labels) -> float:
+    """Returns the current value of a sample of the default registry"""
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+######################################################################
+#  M E T R I C S   T E S T   C A S E S
+######################################################################
+class TestMetrics(TestCase):
+    """Prometheus Metrics Tests"""
+
+    @classmethod
+    def setUpClass(cls):
+        """Run once before all tests"""
+        app.config["TESTING"] = True
+        app.logger.setLevel(logging.CRITICAL)
+        app.app_context().push()
+
+    def setUp(self):
+        """Runs before each test"""
+        self.client = app.test_client()
+        db.session.query(Shopcart).delete()
+        db.session.commit()
+
+    def tearDown(self):
+        """This runs after each test"""
+        db.session.remove()
+
+    def test_request_metrics(self):
+        """It should count the requests by route, method and status"""
+        shopcart = ShopcartFactory()
+        shopcart.create()
+        route = "/api/shopcarts/<int:shopcart_id>"
+        labels = {"method": "GET", "route": route}
+        before = sample("http_requests_total", status="200", **labels)
+        queries = sample("http_request_db_queries_sum", **labels)
+
+        response = self.client.get(f"/api/shopcarts/{shopcart.id}")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(sample("http_requests_total", status="200", **labels), before + 1)
+        self.assertGreater(sample("http_request_duration_seconds_count", **labels), 0)
+        self.assertGreater(sample("http_request_db_queries_sum", **labels), queries)
+        self.assertEqual(sample("http_requests_in_progress", **labels), 0)
+
+    def test_unmatched_route(self):
+        """It should not create labels for unknown URLs"""
+        before = sample("http_requests_total", method="GET", route="unmatched", status="404")
+        self.client.get("/no/such/path/42")
+        after = sample("http_requests_total", method="GET", route="unmatched", status="404")
+        self.assertEqual(after, before + 1)
+
+    def test_metrics_endpoint(self):
+        """It should render the metrics in the Prometheus text format"""
+        self.client.get("/health")
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.content_type.startswith("text/plain"))
+        body = response.get_data(as_text=True)
+        self.assertIn('http_requests_total{method="GET",route="/health",status="200"}', body)
+        self.assertIn("db_query_duration_seconds_bucket", body)
+
+    def test_multiprocess(self):
+        """It should aggregate the metrics of the workers in the directory"""
+        with tempfile.TemporaryDirectory() as directory:
+            with patch.dict(os.environ, {"PROMETHEUS_MULTIPROC_DIR": directory}):
+                body, content_type = render_metrics()
+                mark_process_dead(os.getpid())
+        self.assertTrue(content_type.startswith("text/plain"))
+        self.assertEqual(body, b"")
+
+    def test_missing_multiprocess_directory(self):
+        """It should create the metrics directory when other entry points import the metrics"""
+        with tempfile.TemporaryDirectory() as parent:
+            directory = os.path.join(parent, "prometheus")
+            environment = {**os.environ, "PROMETHEUS_MULTIPROC_DIR": directory}
+            subprocess.run([sys.executable, "-c", "import service.common.metrics"], env=environment, check=True)
+            self.assertTrue(os.path.isdir(directory))
@@ -0,0 +1,109 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Test cases for the SQL Statement Budgets
+"""
+
+# pylint: disable=duplicate-code
+import logging
+from unittest import TestCase
+from sqlalchemy import text
+from wsgi import app
+from service.common.query_budget import QueryBudgetExceeded, query_budget
+from service.models import db, Shopcart
+from tests.factories import ShopcartFactory, ItemFactory
+
+
+@query_budget(1)
+def two_statements():
+    """Sends one statement more than its budget allows"""
+    db.session.execute(text("SELECT 1"))
+    db.session.execute(text("SELECT 2"))
+    return "done"
+
+
+######################################################################
+#  Q U E R Y   B U D G E T   T E S T   C A S E S
+######################################################################
+class TestQueryBudget(TestCase):
+    """SQL Statement Budget Tests"""
+
+    @classmethod
+    def setUpClass(cls):
+        """Run once before all tests"""
+        app.config["TESTING"] = True
+        app.logger.setLevel(logging.CRITICAL)
+        app.app_context().push()
+
+    def setUp(self):
+        """Runs before each test"""
+        self.client = app.test_client()
+        db.session.query(Shopcart).delete()
+        db.session.commit()
+
+    def tearDown(self):
+        """This runs after each test"""
+        app.config["SQL_BUDGET_ACTION"] = "log"
+        app.config["SHOPCART_ITEMS_LOADING"] = "selectin"
+        app.config["TESTING"] = True
+        db.session.remove()
+
+    def test_budget_raise(self):
+        """It should raise when a function exceeds its budget"""
+        app.config["SQL_BUDGET_ACTION"] = "raise"
+        self.assertEqual(two_statements.query_budget, 1)
+        with app.test_request_context():
+            app.preprocess_request()
+            with self.assertRaises(QueryBudgetExceeded):
+                two_statements()
+
+    def test_budget_log(self):
+        """It should log a warning when a function exceeds its budget"""
+        with app.test_request_context():
+            app.preprocess_request()
+            with self.assertLogs(app.logger, logging.WARNING) as logs:
+                self.assertEqual(two_statements(), "done")
+        self.assertIn("its budget is 1", logs.output[0])
+
+    def test_budget_outside_requests(self):
+        """It should not count the statements sent outside of a request"""
+        app.config["SQL_BUDGET_ACTION"] = "raise"
+        self.assertEqual(two_statements(), "done")
+
+    def test_n_plus_one(self):
+        """It should flag a statement repeated for every Shopcart"""
+        for _ in range(app.config["SQL_REPEAT_THRESHOLD"]):
+            shopcart = ShopcartFactory(id=None)
+            shopcart.items.append(ItemFactory(id=None, shopcart=None))
+            shopcart.create()
+        app.config["SHOPCART_ITEMS_LOADING"] = "lazy"
+        with self.assertLogs(app.logger, logging.WARNING) as logs:
+            response = self.client.get("/api/shopcarts")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(any("N+1 pattern" in line for line in logs.output))
+
+        app.config["SQL_BUDGET_ACTION"] = "raise"
+        # a new session, like the next request of a server gets
+        db.session.remove()
+        with self.assertRaises(QueryBudgetExceeded):
+            self.client.get("/api/shopcarts")
+
+    def test_disabled_in_production(self):
+        """It should not record statements unless DEBUG or TESTING is on"""
+        app.config["TESTING"] = False
+        response = self.client.get("/health")
+        self.assertNotIn("X-SQL-Queries", response.headers)
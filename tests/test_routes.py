@@ -18,13 +18,21 @@
 TestYourResourceModel API Service Test Suite
 """
 
-# pylint: disable=duplicate-code
+# pylint: disable=duplicate-code, too-many-lines
+import functools
 import os
+import json
 import logging
+from contextlib import contextmanager
 from unittest import TestCase
+from unittest.mock import patch
+from sqlalchemy import event, update
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 from wsgi import app
 from service.common import status
-from service.models import db, Shopcart
+from service.common.cache import cache
+from service.common.write_coalescing import quantity_buffer
+from service.models import db, Shopcart, Item
 from tests.factories import ShopcartFactory, ItemFactory
 
 DATABASE_URI = os.getenv(
@@ -34,6 +42,44 @@ DATABASE_URI = os.getenv(
 BASE_URL = "/api/shopcarts"
 
 
+@contextmanager
+def count_queries():
+    """Collects the SQL statements sent to the database"""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):  # pylint: disable=unused-argument
+        statements.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, "before_cursor_execute", before_cursor_execute)
+
+
+def fresh_session(open_request):
+    """Wraps the open() of a test client to send every request with a new session
+
+    The test client reuses the app context that setUpClass pushed, and with
+    it the session, whose identity map would answer the lookups that a
+    request of a real server sends to the database.
+    """
+
+    @functools.wraps(open_request)
+    def wrapper(*args, **kwargs):
+        db.session.remove()
+        return open_request(*args, **kwargs)
+
+    return wrapper
+
+
+def query_budget_of(method: str, path: str) -> int:
+    """Returns the SQL budget that the resource of a request declares"""
+    endpoint, _ = app.url_map.bind("localhost").match(path, method)
+    resource = app.view_functions[endpoint].view_class
+    return getattr(resource, method.lower()).query_budget
+
+
 ######################################################################
 #  T E S T   C A S E S
 ######################################################################
@@ -48,17 +94,21 @@ class TestShopcartService(TestCase):
         app.config["DEBUG"] = False
         # Set up the test database
         app.config["SQLALCHEMY_DATABASE_URI"] = DATABASE_URI
+        # fail the tests of resources that exceed their SQL budget
+        app.config["SQL_BUDGET_ACTION"] = "raise"
         app.logger.setLevel(logging.CRITICAL)
         app.app_context().push()
 
     @classmethod
     def tearDownClass(cls):
         """Run once after all tests"""
+        app.config["SQL_BUDGET_ACTION"] = "log"
         db.session.close()
 
     def setUp(self):
         """Runs before each test"""
         self.client = app.test_client()
+        self.client.open = fresh_session(self.client.open)
         db.session.query(Shopcart).delete()  # clean up the last tests
         db.session.commit()
 
@@ -88,6 +138,29 @@ class TestShopcartService(TestCase):
 
         return shopcarts
 
+    def assert_query_count(self, response, expected: int):
+        """Asserts the number of SQL statements that a request sent"""
+        self.assertEqual(int(response.headers["X-SQL-Queries"]), expected)
+
+    def assert_within_budget(self, method: str, path: str, **kwargs):
+        """Sends a request and asserts that it kept to the budget of its resource"""
+        response = self.client.open(path, method=method, **kwargs)
+        budget = query_budget_of(method, path.split("?")[0])
+        self.assertLessEqual(int(response.headers["X-SQL-Queries"]), budget, f"{method} {path}")
+        return response
+
+    def _create_shopcarts_with_items(self, count, item_count=3) -> list:
+        """Creates shopcarts that already hold some items"""
+        ids = []
+        for _ in range(count):
+            shopcart = ShopcartFactory(id=None)
+            for _ in range(item_count):
+                shopcart.items.append(ItemFactory(id=None, shopcart=None))
+            shopcart.create()
+            ids.append(shopcart.id)
+        # loaded after the commits, the requests of the tests replace the session
+        return [Shopcart.find_with_items(shopcart_id) for shopcart_id in ids]
+
     ######################################################################
     #  T E S T   C A S E S
     ######################################################################
@@ -100,6 +173,25 @@ class TestShopcartService(TestCase):
         self.assertEqual(data["status"], 200)
         self.assertEqual(data["message"], "Healthy")
 
+    def test_pool_health(self):
+        """It should report the state of the connection pool"""
+        self._create_shopcarts(1)
+        response = self.client.get("/health/pool")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.get_json()
+        self.assertIn("pool", data)
+        if data["pool"] == "InstrumentedQueuePool":
+            self.assertGreater(data["checkouts"], 0)
+            self.assertEqual(data["checked_out"], 0)
+            self.assertEqual(data["overflow"], 0)
+
+    def test_pool_timeout(self):
+        """It should return 503 when no database connection is available"""
+        with patch.object(Shopcart, "find_with_items", side_effect=PoolTimeoutError("QueuePool limit reached")):
+            response = self.client.get(f"{BASE_URL}/1")
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response.get_json()["error"], "Service Unavailable")
+
     ######################################################################
     #  S H O P C A R T   T E S T   C A S E S
     ######################################################################
@@ -140,6 +232,113 @@ class TestShopcartService(TestCase):
         data = resp.get_json()
         self.assertEqual(data["name"], test_shopcart.name)
 
+    def test_get_shopcart_fields(self):
+        """It should Get only the requested fields of a Shopcart"""
+        shopcart = self._create_shopcarts_with_items(1)[0]
+        etag = self.client.get(f"{BASE_URL}/{shopcart.id}").headers["ETag"]
+
+        with count_queries() as statements:
+            resp = self.client.get(f"{BASE_URL}/{shopcart.id}?fields=name,item_count")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json(), {"id": shopcart.id, "name": shopcart.name, "item_count": 3})
+        self.assertEqual(resp.headers["ETag"], etag)
+        self.assertEqual(len(statements), 1)
+        self.assertFalse(any("FROM item" in sql for sql in statements))
+
+        resp = self.client.get(f"{BASE_URL}/{shopcart.id}?include_items=false")
+        self.assertEqual(list(resp.get_json()), ["id", "total_price", "item_count", "name"])
+        resp = self.client.get(f"{BASE_URL}/{shopcart.id}?fields=items")
+        self.assertEqual(list(resp.get_json()), ["id", "items"])
+        self.assertEqual(len(resp.get_json()["items"]), 3)
+
+        resp = self.client.get(f"{BASE_URL}/{shopcart.id}?fields=name,owner")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("owner", resp.get_json()["message"])
+        resp = self.client.get(f"{BASE_URL}/0?include_items=false")
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_get_shopcart_not_modified(self):
+        """It should answer a matching If-None-Match with 304 without reading the items"""
+        shopcart = self._create_shopcarts_with_items(1)[0]
+        resp = self.client.get(f"{BASE_URL}/{shopcart.id}")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        etag = resp.headers["ETag"]
+
+        with count_queries() as statements:
+            resp = self.client.get(f"{BASE_URL}/{shopcart.id}", headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(resp.headers["ETag"], etag)
+        self.assertEqual(resp.data, b"")
+        self.assertFalse(any("FROM item" in sql for sql in statements))
+
+        # changing an item changes the ETag of the shopcart
+        item = ItemFactory(id=None, shopcart=None)
+        resp = self.client.post(f"{BASE_URL}/{shopcart.id}/items", json=item.serialize())
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        resp = self.client.get(f"{BASE_URL}/{shopcart.id}", headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(resp.headers["ETag"], etag)
+        self.assertEqual(len(resp.get_json()["items"]), 4)
+        etag = resp.headers["ETag"]
+
+        # so does renaming the shopcart
+        resp = self.client.put(f"{BASE_URL}/{shopcart.id}", json={"name": "renamed", "items": []})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        resp = self.client.get(f"{BASE_URL}/{shopcart.id}", headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(resp.headers["ETag"], etag)
+
+    def test_get_shopcart_not_modified_not_found(self):
+        """It should not answer If-None-Match for a Shopcart that does not exist"""
+        resp = self.client.get(f"{BASE_URL}/0", headers={"If-None-Match": "*"})
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_get_shopcart_cached(self):
+        """It should serve a Shopcart from the read cache until a write changes it"""
+        shopcart = self._create_shopcarts_with_items(1, item_count=2)[0]
+        url = f"{BASE_URL}/{shopcart.id}"
+        cache.init({**app.config, "CACHE_BACKEND": "memory"})
+        try:
+            first = self.client.get(url)
+            self.assertGreater(int(first.headers["X-SQL-Queries"]), 0)
+            # a hit only checks the version
+            resp = self.client.get(url)
+            self.assert_query_count(resp, 1)
+            self.assertEqual(resp.get_json(), first.get_json())
+            self.assertEqual(resp.headers["ETag"], first.headers["ETag"])
+            resp = self.client.get(f"{url}?fields=name,items")
+            self.assert_query_count(resp, 1)
+            self.assertEqual(list(resp.get_json()), ["id", "name", "items"])
+            # a revalidation that misses reuses the version it read
+            resp = self.client.get(url, headers={"If-None-Match": '"0"'})
+            self.assert_query_count(resp, 1)
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            # without the version check a hit sends no query
+            with patch.dict(app.config, {"CACHE_CHECK_VERSION": False}):
+                resp = self.client.get(url)
+            self.assert_query_count(resp, 0)
+            self.assertEqual(resp.get_json(), first.get_json())
+
+            # every write drops the entry, so the next read sees it
+            item = first.get_json()["items"][0]
+            resp = self.client.put(f"{url}/items/{item['id']}", json={**item, "quantity": 1000})
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            resp = self.client.get(url)
+            self.assertGreater(int(resp.headers["X-SQL-Queries"]), 0)
+            quantities = {line["id"]: line["quantity"] for line in resp.get_json()["items"]}
+            self.assertEqual(quantities[item["id"]], 1000)
+            self.assertNotEqual(resp.headers["ETag"], first.headers["ETag"])
+            self.client.post(f"{url}/items", json=ItemFactory(id=None, shopcart=None).serialize())
+            self.assertEqual(self.client.get(url).get_json()["item_count"], 3)
+            self.client.put(url, json={"name": "renamed", "items": []})
+            self.assertEqual(self.client.get(url).get_json()["name"], "renamed")
+            self.client.put(f"{url}/clear")
+            self.assertEqual(self.client.get(url).get_json()["items"], [])
+            self.client.delete(url)
+            self.assertEqual(self.client.get(url).status_code, status.HTTP_404_NOT_FOUND)
+        finally:
+            cache.init(app.config)
+
     # ----------------------------------------------------------
     # TEST UPDATE
     # ----------------------------------------------------------
@@ -159,12 +358,62 @@ class TestShopcartService(TestCase):
         updated_shopcart = resp.get_json()
         self.assertEqual(updated_shopcart["name"], "special_shopcart")
 
+    def test_update_shopcart_with_its_items(self):
+        """It should update the Items of a Shopcart by product instead of adding them again"""
+        shopcart = self._create_shopcarts_with_items(1, item_count=2)[0]
+        url = f"{BASE_URL}/{shopcart.id}"
+        resp = self.client.get(url)
+        data, etag = resp.get_json(), resp.headers["ETag"]
+        data["name"] = "renamed"
+        data["items"][0]["quantity"] = 1000
+        data["items"].append(ItemFactory(id=None, shopcart=None).serialize())
+
+        resp = self.client.put(url, json=data, headers={"If-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        updated = resp.get_json()
+        self.assertEqual(updated["name"], "renamed")
+        self.assertEqual(updated["item_count"], 3)
+        quantities = {item["item_id"]: item["quantity"] for item in updated["items"]}
+        self.assertEqual(quantities[data["items"][0]["item_id"]], 1000)
+
+        # the same body again changes nothing
+        resp = self.client.put(url, json=data)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json()["item_count"], 3)
+
     def test_update_nonexistent_shopcart(self):
         """It should return 404 when updating a shopcart that does not exist"""
         update_data = {"name": "some_name"}
         resp = self.client.put(f"{BASE_URL}/0", json=update_data)
         self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
 
+    def test_update_shopcart_if_match(self):
+        """It should only change a Shopcart whose ETag matches If-Match"""
+        shopcart = self._create_shopcarts(1)[0]
+        url = f"{BASE_URL}/{shopcart.id}"
+        etag = self.client.get(url).headers["ETag"]
+
+        resp = self.client.put(url, json={"name": "first", "items": []}, headers={"If-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(resp.headers["ETag"], etag)
+        self.assertEqual(self.client.get(url).headers["ETag"], resp.headers["ETag"])
+
+        # a write based on the old version is refused
+        resp = self.client.put(url, json={"name": "second", "items": []}, headers={"If-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        self.assertEqual(self.client.get(url).get_json()["name"], "first")
+        resp = self.client.put(f"{url}/clear", headers={"If-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        resp = self.client.delete(url, headers={"If-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+
+        resp = self.client.put(url, json={"name": "third", "items": []}, headers={"If-Match": "*"})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        resp = self.client.delete(url, headers={"If-Match": resp.headers["ETag"]})
+        self.assertEqual(resp.status_code, status.HTTP_204_NO_CONTENT)
+        resp = self.client.delete(url, headers={"If-Match": "*"})
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+
     # ----------------------------------------------------------
     # TEST DELETE
     # ----------------------------------------------------------
@@ -207,6 +456,154 @@ class TestShopcartService(TestCase):
         self.assertEqual(len(data), 1)
         self.assertEqual(data[0]["name"], "special_shopcart")
 
+    def test_list_shopcarts_query_count(self):
+        """It should List Shopcarts with a constant number of queries"""
+        self._create_shopcarts_with_items(2)
+        with count_queries() as statements:
+            resp = self.client.get(BASE_URL)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        few_carts = len(statements)
+
+        self._create_shopcarts_with_items(8)
+        with count_queries() as statements:
+            resp = self.client.get(BASE_URL)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual(len(data), 10)
+        self.assertTrue(all(len(cart["items"]) == 3 for cart in data))
+        self.assertEqual(len(statements), few_carts)
+
+    def test_list_shopcarts_fields(self):
+        """It should List only the requested columns without reading the items"""
+        shopcarts = self._create_shopcarts_with_items(3)
+        with count_queries() as statements:
+            resp = self.client.get(BASE_URL + "?fields=id,name&limit=2")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json(), [{"id": cart.id, "name": cart.name} for cart in shopcarts[:2]])
+        self.assertEqual(len(statements), 1)
+        self.assertNotIn("FROM item", statements[0])
+        self.assertNotIn("total_price", statements[0])
+
+        # the next link asks for the same fields
+        self.assertIn("fields=id,name", resp.headers["Link"])
+        resp = self.client.get(resp.headers["Link"].split(";")[0].strip("<>"))
+        self.assertEqual(resp.get_json(), [{"id": shopcarts[2].id, "name": shopcarts[2].name}])
+
+        resp = self.client.get(f"{BASE_URL}?include_items=false&name={shopcarts[0].name}")
+        self.assertEqual(resp.get_json()[0]["item_count"], 3)
+        self.assertNotIn("items", resp.get_json()[0])
+        self.assert_query_count(resp, 1)
+        resp = self.client.get(f"{BASE_URL}?q={shopcarts[1].name}&fields=name")
+        self.assertEqual(resp.get_json()[0], {"id": shopcarts[1].id, "name": shopcarts[1].name})
+        resp = self.client.get(BASE_URL + "?fields=items")
+        self.assertTrue(all(len(cart["items"]) == 3 for cart in resp.get_json()))
+        resp = self.client.get(BASE_URL + "?fields=version")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_list_shopcarts_joined_loading(self):
+        """It should List Shopcarts and their items with a single joined query"""
+        self._create_shopcarts_with_items(4, item_count=2)
+        app.config["SHOPCART_ITEMS_LOADING"] = "joined"
+        try:
+            with count_queries() as statements:
+                resp = self.client.get(BASE_URL + "?limit=3")
+        finally:
+            app.config["SHOPCART_ITEMS_LOADING"] = "selectin"
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual(len(data), 3)
+        self.assertTrue(all(len(cart["items"]) == 2 for cart in data))
+        self.assertEqual(len(statements), 1)
+
+    def test_list_shopcarts_paginated(self):
+        """It should page through the Shopcarts with a cursor"""
+        shopcarts = self._create_shopcarts(5)
+
+        resp = self.client.get(BASE_URL + "?limit=2")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual([cart["id"] for cart in data], [cart.id for cart in shopcarts[:2]])
+        self.assertEqual(resp.headers["X-Next-Cursor"], str(shopcarts[1].id))
+        self.assertIn('rel="next"', resp.headers["Link"])
+
+        # follow the next links until the last page
+        seen = [cart["id"] for cart in data]
+        while "Link" in resp.headers:
+            next_url = resp.headers["Link"].split(";")[0].strip("<>")
+            resp = self.client.get(next_url)
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            seen.extend(cart["id"] for cart in resp.get_json())
+        self.assertEqual(seen, [cart.id for cart in shopcarts])
+        self.assertNotIn("X-Next-Cursor", resp.headers)
+
+    def test_list_shopcarts_paginated_by_name(self):
+        """It should page through the Shopcarts filtered by name"""
+        self._create_shopcarts(2)
+        shopcarts = self._create_shopcarts(3, name="special_shopcart")
+
+        resp = self.client.get(BASE_URL + "?name=special_shopcart&limit=2")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(resp.get_json()), 2)
+        self.assertIn("name=special_shopcart", resp.headers["Link"])
+
+        cursor = resp.headers["X-Next-Cursor"]
+        resp = self.client.get(f"{BASE_URL}?name=special_shopcart&limit=2&cursor={cursor}")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual(len(data), 1)
+        self.assertEqual(data[0]["id"], shopcarts[2].id)
+
+    def test_search_shopcarts(self):
+        """It should search the Shopcarts by name and page through the ranked results"""
+        for name in ("Bob Alison", "alicia keys", "Alice Smith", "Carl"):
+            self._create_shopcarts(1, name=name)
+
+        resp = self.client.get(BASE_URL + "?q=ALI")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual([cart["name"] for cart in resp.get_json()], ["alicia keys", "Alice Smith", "Bob Alison"])
+        self.assert_query_count(resp, 2)
+        resp = self.client.get(BASE_URL + "?q=ali&match=prefix")
+        self.assertEqual([cart["name"] for cart in resp.get_json()], ["alicia keys", "Alice Smith"])
+        resp = self.client.get(BASE_URL + "?q=alise&match=fuzzy")
+        self.assertEqual(resp.get_json()[0]["name"], "Bob Alison")
+        self.assert_query_count(resp, 3)
+
+        # follow the next links of the ranked results
+        resp = self.client.get(BASE_URL + "?q=ali&limit=2")
+        self.assertEqual(resp.headers["X-Next-Cursor"], "2")
+        self.assertIn("q=ali", resp.headers["Link"])
+        self.assertIn("match=substring", resp.headers["Link"])
+        resp = self.client.get(resp.headers["Link"].split(";")[0].strip("<>"))
+        self.assertEqual([cart["name"] for cart in resp.get_json()], ["Bob Alison"])
+        self.assertNotIn("Link", resp.headers)
+
+    def test_search_shopcarts_bad_args(self):
+        """It should not search the Shopcarts with invalid arguments"""
+        resp = self.client.get(BASE_URL + "?q=ali&match=regex")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.client.get(BASE_URL + "?q=ali&name=Carl")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_list_shopcarts_max_page_size(self):
+        """It should never return more Shopcarts than the maximum page size"""
+        self._create_shopcarts(3)
+        max_page_size = app.config["MAX_PAGE_SIZE"]
+        app.config["MAX_PAGE_SIZE"] = 2
+        try:
+            resp = self.client.get(BASE_URL + "?limit=1000")
+        finally:
+            app.config["MAX_PAGE_SIZE"] = max_page_size
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(resp.get_json()), 2)
+        self.assertIn("limit=2", resp.headers["Link"])
+
+    def test_list_shopcarts_bad_page_args(self):
+        """It should not List Shopcarts with invalid pagination arguments"""
+        resp = self.client.get(BASE_URL + "?limit=0")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.client.get(BASE_URL + "?cursor=-1")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
     # ----------------------------------------------------------
     # TEST BAD ROUTES
     # ----------------------------------------------------------
@@ -289,6 +686,40 @@ class TestShopcartService(TestCase):
 
         self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
 
+    def test_add_item_twice(self):
+        """It should reject, increment or replace a product that is added twice"""
+        shopcart = self._create_shopcarts(1)[0]
+        url = f"{BASE_URL}/{shopcart.id}/items"
+        item = ItemFactory(shopcart_id=shopcart.id, quantity=2, price=100)
+        resp = self.client.post(url, json=item.serialize())
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        first = resp.get_json()
+
+        resp = self.client.post(url, json=item.serialize())
+        self.assertEqual(resp.status_code, status.HTTP_409_CONFLICT)
+        self.assertIn("on_conflict=increment", resp.get_json()["message"])
+
+        with count_queries() as statements:
+            resp = self.client.post(f"{url}?on_conflict=increment", json=item.serialize())
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        self.assertEqual((resp.get_json()["id"], resp.get_json()["quantity"]), (first["id"], 4))
+        writes = [sql for sql in statements if sql.startswith("INSERT")]
+        self.assertEqual(len(writes), 1)
+        self.assertIn("ON CONFLICT", writes[0])
+
+        replacement = {**item.serialize(), "quantity": 1, "price": 300, "description": "newer"}
+        resp = self.client.post(f"{url}?on_conflict=replace", json=replacement)
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        line = resp.get_json()
+        self.assertEqual((line["quantity"], line["price"], line["description"]), (1, 300, "newer"))
+
+        resp = self.client.get(f"{BASE_URL}/{shopcart.id}")
+        data = resp.get_json()
+        self.assertEqual((data["item_count"], data["total_price"]), (1, 300))
+
+        resp = self.client.post(f"{url}?on_conflict=sum", json=item.serialize())
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
     # ----------------------------------------------------------
     # TEST READ
     # ----------------------------------------------------------
@@ -323,10 +754,126 @@ class TestShopcartService(TestCase):
         self.assertEqual(str(data["quantity"]), str(item.quantity))
         self.assertEqual(str(data["price"]), str(item.price))
 
+    def test_read_an_item_not_modified(self):
+        """It should answer a matching If-None-Match for an item with 304"""
+        shopcart = self._create_shopcarts_with_items(1, item_count=2)[0]
+        first, second = [item.id for item in shopcart.items]
+        resp = self.client.get(f"{BASE_URL}/{shopcart.id}/items/{first}")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        etag = resp.headers["ETag"]
+
+        with count_queries() as statements:
+            resp = self.client.get(
+                f"{BASE_URL}/{shopcart.id}/items/{first}", headers={"If-None-Match": etag}
+            )
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(len(statements), 1)
+        self.assertNotIn("description", statements[0])
+
+        # the ETag of an item changes with the item only
+        resp = self.client.delete(f"{BASE_URL}/{shopcart.id}/items/{second}")
+        self.assertEqual(resp.status_code, status.HTTP_204_NO_CONTENT)
+        resp = self.client.get(
+            f"{BASE_URL}/{shopcart.id}/items/{first}", headers={"If-None-Match": etag}
+        )
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+        data = self.client.get(f"{BASE_URL}/{shopcart.id}/items/{first}").get_json()
+        resp = self.client.put(f"{BASE_URL}/{shopcart.id}/items/{first}", json={**data, "quantity": 1000})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        resp = self.client.get(
+            f"{BASE_URL}/{shopcart.id}/items/{first}", headers={"If-None-Match": etag}
+        )
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(resp.headers["ETag"], etag)
+
     # ----------------------------------------------------------
     # TEST UPDATE
     # ----------------------------------------------------------
 
+    def test_update_item_quantity_coalesced(self):
+        """It should buffer quantity updates and flush them before the next read"""
+        shopcart = self._create_shopcarts_with_items(1, item_count=1)[0]
+        item = shopcart.items[0]
+        url = f"{BASE_URL}/{shopcart.id}/items/{item.id}"
+        data = self.client.get(url).get_json()
+        # a window long enough that only the requests flush the buffer
+        app.config["QUANTITY_COALESCE_WINDOW"] = 60000
+        try:
+            with count_queries() as statements:
+                for quantity in (1000, 2000, 3000):
+                    resp = self.client.put(url, json={**data, "quantity": quantity})
+                    self.assertEqual(resp.status_code, status.HTTP_202_ACCEPTED)
+            self.assertEqual(resp.get_json()["quantity"], 3000)
+            self.assertNotIn("ETag", resp.headers)
+            self.assertFalse(any(sql.startswith("UPDATE") for sql in statements))
+            self.assertEqual(len(quantity_buffer()), 1)
+
+            # the next read of the shopcart sees the last quantity, written once
+            with count_queries() as statements:
+                resp = self.client.get(url)
+            self.assertEqual(resp.get_json()["quantity"], 3000)
+            self.assertEqual(resp.headers["ETag"], f'"item-{item.id}-2"')
+            self.assertEqual(len([sql for sql in statements if sql.startswith("UPDATE item")]), 1)
+            resp = self.client.get(f"{BASE_URL}/{shopcart.id}/calculate_total_price")
+            self.assertEqual(resp.get_json()["total_price"], 3000 * data["price"])
+
+            # other changes and conditional updates are written at once
+            self.client.put(url, json={**data, "quantity": 4000})
+            resp = self.client.put(url, json={**data, "quantity": 5000, "price": 1})
+            self.assertEqual(resp.headers["ETag"], f'"item-{item.id}-4"')
+            resp = self.client.put(url, json={**data, "quantity": 6000}, headers={"If-Match": resp.headers["ETag"]})
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            self.assertEqual(len(quantity_buffer()), 0)
+            self.client.put(url, json={**data, "quantity": 7000})
+            self.assertEqual(self.client.get(BASE_URL).get_json()[0]["items"][0]["quantity"], 7000)
+        finally:
+            app.config["QUANTITY_COALESCE_WINDOW"] = 0
+            quantity_buffer().flush()
+
+    def test_update_item_if_match(self):
+        """It should only change an Item whose ETag matches If-Match"""
+        shopcart = self._create_shopcarts_with_items(1, item_count=1)[0]
+        url = f"{BASE_URL}/{shopcart.id}/items/{shopcart.items[0].id}"
+        resp = self.client.get(url)
+        data, etag = resp.get_json(), resp.headers["ETag"]
+
+        resp = self.client.put(url, json={**data, "quantity": 1000}, headers={"If-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(resp.headers["ETag"], etag)
+
+        resp = self.client.put(url, json={**data, "quantity": 2000}, headers={"If-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        self.assertEqual(self.client.get(url).get_json()["quantity"], 1000)
+        resp = self.client.delete(url, headers={"If-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        resp = self.client.delete(url, headers={"If-Match": self.client.get(url).headers["ETag"]})
+        self.assertEqual(resp.status_code, status.HTTP_204_NO_CONTENT)
+
+    def test_update_item_conflict(self):
+        """It should not overwrite an Item that changed while it was updated"""
+        shopcart = self._create_shopcarts_with_items(1, item_count=1)[0]
+        item_id = shopcart.items[0].id
+        url = f"{BASE_URL}/{shopcart.id}/items/{item_id}"
+        data = self.client.get(url).get_json()
+        deserialize = Item.deserialize
+
+        def concurrent_write(item, payload):
+            # another request commits between the read and the write
+            with db.engine.begin() as connection:
+                connection.execute(
+                    update(Item.__table__)
+                    .where(Item.__table__.c.id == item_id)
+                    .values(quantity=2000, version=Item.__table__.c.version + 1)
+                )
+            return deserialize(item, payload)
+
+        with patch.object(Item, "deserialize", autospec=True, side_effect=concurrent_write):
+            resp = self.client.put(url, json={**data, "quantity": 1000})
+        self.assertEqual(resp.status_code, status.HTTP_409_CONFLICT)
+        self.assertIn("changed by another request", resp.get_json()["message"])
+        db.session.expire_all()
+        self.assertEqual(self.client.get(url).get_json()["quantity"], 2000)
+
     def test_update_item(self):
         """It should Update an Item in a shopcart"""
         # create a item
@@ -470,6 +1017,175 @@ class TestShopcartService(TestCase):
         self.assertEqual(len(data), 1)
         self.assertEqual(int(data[0]["quantity"]), 5)
 
+    def test_list_items_with_range_filters(self):
+        """It should List the items of a Shopcart within a price or quantity range"""
+        shopcart = self._create_shopcarts(1)[0]
+        for quantity, price in [(1, 100), (5, 200), (10, 300)]:
+            item = ItemFactory(shopcart_id=shopcart.id, quantity=quantity, price=price)
+            resp = self.client.post(f"{BASE_URL}/{shopcart.id}/items", json=item.serialize())
+            self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+
+        resp = self.client.get(f"{BASE_URL}/{shopcart.id}/items?price_min=150&price_max=300")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual([item["price"] for item in resp.get_json()], [200, 300])
+
+        resp = self.client.get(f"{BASE_URL}/{shopcart.id}/items?quantity_gte=5&price_max=200")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual([item["quantity"] for item in resp.get_json()], [5])
+
+        resp = self.client.get(f"{BASE_URL}/{shopcart.id}/items?price_min=cheap")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_list_items_not_found(self):
+        """It should not List the items of a Shopcart that does not exist"""
+        resp = self.client.get(f"{BASE_URL}/0/items")
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    # ----------------------------------------------------------
+    # TEST BATCH
+    # ----------------------------------------------------------
+    def test_add_items_batch(self):
+        """It should add a batch of Items to a Shopcart with one INSERT"""
+        shopcart = self._create_shopcarts(1)[0]
+        items = [ItemFactory(id=None, shopcart=None).serialize() for _ in range(5)]
+        with count_queries() as statements:
+            resp = self.client.post(f"{BASE_URL}/{shopcart.id}/items:batch", json=items)
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        inserts = [sql for sql in statements if sql.startswith("INSERT")]
+        self.assertEqual(len(inserts), 1)
+
+        data = resp.get_json()
+        self.assertEqual(data["errors"], [])
+        self.assertEqual(len(data["items"]), 5)
+        for created, item in zip(data["items"], items):
+            self.assertIsNotNone(created["id"])
+            self.assertEqual(created["shopcart_id"], shopcart.id)
+            self.assertEqual(created["description"], item["description"])
+
+        resp = self.client.get(f"{BASE_URL}/{shopcart.id}")
+        self.assertEqual(len(resp.get_json()["items"]), 5)
+
+    def test_add_items_batch_atomic(self):
+        """It should reject the whole batch when an Item is not valid"""
+        shopcart = self._create_shopcarts(1)[0]
+        items = [ItemFactory(id=None, shopcart=None).serialize() for _ in range(3)]
+        items[1]["quantity"] = "many"
+        items[2] = "not an item"
+        resp = self.client.post(f"{BASE_URL}/{shopcart.id}/items:batch", json=items)
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        data = resp.get_json()
+        self.assertEqual(data["items"], [])
+        self.assertEqual([error["index"] for error in data["errors"]], [1, 2])
+
+        resp = self.client.get(f"{BASE_URL}/{shopcart.id}/items")
+        self.assertEqual(resp.get_json(), [])
+
+    def test_add_items_batch_partial(self):
+        """It should add the valid Items of a batch and report the others"""
+        shopcart = self._create_shopcarts(1)[0]
+        items = [ItemFactory(id=None, shopcart=None).serialize() for _ in range(3)]
+        del items[0]["description"]
+        resp = self.client.post(
+            f"{BASE_URL}/{shopcart.id}/items:batch?atomic=false", json=items
+        )
+        self.assertEqual(resp.status_code, status.HTTP_207_MULTI_STATUS)
+        data = resp.get_json()
+        self.assertEqual(len(data["items"]), 2)
+        self.assertEqual(data["errors"][0]["index"], 0)
+        self.assertIn("description", data["errors"][0]["message"])
+
+    def test_add_items_batch_repeated_products(self):
+        """It should report the products that a batch repeats or the Shopcart already holds"""
+        shopcart = self._create_shopcarts_with_items(1, item_count=1)[0]
+        held = shopcart.items[0].serialize()
+        new = [ItemFactory(id=None, shopcart=None).serialize() for _ in range(2)]
+        items = [held, new[0], new[0], new[1]]
+        url = f"{BASE_URL}/{shopcart.id}/items:batch"
+
+        resp = self.client.post(url, json=[held, new[1]])
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        data = resp.get_json()
+        self.assertEqual([error["index"] for error in data["errors"]], [0])
+        self.assertIn("already in the Shopcart", data["errors"][0]["message"])
+        self.assertEqual(len(self.client.get(f"{url[:-6]}").get_json()), 1)
+
+        resp = self.client.post(f"{url}?atomic=false", json=items)
+        self.assertEqual(resp.status_code, status.HTTP_207_MULTI_STATUS)
+        data = resp.get_json()
+        self.assertEqual([item["item_id"] for item in data["items"]], [str(new[0]["item_id"]), str(new[1]["item_id"])])
+        self.assertEqual([error["index"] for error in data["errors"]], [0, 2])
+        self.assertIn("repeated from index 1", data["errors"][1]["message"])
+        self.assertNotIn("INSERT", resp.get_data(as_text=True))
+        self.assertEqual(len(self.client.get(f"{url[:-6]}").get_json()), 3)
+
+    def test_add_items_batch_bad_request(self):
+        """It should not add a batch that is not a list or is too large"""
+        shopcart = self._create_shopcarts(1)[0]
+        resp = self.client.post(f"{BASE_URL}/{shopcart.id}/items:batch", json={"items": []})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+        items = [ItemFactory(id=None, shopcart=None).serialize() for _ in range(3)]
+        max_batch_size = app.config["MAX_BATCH_SIZE"]
+        app.config["MAX_BATCH_SIZE"] = 2
+        try:
+            resp = self.client.post(f"{BASE_URL}/{shopcart.id}/items:batch", json=items)
+        finally:
+            app.config["MAX_BATCH_SIZE"] = max_batch_size
+        self.assertEqual(resp.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+        resp = self.client.post(f"{BASE_URL}/0/items:batch", json=items)
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    # ----------------------------------------------------------
+    # TEST IMPORT
+    # ----------------------------------------------------------
+    def test_import_shopcarts(self):
+        """It should import Shopcarts from an NDJSON body"""
+        records = [
+            {"id": 7, "name": "Ann", "items": [ItemFactory(id=None, shopcart=None).serialize()]},
+            {"id": 8, "name": "Bob", "items": []},
+        ]
+        body = "\n".join(json.dumps(record) for record in records)
+        with patch.dict(app.config, {"ADMIN_API_TOKEN": "secret"}):
+            resp = self.client.post(
+                "/api/admin/shopcarts:import?source=legacy&batch_size=1",
+                data=body,
+                content_type="application/x-ndjson",
+                headers={"Authorization": "Bearer secret"},
+            )
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual(data, {"shopcarts": 2, "items": 1, "skipped": 0, "checkpoint": 2})
+
+        resp = self.client.get(f"{BASE_URL}?name=Ann")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(resp.get_json()[0]["items"]), 1)
+
+    def test_import_shopcarts_bad_request(self):
+        """It should not import Shopcarts that are not valid"""
+        with patch.dict(app.config, {"ADMIN_API_TOKEN": "secret"}):
+            resp = self.client.post(
+                "/api/admin/shopcarts:import?source=legacy&format=csv",
+                data="id,name\n1\n",
+                content_type="text/csv",
+                headers={"Authorization": "Bearer secret"},
+            )
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_import_shopcarts_unauthorized(self):
+        """It should only import Shopcarts for the holder of the admin token"""
+        url = "/api/admin/shopcarts:import?source=legacy"
+        body = json.dumps({"id": 7, "name": "Ann", "items": []})
+        resp = self.client.post(url, data=body, headers={"Authorization": "Bearer secret"})
+        self.assertEqual(resp.status_code, status.HTTP_403_FORBIDDEN)
+
+        with patch.dict(app.config, {"ADMIN_API_TOKEN": "secret"}):
+            for headers in ({}, {"Authorization": "Bearer guess"}, {"Authorization": "Basic c2VjcmV0Og=="}):
+                resp = self.client.post(url, data=body, headers=headers)
+                self.assertEqual(resp.status_code, status.HTTP_401_UNAUTHORIZED, headers)
+                self.assertEqual(resp.headers["WWW-Authenticate"], "Bearer")
+        self.assertEqual(Shopcart.all(), [])
+
     ######################################################################
     #  A C T I O N S   T E S T   C A S E S
     ######################################################################
@@ -515,6 +1231,43 @@ class TestShopcartService(TestCase):
         data = resp.get_json()
         self.assertEqual(len(data), 0)
 
+    def test_clear_shopcart_query_count(self):
+        """It should Clear a Shopcart with the same number of queries for any size"""
+        small = self._create_shopcarts_with_items(1, item_count=2)[0].id
+        large = self._create_shopcarts_with_items(1, item_count=20)[0].id
+        with count_queries() as statements:
+            resp = self.client.put(f"{BASE_URL}/{small}/clear")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json()["items"], [])
+
+        with count_queries() as large_statements:
+            resp = self.client.put(f"{BASE_URL}/{large}/clear")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json()["items"], [])
+        self.assertEqual(len(large_statements), len(statements))
+        deletes = [sql for sql in large_statements if sql.startswith("DELETE")]
+        self.assertEqual(len(deletes), 1)
+
+    def test_clear_shopcart_changed_meanwhile(self):
+        """It should not Clear a Shopcart that another request changes after its ETag is checked"""
+        shopcart = self._create_shopcarts_with_items(1, item_count=2)[0]
+        url = f"{BASE_URL}/{shopcart.id}"
+        etag = self.client.get(url).headers["ETag"]
+        clear = Shopcart.clear
+
+        def racing_clear(cart):
+            with db.engine.begin() as connection:
+                table = Shopcart.__table__
+                connection.execute(update(table).where(table.c.id == cart.id).values(version=table.c.version + 1))
+            clear(cart)
+
+        with patch.object(Shopcart, "clear", racing_clear):
+            resp = self.client.put(f"{url}/clear", headers={"If-Match": etag})
+            self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+            resp = self.client.put(f"{url}/clear")
+            self.assertEqual(resp.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(len(self.client.get(f"{url}/items").get_json()), 2)
+
     def test_clear_nonexistent_shopcart(self):
         """Request clear for a nonexistent shopcart will get error 404"""
 
@@ -625,3 +1378,42 @@ class TestShopcartService(TestCase):
 
         expected_total_price = 10 + 20 + 30
         self.assertEqual(data["total_price"], expected_total_price)
+
+    ######################################################################
+    #  S Q L   B U D G E T   T E S T   C A S E S
+    ######################################################################
+
+    def test_query_budgets(self):
+        """It should keep every resource within its SQL budget"""
+        shopcart = self._create_shopcarts_with_items(1, item_count=3)[0]
+        url = f"{BASE_URL}/{shopcart.id}"
+        item = ItemFactory(id=None, shopcart=None)
+        item_data = {**item.serialize(), "shopcart_id": shopcart.id}
+
+        self.assert_within_budget("GET", BASE_URL)
+        self.assert_within_budget("POST", BASE_URL, json=ShopcartFactory().serialize())
+        response = self.assert_within_budget("GET", url)
+        self.assert_within_budget("GET", url, headers={"If-None-Match": '"shopcart-0-0"'})
+        self.assert_within_budget("GET", url, headers={"If-None-Match": response.headers["ETag"]})
+        self.assert_within_budget("PUT", url, json=response.get_json())
+        self.assert_within_budget("GET", f"{url}/calculate_total_price")
+
+        response = self.assert_within_budget("POST", f"{url}/items", json=item_data)
+        item_url = f"{url}/items/{response.get_json()['id']}"
+        self.assert_within_budget("GET", f"{url}/items?quantity_gte=1")
+        response = self.assert_within_budget("GET", item_url)
+        self.assert_within_budget("PUT", item_url, json=response.get_json())
+        self.assert_within_budget("DELETE", item_url)
+        self.assert_within_budget("POST", f"{url}/items:batch", json=[item_data, item_data])
+
+        self.assert_within_budget("PUT", f"{url}/clear")
+        self.assert_within_budget("DELETE", url)
+
+    def test_query_count_header(self):
+        """It should report the SQL statements of a request in a header"""
+        shopcart = self._create_shopcarts_with_items(1)[0]
+        resp = self.client.get(f"{BASE_URL}/{shopcart.id}/calculate_total_price")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assert_query_count(resp, 1)
+        resp = self.client.get("/health")
+        self.assert_query_count(resp, 0)
@@ -6,8 +6,11 @@ import logging
 import os
 from unittest import TestCase
 from unittest.mock import patch
+from sqlalchemy import select, text, update
+from sqlalchemy.orm.exc import StaleDataError
 from wsgi import app
 from service.models import Shopcart, Item, DataValidationError, db
+from service.models.shopcart import has_trigrams, trigrams
 from tests.factories import ShopcartFactory, ItemFactory
 
 DATABASE_URI = os.getenv(
@@ -160,6 +163,120 @@ class TestShopcart(TestCase):
         self.assertEqual(same_shopcart.id, shopcart.id)
         self.assertEqual(same_shopcart.name, shopcart.name)
 
+    def test_find_columns(self):
+        """It should Find some columns of a Shopcart without its items"""
+        shopcart = ShopcartFactory()
+        shopcart.items.append(ItemFactory(id=None))
+        shopcart.create()
+
+        row = Shopcart.find_columns(shopcart.id, "id", "name", "item_count")
+        self.assertEqual(tuple(row), (shopcart.id, shopcart.name, 1))
+        self.assertIsNone(Shopcart.find_columns(0, "id"))
+        rows = Shopcart.find_by_name(shopcart.name, Shopcart.select_columns("id")).all()
+        self.assertEqual([row.id for row in rows], [shopcart.id])
+
+    def test_find_with_items(self):
+        """It should Find a Shopcart with its items loaded"""
+        shopcart = ShopcartFactory()
+        shopcart.items.append(ItemFactory(id=None))
+        shopcart.create()
+        shopcart_id = shopcart.id
+        db.session.expunge_all()
+
+        found = Shopcart.find_with_items(shopcart_id)
+        self.assertIn("items", found.__dict__)
+        self.assertEqual(len(found.items), 1)
+
+    def test_paginate_shopcarts(self):
+        """It should return a page of Shopcarts and the next cursor"""
+        shopcarts = ShopcartFactory.create_batch(3)
+        for shopcart in shopcarts:
+            shopcart.create()
+
+        page, cursor = Shopcart.paginate(Shopcart.query, 2)
+        self.assertEqual([s.id for s in page], [s.id for s in shopcarts[:2]])
+        self.assertEqual(cursor, shopcarts[1].id)
+
+        page, cursor = Shopcart.paginate(Shopcart.query, 2, cursor)
+        self.assertEqual([s.id for s in page], [shopcarts[2].id])
+        self.assertIsNone(cursor)
+
+    def test_search_by_name(self):
+        """It should search Shopcarts by name, best matches first"""
+        for name in ("Bob Alison", "alicia keys", "Alice Smith", "Carl", "al_ice 100%"):
+            ShopcartFactory(name=name).create()
+
+        def search(query, match):
+            return [shopcart.name for shopcart in Shopcart.search_by_name(query, match)]
+
+        self.assertEqual(search("ALI", "prefix"), ["alicia keys", "Alice Smith"])
+        self.assertEqual(search(" ali ", "substring"), ["alicia keys", "Alice Smith", "Bob Alison"])
+        self.assertEqual(search("alise", "fuzzy")[0], "Bob Alison")
+        self.assertNotIn("Carl", search("alise", "fuzzy"))
+        # the wildcards of LIKE are plain text
+        self.assertEqual(search("_ice", "substring"), ["al_ice 100%"])
+        self.assertEqual(search("0%", "substring"), ["al_ice 100%"])
+        self.assertRaises(DataValidationError, Shopcart.search_by_name, "ali", "regex")
+
+    def test_search_with_trigram_index(self):
+        """It should rank fuzzy matches by similarity when the database has pg_trgm"""
+        self.assertEqual(trigrams("alice"), ["ali", "ice", "lic"])
+        self.assertEqual(trigrams("al"), ["al"])
+        installed = db.engine.dialect.name == "postgresql" and db.session.execute(
+            text("SELECT count(*) FROM pg_extension WHERE extname = 'pg_trgm'")
+        ).scalar() == 1
+        self.assertIs(has_trigrams(db.session), installed)
+        criterion, ranking = Shopcart.name_search("Alice", "fuzzy", "postgresql", trigram_index=True)
+        sql = str(select(Shopcart.id).where(criterion).order_by(*ranking))
+        self.assertIn("lower(shopcart.name) % :lower_1", sql)
+        self.assertIn("similarity(lower(shopcart.name), :similarity_1) DESC", sql)
+
+    def test_paginate_offset(self):
+        """It should page through ranked Shopcarts by their position"""
+        for name in ("ab", "abc", "abcd"):
+            ShopcartFactory(name=name).create()
+        query = Shopcart.search_by_name("ab", "prefix")
+        page, cursor = Shopcart.paginate_offset(query, 2)
+        self.assertEqual([s.name for s in page], ["ab", "abc"])
+        self.assertEqual(cursor, 2)
+        page, cursor = Shopcart.paginate_offset(query, 2, cursor)
+        self.assertEqual([s.name for s in page], ["abcd"])
+        self.assertIsNone(cursor)
+
+    def test_clear_a_shopcart(self):
+        """It should Clear all of the items of a Shopcart"""
+        shopcart = ShopcartFactory()
+        for item in ItemFactory.create_batch(3):
+            shopcart.items.append(item)
+        shopcart.create()
+        other = ShopcartFactory()
+        other.items.append(ItemFactory())
+        other.create()
+
+        shopcart.clear()
+        self.assertEqual(shopcart.items, [])
+        self.assertEqual(Item.find_by_shopcart_id(shopcart.id).count(), 0)
+        self.assertEqual(Item.find_by_shopcart_id(other.id).count(), 1)
+
+    def test_clear_shopcart_failed(self):
+        """It should not Clear a Shopcart on database error"""
+        shopcart = ShopcartFactory()
+        shopcart.create()
+        with patch("service.models.db.session.commit", side_effect=Exception()):
+            self.assertRaises(DataValidationError, shopcart.clear)
+
+    def test_clear_a_changed_shopcart(self):
+        """It should not Clear a Shopcart that changed since it was read"""
+        shopcart = ShopcartFactory()
+        shopcart.items.append(ItemFactory(id=None, shopcart=None))
+        shopcart.create()
+        read = shopcart.version
+        # another request writes the Shopcart after it was read
+        with db.engine.begin() as connection:
+            connection.execute(update(Shopcart.__table__).values(version=read + 1).where(Shopcart.id == shopcart.id))
+        self.assertRaises(StaleDataError, shopcart.clear)
+        self.assertEqual(Item.find_by_shopcart_id(shopcart.id).count(), 1)
+
     def test_serialize_a_shopcart(self):
         """It should Serialize a Shopcart"""
         shopcart = Shopcart()
@@ -226,20 +343,68 @@ class TestShopcart(TestCase):
 
         total_price = Shopcart.calculate_total_price(shopcart.id)
         self.assertEqual(total_price, test_total_price)
+        self.assertIsNone(Shopcart.calculate_total_price(0))
+
+    def test_totals_follow_item_changes(self):
+        """It should keep the totals in step with the items"""
+        shopcart = ShopcartFactory()
+        shopcart.items.append(ItemFactory(id=None, quantity=2, price=100))
+        shopcart.items.append(ItemFactory(id=None, quantity=1, price=50))
+        shopcart.create()
+        self.assertEqual(shopcart.total_price, 250)
+        self.assertEqual(shopcart.item_count, 2)
+
+        # add, update and delete single items
+        item = ItemFactory(id=None, shopcart=shopcart, quantity=3, price=10)
+        item.create()
+        self.assertEqual((shopcart.total_price, shopcart.item_count), (280, 3))
+        item.quantity = 5
+        item.update()
+        self.assertEqual((shopcart.total_price, shopcart.item_count), (300, 3))
+        item.delete()
+        self.assertEqual((shopcart.total_price, shopcart.item_count), (250, 2))
+
+        # move an item to another shopcart
+        other = ShopcartFactory()
+        other.create()
+        moved = shopcart.items[0]
+        moved.shopcart_id = other.id
+        moved.update()
+        self.assertEqual((shopcart.total_price, shopcart.item_count), (50, 1))
+        self.assertEqual((other.total_price, other.item_count), (200, 1))
+
+        shopcart.clear()
+        self.assertEqual((shopcart.total_price, shopcart.item_count), (0, 0))
+        other.delete()
+        self.assertEqual(Shopcart.all(), [shopcart])
+
+    def test_reconcile_totals(self):
+        """It should find and repair drifted totals"""
+        shopcart = ShopcartFactory()
+        shopcart.items.append(ItemFactory(quantity=2, price=100))
+        shopcart.create()
+        empty = ShopcartFactory()
+        empty.create()
+        self.assertEqual(Shopcart.reconcile_totals(), [])
+
+        db.session.execute(update(Shopcart).values(total_price=999, item_count=7))
+        db.session.commit()
+        drifted = Shopcart.reconcile_totals()
+        self.assertEqual([row["id"] for row in drifted], [shopcart.id, empty.id])
+        self.assertEqual(drifted[0]["total_price"], 999)
+        self.assertEqual(drifted[0]["actual_total_price"], 200)
+        self.assertEqual(drifted[1]["actual_item_count"], 0)
+
+        self.assertEqual(len(Shopcart.reconcile_totals(repair=True)), 2)
+        self.assertEqual(Shopcart.reconcile_totals(), [])
+        self.assertEqual((shopcart.total_price, shopcart.item_count), (200, 1))
+        self.assertEqual((empty.total_price, empty.item_count), (0, 0))
 
-    # def test_total_price_selected(self):
-    #     """It should total price selected"""
-    #     shopcart = ShopcartFactory()
-    #     item1 = ItemFactory()
-    #     shopcart.items.append(item1)
-    #     item2 = ItemFactory()
-    #     shopcart.items.append(item2)
-    #     item3 = ItemFactory()
-    #     shopcart.items.append(item3)
-    #     shopcart.create()
-    #     test_total_price = item1.price * item1.quantity + item3.price * item3.quantity
-
-    #     total_price = Shopcart.calculate_selected_items_price(
-    #         shopcart.id, [int(item1.item_id), int(item3.item_id)]
-    #     )
-    #     self.assertEqual(total_price, test_total_price)
+    @patch("service.models.db.session.commit")
+    def test_reconcile_totals_failed(self, exception_mock):
+        """It should not repair the totals on database error"""
+        shopcart = ShopcartFactory()
+        shopcart.create()
+        db.session.execute(update(Shopcart).values(item_count=7))
+        exception_mock.side_effect = Exception()
+        self.assertRaises(DataValidationError, Shopcart.reconcile_totals, True)
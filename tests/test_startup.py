@@ -0,0 +1,66 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Test cases for the Startup of the Service
+"""
+
+import os
+import subprocess
+import sys
+import time
+from unittest import TestCase
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# nothing listens on the discard port, so every connection is refused
+UNREACHABLE_DATABASE = "postgresql+psycopg://postgres@127.0.0.1:9/postgres"
+
+# Most seconds that a new process may take to import wsgi.py
+IMPORT_BUDGET = 5
+
+BOOT = "import wsgi; from service import api; print(api._schema is None)"
+
+
+def boot(**env) -> subprocess.CompletedProcess:
+    """Imports wsgi.py in a new interpreter"""
+    env = dict(os.environ, PYTHONPATH=ROOT, DATABASE_URI=UNREACHABLE_DATABASE, **env)
+    return subprocess.run(
+        [sys.executable, "-c", BOOT], cwd=ROOT, env=env, capture_output=True, text=True, check=False
+    )
+
+
+######################################################################
+#  S T A R T U P   T E S T   C A S E S
+######################################################################
+class TestStartup(TestCase):
+    """Startup Tests"""
+
+    def test_boot_without_database(self):
+        """It should start within the budget without reaching the database"""
+        started = time.monotonic()
+        result = boot(DB_CREATE_TABLES="false")
+        elapsed = time.monotonic() - started
+        self.assertEqual(result.returncode, 0, result.stderr)
+        # the Swagger spec is only built when it is first requested
+        self.assertEqual(result.stdout.strip(), "True")
+        self.assertLess(elapsed, IMPORT_BUDGET)
+
+    def test_boot_creating_tables(self):
+        """It should stop gunicorn from respawning when it cannot create the tables"""
+        result = boot(DB_CREATE_TABLES="true")
+        self.assertEqual(result.returncode, 4)
+        self.assertIn("Cannot continue", result.stderr + result.stdout)
@@ -0,0 +1,140 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Test cases for the Write Coalescing
+"""
+
+# pylint: disable=duplicate-code
+import logging
+import time
+from unittest import TestCase
+from unittest.mock import patch
+from sqlalchemy import select
+from wsgi import app
+from service.common.write_coalescing import QuantityBuffer
+from service.models import db, Shopcart, Item
+from tests.factories import ShopcartFactory, ItemFactory
+
+
+def stored_quantities() -> dict:
+    """Returns the quantities in the database by Item id"""
+    with db.engine.connect() as connection:
+        return dict(connection.execute(select(Item.id, Item.quantity)).all())
+
+
+######################################################################
+#  W R I T E   C O A L E S C I N G   T E S T   C A S E S
+######################################################################
+class TestQuantityBuffer(TestCase):
+    """Quantity Buffer Tests"""
+
+    @classmethod
+    def setUpClass(cls):
+        """Run once before all tests"""
+        app.config["TESTING"] = True
+        app.logger.setLevel(logging.CRITICAL)
+        app.app_context().push()
+
+    def setUp(self):
+        """Creates two Shopcarts with two Items each"""
+        db.session.query(Shopcart).delete()
+        db.session.commit()
+        self.shopcarts = []
+        for _ in range(2):
+            shopcart = ShopcartFactory(id=None)
+            shopcart.items.extend(ItemFactory(id=None, shopcart=None) for _ in range(2))
+            shopcart.create()
+            self.shopcarts.append(shopcart)
+        self.items = [item for shopcart in self.shopcarts for item in shopcart.items]
+        self.buffer = QuantityBuffer(app)
+        app.config["QUANTITY_COALESCE_WINDOW"] = 60000
+
+    def tearDown(self):
+        """This runs after each test"""
+        self.buffer.close()
+        app.config["QUANTITY_COALESCE_WINDOW"] = 0
+        app.config["QUANTITY_COALESCE_MAX_PENDING"] = 1000
+        db.session.remove()
+
+    def put(self, item: Item, quantity: int) -> None:
+        """Buffers a quantity of an Item"""
+        self.buffer.put(item.shopcart_id, item.id, quantity)
+
+    def test_flush_by_shopcart(self):
+        """It should keep the last quantity of every Item until its Shopcart is flushed"""
+        first, second, third, _ = self.items
+        for quantity in (1000, 2000):
+            self.put(first, quantity)
+        self.put(second, 3000)
+        self.put(third, 4000)
+        self.assertTrue(self.buffer.enabled)
+        self.assertEqual(len(self.buffer), 3)
+        self.assertNotIn(2000, stored_quantities().values())
+
+        self.assertEqual(self.buffer.flush(first.shopcart_id), 2)
+        stored = stored_quantities()
+        self.assertEqual((stored[first.id], stored[second.id]), (2000, 3000))
+        self.assertNotEqual(stored[third.id], 4000)
+        self.assertEqual(self.buffer.flush(first.shopcart_id), 0)
+
+        self.assertEqual(self.buffer.flush(), 1)
+        self.assertEqual(stored_quantities()[third.id], 4000)
+        # every flush bumps the version once
+        db.session.expire_all()
+        self.assertEqual(db.session.get(Item, first.id).version, 2)
+
+    def test_flush_when_full(self):
+        """It should flush at once when the buffer holds too many Items"""
+        app.config["QUANTITY_COALESCE_MAX_PENDING"] = 2
+        self.put(self.items[0], 1000)
+        self.assertEqual(len(self.buffer), 1)
+        self.put(self.items[1], 2000)
+        self.assertEqual(len(self.buffer), 0)
+        self.assertEqual(stored_quantities()[self.items[1].id], 2000)
+
+    def test_flush_in_background(self):
+        """It should flush the buffer every window from a thread"""
+        app.config["QUANTITY_COALESCE_WINDOW"] = 20
+        self.put(self.items[0], 1000)
+        deadline = time.monotonic() + 2
+        while len(self.buffer) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(stored_quantities()[self.items[0].id], 1000)
+
+    def test_flush_on_close(self):
+        """It should write the pending quantities when the process exits"""
+        self.put(self.items[0], 1000)
+        self.buffer.close()
+        self.assertEqual(stored_quantities()[self.items[0].id], 1000)
+        self.buffer._thread.join(1)
+        self.assertFalse(self.buffer._thread.is_alive())
+
+    def test_flush_error(self):
+        """It should keep the quantities that could not be written"""
+        self.put(self.items[0], 1000)
+        with patch.object(QuantityBuffer, "_write", side_effect=RuntimeError("database is gone")):
+            self.assertEqual(self.buffer.flush(), 0)
+        self.assertEqual(len(self.buffer), 1)
+        self.assertEqual(self.buffer.flush(), 1)
+        self.assertEqual(stored_quantities()[self.items[0].id], 1000)
+
+    def test_after_fork(self):
+        """It should start empty and without a thread in a forked worker"""
+        self.put(self.items[0], 1000)
+        self.buffer._after_fork()
+        self.assertEqual(len(self.buffer), 0)
+        self.assertIsNone(self.buffer._thread)